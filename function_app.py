@@ -1,8 +1,12 @@
 """Azure Functions Python v2 app for document processing and GitHub integration.
 
-Exposes two HTTP-triggered endpoints:
-- /api/process_file: Accepts a document (base64-encoded) and returns extracted Markdown or JSON.
+Exposes HTTP-triggered endpoints:
+- /api/process_file: Accepts a document (base64 JSON, raw binary or multipart) and returns extracted Markdown or JSON.
+- /api/process_batch: Converts many base64 documents in parallel and returns per-file JSON results.
 - /api/write_to_repo: Creates or updates a text file in a specified GitHub repository.
+- /api/ingest, /api/ingest_status/{job_id}: Queue-based asynchronous convert + persist pipeline.
+- /api/should_process: Sync-manifest check so unchanged source items are skipped.
+- /api/search: BM25 full-text search over converted / written Markdown (opt-in index).
 
 Uses the new programming model (no explicit function.json needed).
 """
@@ -10,217 +14,4097 @@ Uses the new programming model (no explicit function.json needed).
 from __future__ import annotations
 
 import json
-from typing import Any, Optional
+import re
+from typing import Any, Iterator, Optional
 
 import azure.functions as func
 import os
+import asyncio
 import base64 as _b64
-import requests
 import io
+import contextlib
+import contextvars
+import functools
+import hashlib
+import inspect
+import random
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
 
 # ---------------------------------------------------------------
 # Lightweight .env support for local runs (outside `func host start`).
 # The Azure Functions host already injects settings from local.settings.json;
 # this only supplements missing keys from a developer-provided .env file.
 # We purposely avoid adding an external dependency (like python-dotenv).
+#
+# Import-time work is kept to the standard library and azure.functions:
+# cold starts on the Consumption plan pay for everything imported here.
+# Heavy packages (requests, markitdown, openai, numpy, Pillow, Azure SDKs)
+# are imported inside the functions that need them, so e.g. write_to_repo
+# never loads markitdown or openai. tests/test_import_time.py enforces it.
 # ---------------------------------------------------------------
 def _load_local_dotenv() -> None:
+    if os.getenv("WEBSITE_INSTANCE_ID"):  # hosted in Azure: settings come from the app configuration
+        return
     env_path = os.path.join(os.path.dirname(__file__), ".env")
     if not os.path.isfile(env_path):  # nothing to do
         return
     try:
-        with open(env_path, "r", encoding="utf-8") as fh:
-            for raw_line in fh:
-                line = raw_line.strip()
-                if not line or line.startswith("#") or "=" not in line:
-                    continue
-                key, value = line.split("=", 1)
-                key = key.strip()
-                value = value.strip().strip('"').strip("'")
-                # Do not override variables already present (e.g. from host / CI)
-                if key and key not in os.environ:
-                    os.environ[key] = value
-    except Exception as e:  # noqa: BLE001 - best effort only
-        print(f"[env] Skipping .env load due to error: {e}")
+        with open(env_path, "r", encoding="utf-8") as fh:
+            for raw_line in fh:
+                line = raw_line.strip()
+                if not line or line.startswith("#") or "=" not in line:
+                    continue
+                key, value = line.split("=", 1)
+                key = key.strip()
+                value = value.strip().strip('"').strip("'")
+                # Do not override variables already present (e.g. from host / CI)
+                if key and key not in os.environ:
+                    os.environ[key] = value
+    except Exception as e:  # noqa: BLE001 - best effort only
+        print(f"[env] Skipping .env load due to error: {e}")
+
+
+_load_local_dotenv()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# ---------------------------------------------------------------
+# Request timing and tracing.
+# `_stage(name)` times a step of the current request. The durations feed the
+# Server-Timing header (and `timings` in JSON responses) of HTTP handlers
+# wrapped with `_timed`. When TRACING_ENABLED is set, each stage is also an
+# OpenTelemetry span, exported to Application Insights if
+# APPLICATIONINSIGHTS_CONNECTION_STRING is configured. Outside a timed
+# request with tracing off, a stage costs a ContextVar lookup.
+# ---------------------------------------------------------------
+class _Timings:
+    """Accumulated milliseconds (and call counts) per stage for one request."""
+
+    __slots__ = ("stages",)
+
+    def __init__(self) -> None:
+        self.stages: dict[str, list[float]] = {}
+
+    def add(self, name: str, elapsed_ms: float) -> None:
+        entry = self.stages.setdefault(name, [0.0, 0])
+        entry[0] += elapsed_ms
+        entry[1] += 1
+
+    def as_dict(self) -> dict[str, float]:
+        return {name: round(total, 2) for name, (total, _count) in self.stages.items()}
+
+    def server_timing(self) -> str:
+        return ", ".join(
+            f"{name};dur={total:.1f}" + (f';desc="{int(count)} calls"' if count > 1 else "")
+            for name, (total, count) in self.stages.items()
+        )
+
+
+_current_timings: Any = contextvars.ContextVar("request_timings", default=None)
+_tracer: Any = None
+_tracer_resolved = False
+_tracer_lock = threading.Lock()
+
+
+def _get_tracer():
+    """The OpenTelemetry tracer, or None when tracing is off or unavailable."""
+    global _tracer, _tracer_resolved
+    if _tracer_resolved:
+        return _tracer
+    with _tracer_lock:
+        if not _tracer_resolved:
+            if _env_flag("TRACING_ENABLED"):
+                try:
+                    if os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
+                        from azure.monitor.opentelemetry import configure_azure_monitor  # type: ignore
+
+                        configure_azure_monitor()
+                    from opentelemetry import trace  # type: ignore
+
+                    _tracer = trace.get_tracer("enterprise-artifacts-indexing")
+                except Exception as e:  # noqa: BLE001 - tracing must never break requests
+                    print(f"[tracing] Disabled: {e}")
+                    _tracer = None
+            _tracer_resolved = True
+    return _tracer
+
+
+@contextlib.contextmanager
+def _stage(name: str, **attributes: Any) -> Iterator[None]:
+    timings = _current_timings.get()
+    tracer = _get_tracer()
+    if timings is None and tracer is None:
+        yield
+        return
+    span = tracer.start_as_current_span(name, attributes=attributes or None) if tracer else contextlib.nullcontext()
+    started = time.perf_counter()
+    try:
+        with span:
+            yield
+    finally:
+        if timings is not None:
+            timings.add(name, (time.perf_counter() - started) * 1000)
+
+
+def _request_timings() -> Optional[dict[str, float]]:
+    """Stages completed so far in the current timed request (for JSON bodies)."""
+    timings = _current_timings.get()
+    return timings.as_dict() if timings is not None else None
+
+
+def _timed(handler: Any) -> Any:
+    """Collect stage timings for an HTTP handler and return them as Server-Timing."""
+
+    if inspect.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def async_wrapper(req: func.HttpRequest) -> func.HttpResponse:
+            timings = _Timings()
+            token = _current_timings.set(timings)
+            try:
+                with _stage("total", **{"faas.name": handler.__name__}):
+                    resp = await handler(req)
+            finally:
+                _current_timings.reset(token)
+            resp.headers["Server-Timing"] = timings.server_timing()
+            return resp
+
+        return async_wrapper
+
+    @functools.wraps(handler)
+    def wrapper(req: func.HttpRequest) -> func.HttpResponse:
+        timings = _Timings()
+        token = _current_timings.set(timings)
+        try:
+            with _stage("total", **{"faas.name": handler.__name__}):
+                resp = handler(req)
+        finally:
+            _current_timings.reset(token)
+        resp.headers["Server-Timing"] = timings.server_timing()
+        return resp
+
+    return wrapper
+
+
+# ---------------------------------------------------------------
+# Blocking work in async handlers.
+# process_file and write_to_repo are coroutines: the host runs them on its
+# event loop, so awaiting GitHub calls costs no thread. Anything that blocks
+# (MarkItDown, base64 decoding, Azure Storage SDK calls) goes through
+# `_offload`, which runs it on a bounded thread pool with the request's
+# context (stage timings, image pre-processing stats) carried along.
+# ---------------------------------------------------------------
+_offload_executor: Any = None
+_offload_lock = threading.Lock()
+
+
+async def _offload(fn: Any, *args: Any) -> Any:
+    global _offload_executor
+    if _offload_executor is None:
+        with _offload_lock:
+            if _offload_executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                _offload_executor = ThreadPoolExecutor(max_workers=max(1, _env_int("HANDLER_THREADS", 16)),
+                                                       thread_name_prefix="handler")
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _offload_executor, functools.partial(context.run, fn, *args)
+    )
+
+
+# Simplified prompt for images only (avoid diagram generation for non-images now)
+_LLM_PROMPT = (
+    "If the input represents an image or visual diagram, optionally add a concise mermaid code block that approximates structural relationships. "
+    "If not appropriate, return only the extracted content with no additions."
+)
+
+
+# ---------------------------------------------------------------
+# Content-addressed conversion cache.
+# The Logic App re-sends unchanged SharePoint documents on every poll, so
+# conversion results are cached under a key derived from the upload's sha256
+# plus everything that can change the output (converter version, LLM
+# deployment and prompt). A small in-memory LRU sits in front of a bounded
+# on-disk store so results also survive worker recycles on the same instance.
+# ---------------------------------------------------------------
+def _converter_version() -> str:
+    # importlib.metadata avoids importing markitdown itself just to key the cache.
+    try:
+        from importlib.metadata import version
+
+        return version("markitdown")
+    except Exception:  # noqa: BLE001 - package metadata missing
+        return "unknown"
+
+
+def _conversion_settings(use_llm: bool, filename: str = "", content_type: Optional[str] = None) -> dict[str, Any]:
+    """Return every setting that influences conversion output for a document.
+
+    MarkItDown picks its converter from the extension and declared type, so
+    the same bytes named x.txt and x.csv must not share an entry.
+    """
+    settings: dict[str, Any] = {
+        "converter": "markitdown",
+        "converter_version": _converter_version(),
+        "use_llm": use_llm,
+        "extension": os.path.splitext(filename)[1].lower(),
+        "content_type": content_type,
+    }
+    if use_llm:
+        settings.update(
+            endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+            prompt=_LLM_PROMPT,
+            image_preprocessing=_caption_image_settings(),
+        )
+    return settings
+
+
+def _conversion_cache_key(sha256_hash: str, settings: dict[str, Any]) -> str:
+    fingerprint = json.dumps(settings, sort_keys=True)
+    return hashlib.sha256(f"{sha256_hash}\n{fingerprint}".encode("utf-8")).hexdigest()
+
+
+class _TwoTierCache:
+    """In-memory LRU in front of an optional size-bounded directory of text values.
+
+    Both tiers are bounded in bytes. The disk tier evicts least recently used
+    entries (by mtime, refreshed on read). All disk errors are swallowed: a
+    cache failure must never fail a conversion.
+    """
+
+    def __init__(self, directory: Optional[str], memory_bytes: int, disk_bytes: int):
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[str, str] = OrderedDict()
+        self._memory_used = 0
+        self._memory_limit = max(memory_bytes, 0)
+        self._disk_limit = max(disk_bytes, 0)
+        self._disk_used: Optional[int] = None  # computed lazily on first write
+        self._directory = directory if directory and self._disk_limit else None
+        if self._directory:
+            try:
+                os.makedirs(self._directory, exist_ok=True)
+            except OSError as e:
+                print(f"[cache] Disk tier disabled ({self._directory}): {e}")
+                self._directory = None
+
+    @classmethod
+    def from_env(cls) -> "_TwoTierCache":
+        if not _env_flag("CONVERSION_CACHE_ENABLED", True):
+            return cls(None, 0, 0)
+        directory = os.getenv("CONVERSION_CACHE_DIR") or os.path.join(
+            tempfile.gettempdir(), "artifacts-indexing-cache"
+        )
+        return cls(
+            directory,
+            memory_bytes=_env_int("CONVERSION_CACHE_MEMORY_MB", 64) * 1024 * 1024,
+            disk_bytes=_env_int("CONVERSION_CACHE_DISK_MB", 1024) * 1024 * 1024,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._memory_limit or self._directory)
+
+    def _path(self, key: str) -> str:
+        assert self._directory is not None
+        return os.path.join(self._directory, key[:2], f"{key}.md")
+
+    def _remember(self, key: str, value: str) -> None:
+        size = len(value.encode("utf-8"))
+        if size > self._memory_limit // 4:  # keep huge documents on disk only
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_used -= len(previous.encode("utf-8"))
+            self._memory[key] = value
+            self._memory_used += size
+            while self._memory_used > self._memory_limit and self._memory:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_used -= len(evicted.encode("utf-8"))
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                return value
+        if not self._directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                value = fh.read()
+            os.utime(path)
+        except OSError:
+            return None
+        self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        if self._memory_limit:
+            self._remember(key, value)
+        if not self._directory:
+            return
+        path = self._path(key)
+        data = value.encode("utf-8")
+        if len(data) > self._disk_limit:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[cache] Disk write failed: {e}")
+            return
+        with self._lock:
+            if self._disk_used is None:
+                self._disk_used = sum(size for _, _, size in self._scan_disk())
+            else:
+                self._disk_used += len(data)
+            if self._disk_used > self._disk_limit:
+                self._evict_disk()
+
+    def _scan_disk(self) -> list[tuple[float, str, int]]:
+        entries: list[tuple[float, str, int]] = []
+        assert self._directory is not None
+        for root, _dirs, files in os.walk(self._directory):
+            for name in files:
+                if not name.endswith(".md"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, path, st.st_size))
+        return entries
+
+    def _evict_disk(self) -> None:
+        entries = sorted(self._scan_disk())
+        used = sum(size for _, _, size in entries)
+        target = int(self._disk_limit * 0.9)  # evict in batches, not per write
+        for _, path, size in entries:
+            if used <= target:
+                break
+            try:
+                os.remove(path)
+                used -= size
+            except OSError:
+                pass
+        self._disk_used = used
+
+
+_conversion_cache = _TwoTierCache.from_env()
+
+
+# ---------------------------------------------------------------
+# Image captioning.
+# MarkItDown describes an image with one blocking
+# `llm_client.chat.completions.create(...)` call. `_CaptionClient` stands in
+# for that client:
+# - Descriptions are cached under a perceptual hash (dHash) of the image plus
+#   the prompt, deployment and endpoint, so re-encoded or resized copies of
+#   the same logo/screenshot/diagram are not described again.
+# - Concurrent requests for the same image share one in-flight call.
+# - The calls themselves run on a single background event loop with an async
+#   OpenAI client, bounded by LLM_MAX_CONCURRENCY across all requests.
+# ---------------------------------------------------------------
+def _perceptual_hash(data: bytes) -> Optional[int]:
+    """64-bit difference hash of an image, or None if it cannot be decoded."""
+    try:
+        from PIL import Image  # type: ignore
+
+        with Image.open(io.BytesIO(data)) as img:
+            pixels = img.convert("L").resize((9, 8), Image.Resampling.LANCZOS).tobytes()
+    except Exception:  # noqa: BLE001 - unknown format, Pillow missing, ...
+        return None
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def _caption_request_parts(messages: Any) -> tuple[Optional[str], Optional[bytes]]:
+    """Extract (prompt, image bytes) from MarkItDown's caption request."""
+    prompt: Optional[str] = None
+    image: Optional[bytes] = None
+    try:
+        for part in messages[0]["content"]:
+            if part.get("type") == "text":
+                prompt = part.get("text")
+            elif part.get("type") == "image_url":
+                url = part["image_url"]["url"]
+                if url.startswith("data:") and ";base64," in url:
+                    image = _b64.b64decode(url.split(";base64,", 1)[1])
+    except (LookupError, TypeError, AttributeError, ValueError):
+        return None, None
+    return prompt, image
+
+
+def _caption_image_settings() -> Optional[dict[str, Any]]:
+    """Pre-processing applied to images before captioning (None = send originals)."""
+    if not _env_flag("LLM_IMAGE_PREPROCESS", True):
+        return None
+    return {
+        "max_dimension": _env_int("LLM_IMAGE_MAX_DIMENSION", 2048),
+        "max_bytes": _env_int("LLM_MAX_IMAGE_BYTES", 2_000_000),
+        "format": (os.getenv("LLM_IMAGE_FORMAT") or "webp").lower(),
+    }
+
+
+_IMAGE_MIME = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+
+# Per-request record of the pre-processing stage (set by process_file).
+_image_preprocessing: Any = contextvars.ContextVar("image_preprocessing", default=None)
+
+
+def _prepare_caption_image(data: bytes, settings: dict[str, Any]) -> tuple[bytes, str, dict[str, Any]]:
+    """Downscale, re-encode and strip metadata from an image bound for the LLM.
+
+    Returns (bytes, mime type, stats). The originals are returned if they
+    cannot be decoded or re-encoding does not make them smaller.
+    """
+    from PIL import Image, ImageOps  # type: ignore
+
+    started = time.perf_counter()
+    fmt = settings["format"] if settings["format"] in _IMAGE_MIME else "webp"
+    with Image.open(io.BytesIO(data)) as original:
+        original_size = original.size
+        original_mime = Image.MIME.get(original.format or "", "application/octet-stream")
+        img = ImageOps.exif_transpose(original)  # bake in orientation before EXIF is dropped
+        if fmt == "jpeg" and img.mode != "RGB":
+            img = img.convert("RGBA") if "A" in img.getbands() else img.convert("RGB")
+            if img.mode == "RGBA":
+                background = Image.new("RGB", img.size, "white")
+                background.paste(img, mask=img.getchannel("A"))
+                img = background
+        elif img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGBA")
+        limit = max(settings["max_dimension"], 64)
+        if max(img.size) > limit:
+            img.thumbnail((limit, limit), Image.Resampling.LANCZOS)
+        quality = 85
+        while True:
+            out = io.BytesIO()
+            # No exif/icc arguments: metadata is not carried over.
+            img.save(out, "PNG" if fmt == "png" else fmt.upper(), quality=quality, optimize=True)
+            encoded = out.getvalue()
+            if len(encoded) <= settings["max_bytes"] or max(img.size) <= 256:
+                break
+            if fmt != "png" and quality > 55:
+                quality -= 15
+            else:
+                img = img.resize((max(img.width * 3 // 4, 1), max(img.height * 3 // 4, 1)), Image.Resampling.LANCZOS)
+
+    if len(encoded) >= len(data):
+        encoded, mime, sent_size = data, original_mime, original_size
+    else:
+        mime, sent_size = _IMAGE_MIME[fmt], img.size
+    stats = {
+        "original_bytes": len(data),
+        "sent_bytes": len(encoded),
+        "original_size": list(original_size),
+        "sent_size": list(sent_size),
+        "format": mime,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    return encoded, mime, stats
+
+
+def _with_caption_image(messages: Any, image: bytes, mime: str) -> Any:
+    """Copy of MarkItDown's caption request with the image replaced."""
+    uri = f"data:{mime};base64,{_b64.b64encode(image).decode('ascii')}"
+    content = [
+        {"type": "image_url", "image_url": {**part["image_url"], "url": uri}} if part.get("type") == "image_url" else part
+        for part in messages[0]["content"]
+    ]
+    return [{**messages[0], "content": content}, *messages[1:]]
+
+
+class _CaptionCache:
+    """Descriptions keyed on (settings scope, perceptual hash).
+
+    Exact hash matches go through the shared conversion cache (memory + disk)
+    and a bounded in-process index. The index also answers near-duplicates
+    whose hashes differ by at most CAPTION_PHASH_MAX_DISTANCE bits. Those are
+    found through band buckets rather than a scan: with d + 1 bands, two
+    hashes within d bits agree exactly on at least one band.
+    """
+
+    def __init__(self, store: _TwoTierCache, max_distance: int, max_entries: int = 4096):
+        self._store = store
+        self._max_distance = min(max(max_distance, 0), 63)
+        self._max_entries = max_entries
+        self._index: OrderedDict[tuple[str, int], str] = OrderedDict()
+        self._buckets: dict[tuple[str, int, int], set[int]] = {}
+        bands = self._max_distance + 1
+        self._band_width = -(-64 // bands)
+        self._bands = -(-64 // self._band_width)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(scope: str, phash: int) -> str:
+        return hashlib.sha256(f"caption\n{scope}\n{phash:016x}".encode("utf-8")).hexdigest()
+
+    def _band_keys(self, scope: str, phash: int) -> list[tuple[str, int, int]]:
+        mask = (1 << self._band_width) - 1
+        return [(scope, band, (phash >> (band * self._band_width)) & mask) for band in range(self._bands)]
+
+    def get(self, scope: str, phash: int) -> Optional[str]:
+        with self._lock:
+            text = self._index.get((scope, phash))
+            if text is not None:
+                self._index.move_to_end((scope, phash))
+                return text
+        if self._store.enabled:
+            text = self._store.get(self._key(scope, phash))
+            if text is not None:
+                return text
+        if not self._max_distance:
+            return None
+        with self._lock:
+            candidates = set().union(*(self._buckets.get(key, ()) for key in self._band_keys(scope, phash)))
+            best = min(candidates, key=lambda entry: bin(entry ^ phash).count("1"), default=None)
+            if best is None or bin(best ^ phash).count("1") > self._max_distance:
+                return None
+            self._index.move_to_end((scope, best))
+            return self._index[(scope, best)]
+
+    def put(self, scope: str, phash: int, text: str) -> None:
+        if self._store.enabled:
+            self._store.put(self._key(scope, phash), text)
+        with self._lock:
+            if (scope, phash) not in self._index and self._max_distance:
+                for key in self._band_keys(scope, phash):
+                    self._buckets.setdefault(key, set()).add(phash)
+            self._index[(scope, phash)] = text
+            self._index.move_to_end((scope, phash))
+            while len(self._index) > self._max_entries:
+                (old_scope, old_hash), _text = self._index.popitem(last=False)
+                if self._max_distance:
+                    for key in self._band_keys(old_scope, old_hash):
+                        bucket = self._buckets.get(key)
+                        if bucket is not None:
+                            bucket.discard(old_hash)
+                            if not bucket:
+                                del self._buckets[key]
+
+_caption_cache = _CaptionCache(_conversion_cache, max_distance=_env_int("CAPTION_PHASH_MAX_DISTANCE", 4))
+
+
+class _CaptionWorker:
+    """Runs async chat completions on a private event loop thread with bounded concurrency."""
+
+    def __init__(self, client_factory: Any, concurrency: int):
+        self._client_factory = client_factory
+        self._concurrency = max(concurrency, 1)
+        self._lock = threading.Lock()
+        self._loop: Any = None
+        self._client: Any = None
+        self._semaphore: Any = None
+
+    def _ensure_started(self) -> None:
+        if self._loop is not None:
+            return
+        with self._lock:
+            if self._loop is not None:
+                return
+            import asyncio
+
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="caption-worker", daemon=True).start()
+            self._client = self._client_factory()
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+            self._loop = loop
+
+    async def _describe(self, model: Optional[str], messages: Any) -> Optional[str]:
+        async with self._semaphore:
+            response = await self._client.chat.completions.create(model=model, messages=messages)
+        return response.choices[0].message.content
+
+    def submit(self, model: Optional[str], messages: Any):
+        """Schedule a caption call; returns a concurrent.futures.Future."""
+        import asyncio
+
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(self._describe(model, messages), self._loop)
+
+
+class _CaptionClient:
+    """Drop-in for the `llm_client` MarkItDown uses to caption images."""
+
+    def __init__(self, client_factory: Any, endpoint: Optional[str] = None,
+                 concurrency: Optional[int] = None, cache: Optional[_CaptionCache] = None):
+        from types import SimpleNamespace
+
+        self._endpoint = endpoint
+        self._worker = _CaptionWorker(client_factory, concurrency or _env_int("LLM_MAX_CONCURRENCY", 4))
+        self._cache = cache if cache is not None else _caption_cache
+        self._inflight: dict[tuple[str, int], Any] = {}
+        self._inflight_lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    @staticmethod
+    def _completion(text: Optional[str]) -> Any:
+        from types import SimpleNamespace
+
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+    @staticmethod
+    def _preprocess(messages: Any, image: Optional[bytes], settings: Optional[dict[str, Any]]) -> Any:
+        if image is None or settings is None:
+            return messages
+        try:
+            with _stage("image_preprocess"):
+                data, mime, stats = _prepare_caption_image(image, settings)
+        except Exception as e:  # noqa: BLE001 - never fail a caption over pre-processing
+            print(f"[caption] Image pre-processing skipped: {e}")
+            return messages
+        recorded = _image_preprocessing.get()
+        if recorded is not None:
+            recorded.append(stats)
+        return _with_caption_image(messages, data, mime)
+
+    def _result(self, future: Any, backend: str, record: bool) -> Optional[str]:
+        """Wait for a caption at most LLM_TIMEOUT_SECONDS; the caller that owns the call feeds the breaker."""
+        try:
+            text = future.result(timeout=max(_env_int("LLM_TIMEOUT_SECONDS", 60), 1))
+        except TimeoutError:
+            future.cancel()
+            failure = _ConversionFailure("LLMTimeout", backend)
+            if record:
+                _circuit_breaker.record(backend, failure)
+            raise failure from None
+        except Exception as e:
+            if record:
+                _circuit_breaker.record(backend, e)
+            raise
+        if record:
+            _circuit_breaker.record(backend)
+        return text
+
+    def _create(self, model: Optional[str] = None, messages: Any = None, **_kwargs: Any) -> Any:
+        prompt, image = _caption_request_parts(messages)
+        settings = _caption_image_settings()
+        phash = _perceptual_hash(image) if image is not None else None
+        backend = f"llm:{self._endpoint}/{model}"
+        if phash is None:  # not decodable, so nothing to dedupe or shrink either
+            _circuit_breaker.check(backend)
+            with _stage("llm", **{"gen_ai.request.model": model or ""}):
+                return self._completion(self._result(self._worker.submit(model, messages), backend, True))
+
+        scope = json.dumps(
+            {"prompt": prompt, "deployment": model, "endpoint": self._endpoint, "preprocess": settings},
+            sort_keys=True,
+        )
+        text = self._cache.get(scope, phash)
+        if text is not None:
+            return self._completion(text)
+
+        with self._inflight_lock:
+            future = self._inflight.get((scope, phash))
+            owner = future is None
+        if owner:
+            _circuit_breaker.check(backend)
+            request = self._preprocess(messages, image, settings)
+            with self._inflight_lock:
+                future = self._inflight.get((scope, phash))
+                owner = future is None
+                if owner:
+                    future = self._worker.submit(model, request)
+                self._inflight[(scope, phash)] = future
+        try:
+            with _stage("llm", **{"gen_ai.request.model": model or ""}):
+                text = self._result(future, backend, owner)
+            if owner and text:
+                # Cache before leaving the in-flight table so no caller sees neither.
+                self._cache.put(scope, phash, text)
+        finally:
+            if owner:
+                with self._inflight_lock:
+                    self._inflight.pop((scope, phash), None)
+        return self._completion(text)
+
+# ---------------------------------------------------------------
+# Converter registry.
+# Building MarkItDown (and, for images, an AzureOpenAI client with its own
+# connection pool) is far more expensive than a small conversion, so each
+# variant is built once per process and shared by all requests. MarkItDown
+# converters keep no per-call state and the OpenAI client is thread-safe.
+# The LLM variant is rebuilt when any AZURE_OPENAI_* setting changes.
+# ---------------------------------------------------------------
+def _azure_openai_settings() -> tuple[Optional[str], ...]:
+    return (
+        os.getenv("AZURE_OPENAI_ENDPOINT"),
+        os.getenv("AZURE_OPENAI_API_KEY"),
+        os.getenv("AZURE_OPENAI_DEPLOYMENT"),
+        os.getenv("AZURE_OPENAI_API_VERSION"),
+    )
+
+
+def _is_image(fname: str, ctype: Optional[str]) -> bool:
+    if ctype and ctype.startswith("image/"):
+        return True
+    fname_lower = fname.lower()
+    return any(fname_lower.endswith(ext) for ext in (".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp", ".tiff"))
+
+
+def _build_markitdown_with_optional_llm(use_llm: bool):
+    """Return a new MarkItDown instance (callers should go through ``_converters``).
+
+    If use_llm=True and Azure/OpenAI env vars are present, attempt to enable LLM enrichment.
+    Falls back silently if anything fails. We avoid hard dependency on openai at import time so tests
+    (which don't set these vars) remain fast and offline.
+    """
+    try:
+        from markitdown import MarkItDown  # type: ignore
+    except Exception:  # pragma: no cover - should not happen unless package missing
+        return None
+
+    if not use_llm:
+        # Always plain MarkItDown for non-image documents per updated requirement.
+        return MarkItDown()
+
+    # Prefer Azure OpenAI if endpoint provided
+    azure_endpoint, azure_api_key, azure_deployment, azure_api_version = _azure_openai_settings()
+
+    client = None
+    model_name = None
+    # Attempt Azure first
+    if azure_endpoint and azure_api_key:
+        try:  # pragma: no cover - network not executed in tests
+            from openai import AsyncAzureOpenAI  # type: ignore
+
+            def make_client():
+                return AsyncAzureOpenAI(
+                    api_key=azure_api_key,
+                    azure_endpoint=azure_endpoint,
+                    api_version=azure_api_version,
+                )
+
+            # Captions go through the deduplicating, concurrency-bounded shim.
+            client = _CaptionClient(make_client, endpoint=azure_endpoint)
+            model_name = azure_deployment
+        except Exception as e:  # noqa: BLE001
+            print(f"[process_file] AzureOpenAI init failed: {e}")
+            client = None
+
+    try:
+        # MarkItDown currently supports passing llm_client + llm_model + llm_prompt.
+        return MarkItDown(llm_client=client, llm_model=model_name, llm_prompt=_LLM_PROMPT)
+    except Exception as e:  # noqa: BLE001
+        print(f"[process_file] MarkItDown LLM integration failed, falling back: {e}")
+        try:
+            return MarkItDown()
+        except Exception:
+            return None
+
+
+class _ConverterRegistry:
+    """Process-wide holder of the plain and LLM-enabled MarkItDown instances."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._plain: Any = None
+        self._llm: Optional[tuple[tuple[Optional[str], ...], Any]] = None
+
+    def get(self, use_llm: bool):
+        if not use_llm:
+            if self._plain is None:
+                with self._lock:
+                    if self._plain is None:
+                        self._plain = _build_markitdown_with_optional_llm(use_llm=False)
+            return self._plain
+
+        settings = _azure_openai_settings()
+        current = self._llm
+        if current is None or current[0] != settings:
+            with self._lock:
+                current = self._llm
+                if current is None or current[0] != settings:
+                    instance = _build_markitdown_with_optional_llm(use_llm=True)
+                    if instance is None:  # do not pin a failed build
+                        return None
+                    current = (settings, instance)
+                    self._llm = current
+        return current[1]
+
+    def prewarm(self) -> None:
+        try:
+            self.get(use_llm=False)
+            self.get(use_llm=True)
+        except Exception as e:  # noqa: BLE001 - prewarm is best effort
+            print(f"[converters] Prewarm failed: {e}")
+
+
+_converters = _ConverterRegistry()
+
+# Optionally build both converters in the background while the host finishes
+# starting, so the first request does not pay for markitdown/openai imports.
+if _env_flag("CONVERTER_PREWARM"):
+    threading.Thread(target=_converters.prewarm, name="converter-prewarm", daemon=True).start()
+
+
+# ---------------------------------------------------------------
+# Upload intake.
+# process_file accepts three body shapes:
+#   - application/json with base64 content (original contract)
+#   - application/octet-stream with the raw file as the body
+#   - multipart/form-data with a single file part
+# Raw and multipart uploads avoid the base64 inflation and the extra decoded
+# copy; the file is hashed in fixed-size chunks while it is read. Large
+# base64 payloads are decoded in chunks straight into a temp file instead of
+# a second in-memory copy, and uploads over UPLOAD_MAX_MB are rejected (413)
+# before any decoding.
+# ---------------------------------------------------------------
+_READ_CHUNK_BYTES = 1024 * 1024
+_B64_CHUNK_CHARS = 4 * (_READ_CHUNK_BYTES // 3)  # whole base64 quanta, ~1 MiB decoded
+
+
+class _UploadTooLarge(Exception):
+    """The upload exceeds UPLOAD_MAX_MB (HTTP 413)."""
+
+    def __init__(self, size: int, limit: int):
+        super().__init__(f"Upload too large ({size} bytes; limit {limit} bytes)")
+        self.size = size
+        self.limit = limit
+
+
+def _upload_limits() -> tuple[int, int]:
+    """(max_bytes, spool_bytes); a max of 0 means unlimited."""
+    return (max(_env_int("UPLOAD_MAX_MB", 100), 0) * 1024 * 1024,
+            max(_env_int("UPLOAD_SPOOL_MB", 16), 0) * 1024 * 1024)
+
+
+def _check_upload_size(size: int) -> None:
+    max_bytes, _spool_bytes = _upload_limits()
+    if max_bytes and size > max_bytes:
+        raise _UploadTooLarge(size, max_bytes)
+
+
+_DOCX_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+_XLSX_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+_EXTENSION_TYPES = {
+    ".pdf": "application/pdf",
+    ".docx": _DOCX_TYPE,
+    ".pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    ".xlsx": _XLSX_TYPE,
+    ".txt": "text/plain",
+    ".text": "text/plain",
+    ".md": "text/markdown",
+    ".markdown": "text/markdown",
+    ".csv": "text/csv",
+    ".json": "application/json",
+    ".jsonl": "application/jsonl",
+    ".html": "text/html",
+    ".htm": "text/html",
+    ".xml": "application/xml",
+}
+# (offset, signature, content type); checked in order against the first bytes.
+_MAGIC_TYPES = (
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (8, b"WEBP", "image/webp"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (0, b"{\\rtf", "application/rtf"),
+)
+# Top-level directory of an Office Open XML package -> content type.
+_OOXML_PARTS = {"word/": _DOCX_TYPE, "ppt/": None, "xl/": _XLSX_TYPE}
+_SNIFF_BYTES = 4096
+
+
+def _infer_content_type(filename: str) -> str:
+    return _EXTENSION_TYPES.get(os.path.splitext(filename.lower())[1], "application/octet-stream")
+
+
+def _sniff_content_type(stream: Any) -> Optional[str]:
+    """Content type from the file's leading magic bytes, or None if unrecognised.
+
+    ZIP containers are told apart (DOCX/PPTX/XLSX/EPUB) by their member names;
+    text is only reported as text/plain when it decodes as UTF-8.
+    """
+    stream.seek(0)
+    head = stream.read(_SNIFF_BYTES)
+    stream.seek(0)
+    if head.startswith(b"RIFF") and head[8:12] != b"WEBP":
+        return None
+    for offset, signature, content_type in _MAGIC_TYPES:
+        if head[offset:offset + len(signature)] == signature:
+            return content_type
+    if head.startswith(b"PK\x03\x04"):
+        import zipfile
+
+        try:
+            with zipfile.ZipFile(stream) as archive:
+                names = archive.namelist()
+                mimetype = archive.read("mimetype").decode("ascii", "replace") if "mimetype" in names else ""
+        except Exception:  # noqa: BLE001 - damaged archive: leave it to the extension
+            return None
+        finally:
+            stream.seek(0)
+        if mimetype == "application/epub+zip":
+            return mimetype
+        for prefix, content_type in _OOXML_PARTS.items():
+            if any(name.startswith(prefix) for name in names):
+                return content_type or _EXTENSION_TYPES[".pptx"]
+        return "application/zip"
+    stripped = head.lstrip()
+    if stripped[:15].lower() in (b"<!doctype html>", b"<!doctype html ") or stripped[:5].lower() == b"<html":
+        return "text/html"
+    if head and b"\x00" not in head:
+        try:
+            head.decode("utf-8")
+        except UnicodeDecodeError as e:
+            if e.start < len(head) - 3:  # not just a character cut off by the read
+                return None
+        return "text/plain"
+    return None
+
+
+def _resolve_content_type(filename: str, declared: Optional[str], stream: Any) -> str:
+    """Declared type if specific, else magic bytes, else the filename extension."""
+    if declared and declared != "application/octet-stream":
+        return declared
+    sniffed = _sniff_content_type(stream)
+    by_extension = _infer_content_type(filename)
+    if sniffed is None or (sniffed == "text/plain" and by_extension != "application/octet-stream"):
+        return by_extension  # text has no magic; a known extension says which kind
+    return sniffed
+
+
+class _Upload:
+    """An uploaded file: metadata plus either in-memory bytes or a seekable stream."""
+
+    def __init__(self, filename: str, content_type: Optional[str], sha256: str, size: int,
+                 data: Optional[bytes] = None, stream: Optional[Any] = None,
+                 fields: Optional[dict[str, Any]] = None, spooled: bool = False):
+        self.filename = filename
+        self.sha256 = sha256
+        self.size = size
+        self._data = data
+        self._stream = stream
+        self._spooled = spooled  # `stream` is our temp file, removed on close()
+        self.content_type = _resolve_content_type(filename, content_type, self.open())
+        # Other request fields (JSON keys, form fields or query params).
+        self.fields: dict[str, Any] = fields or {}
+
+    def open(self):
+        """Return a binary stream positioned at the start of the file."""
+        if self._stream is not None:
+            self._stream.seek(0)
+            return self._stream
+        return io.BytesIO(self._data or b"")
+
+    def read_bytes(self) -> bytes:
+        if self._data is not None:
+            return self._data
+        return self.open().read()
+
+    @property
+    def path(self) -> Optional[str]:
+        """Filesystem path of a spooled upload (readable by pool workers), else None."""
+        return self._stream.name if self._spooled else None
+
+    def close(self) -> None:
+        """Remove the spooled temp file, if any (in-memory uploads need nothing)."""
+        if self._spooled and not self._stream.closed:
+            self._stream.close()
+            try:
+                os.unlink(self._stream.name)
+            except OSError:
+                pass
+
+
+def _spool_file(filename: str):
+    """A new temp file for an upload; a plain file object, as MarkItDown requires io.IOBase."""
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=os.path.splitext(filename)[1][:16])
+    os.close(fd)
+    return open(path, "w+b")  # .name is the path (fdopen would give the descriptor)
+
+
+def _hash_bytes(data: bytes) -> str:
+    with _stage("hash"):
+        hasher = hashlib.sha256()
+        view = memoryview(data)
+        for offset in range(0, len(view), _READ_CHUNK_BYTES):
+            hasher.update(view[offset:offset + _READ_CHUNK_BYTES])
+        return hasher.hexdigest()
+
+
+def _header_filename(req: func.HttpRequest) -> Optional[str]:
+    from urllib.parse import unquote
+
+    name = req.headers.get("X-Filename")
+    if name:
+        return unquote(name)
+    disposition = req.headers.get("Content-Disposition") or ""
+    for part in disposition.split(";"):
+        key, _, value = part.strip().partition("=")
+        if key.lower() == "filename*" and "''" in value:  # RFC 5987: UTF-8''name
+            return unquote(value.split("''", 1)[1])
+        if key.lower() == "filename" and value:
+            return value.strip('"')
+    return req.params.get("filename")
+
+
+def _query_param(req: func.HttpRequest, name: str) -> Optional[str]:
+    # HttpRequest objects built directly (tests) may not populate params from the URL.
+    value = req.params.get(name)
+    if value is None:
+        from urllib.parse import parse_qs, urlsplit
+
+        values = parse_qs(urlsplit(req.url).query).get(name)
+        value = values[0] if values else None
+    return value
+
+
+def _read_upload(req: func.HttpRequest) -> tuple[Optional[_Upload], Optional[str]]:
+    """Parse the request body into an _Upload, or return an error message."""
+    request_type = (req.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+
+    encoding = _request_encoding(req)
+    if request_type == "application/octet-stream":
+        body = req.get_body()
+        if not body:
+            return None, "Empty request body"
+        if encoding is None:
+            _check_upload_size(len(body))
+        filename = _header_filename(req)
+        if not filename:
+            return None, "Missing filename (X-Filename header, Content-Disposition or ?filename=)"
+        content_type = req.headers.get("X-File-Content-Type") or req.params.get("content_type")
+        if encoding is not None:
+            data, spool, sha256_hash, size = _inflate_upload(body, encoding, filename)
+            if not size:
+                return None, "Empty request body"
+            return _Upload(filename, content_type, sha256_hash, size, data=data, stream=spool,
+                           fields=dict(req.params), spooled=spool is not None), None
+        return _Upload(filename, content_type, _hash_bytes(body), len(body), data=body,
+                       fields=dict(req.params)), None
+
+    if request_type == "multipart/form-data":
+        if encoding is not None:
+            raise _ContentEncodingError("Content-Encoding is not supported for multipart uploads", 415)
+        try:
+            with _stage("parse"):
+                files = req.files
+                form = req.form
+        except Exception as e:  # noqa: BLE001
+            return None, f"Invalid multipart body ({e.__class__.__name__})"
+        part = files.get("file") or next(iter(files.values()), None)
+        if part is None:
+            return None, "Multipart body must contain a file part"
+        filename = form.get("filename") or part.filename
+        if not filename:
+            return None, "Missing filename"
+        # Werkzeug already spooled the part (to disk when large); hash it in
+        # place rather than materializing another copy.
+        stream = part.stream
+        hasher = hashlib.sha256()
+        size = 0
+        stream.seek(0)
+        with _stage("hash"):
+            while True:
+                chunk = stream.read(_READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                size += len(chunk)
+        if not size:
+            return None, "Empty file part"
+        _check_upload_size(size)
+        content_type = form.get("content_type") or (
+            part.mimetype if part.mimetype and part.mimetype != "application/octet-stream" else None
+        )
+        return _Upload(filename, content_type, hasher.hexdigest(), size, stream=stream,
+                       fields=form.to_dict()), None
+
+    try:
+        body_raw = _request_body(req)
+        if not body_raw:
+            return None, "Empty request body"
+        with _stage("parse"):
+            payload: Any = json.loads(body_raw)
+    except json.JSONDecodeError as e:
+        # Provide the underlying JSON error message to aid debugging (e.g. invalid escapes)
+        return None, f"Body must be JSON ({e.msg})"
+
+    if not isinstance(payload, dict):
+        return None, "JSON body must be an object"
+    return _upload_from_payload(payload)
+
+
+def _spool_base64(content_b64: str, filename: str) -> tuple[Any, str, int]:
+    """Decode base64 chunk by chunk into a temp file; returns (file, sha256, size)."""
+    spool = _spool_file(filename)
+    try:
+        hasher = hashlib.sha256()
+        size = 0
+        for offset in range(0, len(content_b64), _B64_CHUNK_CHARS):
+            chunk = _b64.b64decode(content_b64[offset:offset + _B64_CHUNK_CHARS], validate=True)
+            hasher.update(chunk)
+            spool.write(chunk)
+            size += len(chunk)
+        spool.flush()
+    except BaseException:
+        spool.close()
+        os.unlink(spool.name)
+        raise
+    return spool, hasher.hexdigest(), size
+
+
+def _upload_from_payload(payload: dict[str, Any]) -> tuple[Optional[_Upload], Optional[str]]:
+    """Build an _Upload from a {filename, content_base64, content_type} object.
+
+    Raises _UploadTooLarge when the decoded size would exceed UPLOAD_MAX_MB.
+    """
+    filename = payload.get("filename")
+    content_b64 = payload.get("content_base64")
+    content_type = payload.get("content_type")
+
+    if not filename or not content_b64:
+        return None, "Missing filename or content_base64"
+    if not isinstance(content_b64, str) or len(content_b64) % 4:
+        return None, "content_base64 is not valid base64"
+    _check_upload_size(len(content_b64) // 4 * 3 - content_b64[-2:].count("="))
+
+    fields = {k: v for k, v in payload.items() if k not in ("filename", "content_base64", "content_type")}
+    _max_bytes, spool_bytes = _upload_limits()
+    if len(content_b64) // 4 * 3 > spool_bytes:
+        try:
+            with _stage("decode", spooled=True):
+                spool, sha256_hash, size = _spool_base64(content_b64, str(filename))
+        except Exception:  # noqa: BLE001
+            return None, "content_base64 is not valid base64"
+        return _Upload(filename, content_type, sha256_hash, size, stream=spool, fields=fields, spooled=True), None
+
+    try:
+        with _stage("decode"):
+            file_bytes = _b64.b64decode(content_b64, validate=True)
+    except Exception:  # noqa: BLE001
+        return None, "content_base64 is not valid base64"
+
+    return _Upload(filename, content_type, _hash_bytes(file_bytes), len(file_bytes), data=file_bytes,
+                   fields=fields), None
+
+
+# ---------------------------------------------------------------
+# HTTP content coding.
+# process_file, process_batch and write_to_repo accept request bodies sent
+# with Content-Encoding gzip or zstd (zstd needs the optional `zstandard`
+# package). Bodies are inflated in bounded chunks, and the request fails
+# with 413 as soon as the output passes REQUEST_MAX_DECOMPRESSED_MB (raw
+# uploads: also UPLOAD_MAX_MB), so a decompression bomb is never fully
+# materialised. Compressed raw uploads larger than UPLOAD_SPOOL_MB inflate
+# straight into a temp file. Responses of at least
+# RESPONSE_COMPRESSION_MIN_BYTES are compressed when Accept-Encoding allows
+# it; zstd wins over gzip at equal q.
+# ---------------------------------------------------------------
+class _ContentEncodingError(Exception):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def _zstd():
+    try:
+        import zstandard  # type: ignore
+
+        return zstandard
+    except ImportError:  # optional dependency
+        return None
+
+
+def _supported_encodings() -> tuple[str, ...]:
+    """Content codings we can decode and produce, in order of preference."""
+    return ("zstd", "gzip") if _zstd() is not None else ("gzip",)
+
+
+def _request_encoding(req: func.HttpRequest) -> Optional[str]:
+    """The request body's Content-Encoding (None for identity); 415 if unsupported."""
+    value = (req.headers.get("Content-Encoding") or "").strip().lower()
+    if value in ("", "identity"):
+        return None
+    value = "gzip" if value == "x-gzip" else value
+    if value not in _supported_encodings():
+        raise _ContentEncodingError(f"Unsupported Content-Encoding: {value}", 415)
+    return value
+
+
+def _decompressed_limit(upload_max: int = 0) -> int:
+    """Largest inflated body we accept (bytes); 0 means unlimited."""
+    limits = [max(_env_int("REQUEST_MAX_DECOMPRESSED_MB", 150), 0) * 1024 * 1024, upload_max]
+    return min((limit for limit in limits if limit), default=0)
+
+
+def _inflate(data: bytes, encoding: str) -> Iterator[bytes]:
+    """Decompress `data` in chunks of at most _READ_CHUNK_BYTES."""
+    try:
+        if encoding == "zstd":
+            reader = _zstd().ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True)
+            while chunk := reader.read(_READ_CHUNK_BYTES):
+                yield chunk
+            return
+        import zlib
+
+        while data:  # a gzip body may consist of several members
+            inflater = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+            while not inflater.eof:
+                chunk = inflater.decompress(data, _READ_CHUNK_BYTES)
+                data = inflater.unconsumed_tail
+                if chunk:
+                    yield chunk
+                elif not data:
+                    raise _ContentEncodingError("Truncated gzip body")
+            data = inflater.unused_data
+    except _ContentEncodingError:
+        raise
+    except Exception as e:  # noqa: BLE001 - zlib.error, zstandard.ZstdError
+        raise _ContentEncodingError(f"Invalid {encoding} body ({e})") from e
+
+
+def _request_body(req: func.HttpRequest) -> bytes:
+    """The request body with any Content-Encoding removed."""
+    body = req.get_body()
+    encoding = _request_encoding(req)
+    if encoding is None or not body:
+        return body
+    limit = _decompressed_limit()
+    inflated = bytearray()
+    with _stage("inflate", encoding=encoding):
+        for chunk in _inflate(body, encoding):
+            inflated += chunk
+            if limit and len(inflated) > limit:
+                raise _UploadTooLarge(len(inflated), limit)
+    return bytes(inflated)
+
+
+def _inflate_upload(body: bytes, encoding: str, filename: str) -> tuple[Optional[bytes], Any, str, int]:
+    """Inflate a compressed raw upload; returns (data, spool, sha256, size).
+
+    The output stays in memory up to UPLOAD_SPOOL_MB and moves to a temp
+    file (`spool`, with `data` None) beyond that.
+    """
+    max_bytes, spool_bytes = _upload_limits()
+    limit = _decompressed_limit(max_bytes)
+    hasher = hashlib.sha256()
+    buffer = bytearray()
+    spool: Any = None
+    size = 0
+    try:
+        with _stage("inflate", encoding=encoding):
+            for chunk in _inflate(body, encoding):
+                size += len(chunk)
+                if limit and size > limit:
+                    raise _UploadTooLarge(size, limit)
+                hasher.update(chunk)
+                if spool is None and size > spool_bytes:
+                    spool = _spool_file(filename)
+                    spool.write(buffer)
+                    buffer = bytearray()
+                if spool is not None:
+                    spool.write(chunk)
+                else:
+                    buffer += chunk
+        if spool is not None:
+            spool.flush()
+    except BaseException:
+        if spool is not None:
+            spool.close()
+            os.unlink(spool.name)
+        raise
+    return (None if spool is not None else bytes(buffer)), spool, hasher.hexdigest(), size
+
+
+def _negotiate_encoding(accept: Optional[str]) -> Optional[str]:
+    """Best supported coding for an Accept-Encoding header, or None for identity."""
+    if not accept:
+        return None
+    weights: dict[str, float] = {}
+    for item in accept.split(","):
+        name, _, params = item.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in _supported_encodings():
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return _zstd().ZstdCompressor(level=3).compress(body)
+    import gzip
+
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+def _encode_response(req: func.HttpRequest, resp: func.HttpResponse) -> func.HttpResponse:
+    """Return `resp` compressed as negotiated with the client (or unchanged)."""
+    body = resp.get_body()
+    if (not _env_flag("RESPONSE_COMPRESSION_ENABLED", True) or "Content-Encoding" in resp.headers
+            or len(body) < max(_env_int("RESPONSE_COMPRESSION_MIN_BYTES", 1024), 1)):
+        return resp
+    resp.headers["Vary"] = "Accept-Encoding"
+    encoding = _negotiate_encoding(req.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return resp
+    with _stage("compress", encoding=encoding):
+        compressed = _compress_body(body, encoding)
+    return func.HttpResponse(compressed, status_code=resp.status_code,
+                             headers={**resp.headers, "Content-Encoding": encoding},
+                             mimetype=resp.mimetype, charset=resp.charset)
+
+
+def _compressible(handler: Any) -> Any:
+    """Compress an HTTP handler's responses per Accept-Encoding."""
+
+    if inspect.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def async_wrapper(req: func.HttpRequest) -> func.HttpResponse:
+            resp = await handler(req)
+            if len(resp.get_body()) > _READ_CHUNK_BYTES:  # keep big compressions off the event loop
+                return await _offload(_encode_response, req, resp)
+            return _encode_response(req, resp)
+
+        return async_wrapper
+
+    @functools.wraps(handler)
+    def wrapper(req: func.HttpRequest) -> func.HttpResponse:
+        return _encode_response(req, handler(req))
+
+    return wrapper
+
+
+# ---------------------------------------------------------------
+# Single-flight conversions.
+# SharePoint change events arrive in bursts, so several invocations often
+# carry the same bytes at once. Conversions are coalesced per cache key
+# (content hash + conversion settings): the first caller converts, and
+# concurrent callers with the same key wait for its result (reported as
+# cache status "coalesced") instead of repeating the MarkItDown work and
+# LLM calls. With SINGLEFLIGHT_LEASE_ENABLED the in-process leader also
+# takes a lease on a blob in the pipeline container. Leaders on other
+# instances then wait for the lease holder to publish its Markdown in that
+# blob. Waiting is bounded by SINGLEFLIGHT_WAIT_SECONDS, after which a
+# follower converts on its own. Storage errors fall back to converting
+# locally.
+# ---------------------------------------------------------------
+_LEASE_POLL_SECONDS = 1.0
+
+
+class _SingleFlight:
+    """Coalesce concurrent calls that share a key into one execution."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict[str, Any] = {}
+
+    def do(self, key: str, fn: Any, timeout: Optional[float] = None) -> tuple[Any, bool]:
+        """Return (result, ran); `ran` is False when the result came from another caller.
+
+        Followers get the leader's result or exception. A follower that waits
+        longer than `timeout` runs `fn` itself.
+        """
+        from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        if not leader:
+            try:
+                with _stage("singleflight_wait"):
+                    return future.result(timeout), False
+            except FutureTimeout:
+                return fn(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+        return result, True
+
+
+_conversion_flights = _SingleFlight()
+
+
+def _published_conversion(blob: Any) -> tuple[Optional[str], bool]:
+    """(Markdown published by a lease holder, whether the lease is currently held)."""
+    properties = blob.get_blob_properties()
+    if (properties.metadata or {}).get("state") == "done":
+        return blob.download_blob().readall().decode("utf-8"), False
+    return None, properties.lease.state == "leased"
+
+
+def _acquire_conversion_lease(blob: Any, lease_seconds: int, deadline: float) -> tuple[Optional[str], Any]:
+    """Wait until we hold the lease or another instance published; returns (markdown, lease)."""
+    from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError  # type: ignore
+
+    while True:
+        try:
+            text, held = _published_conversion(blob)
+        except ResourceNotFoundError:
+            try:
+                blob.upload_blob(b"", overwrite=False)
+            except ResourceExistsError:
+                pass  # another instance created it first
+            continue
+        if text is not None:
+            return text, None
+        if not held:
+            try:
+                lease = blob.acquire_lease(lease_duration=lease_seconds)
+            except HttpResponseError as e:
+                if e.status_code != 409:  # 409: someone else got there first
+                    raise
+            else:
+                text, _held = _published_conversion(blob)  # published between our read and acquire?
+                if text is not None:
+                    lease.release()
+                    return text, None
+                return None, lease
+        if time.monotonic() >= deadline:
+            return None, None
+        time.sleep(_LEASE_POLL_SECONDS)
+
+
+def _expire_published_conversion(blob: Any, etag: Optional[str]) -> None:
+    """Delete a published result once waiting instances have had time to read it.
+
+    Followers poll every _LEASE_POLL_SECONDS, so SINGLEFLIGHT_RESULT_TTL_SECONDS
+    only has to cover one poll. The etag condition leaves the blob alone if a
+    newer flight has rewritten it, and a leased blob cannot be deleted anyway.
+    """
+    def delete() -> None:
+        from azure.core import MatchConditions  # type: ignore
+
+        try:
+            if etag:
+                blob.delete_blob(etag=etag, match_condition=MatchConditions.IfNotModified)
+            else:
+                blob.delete_blob()
+        except Exception:  # noqa: BLE001 - already gone, re-leased or rewritten
+            pass
+
+    timer = threading.Timer(max(_env_int("SINGLEFLIGHT_RESULT_TTL_SECONDS", 60), 0), delete)
+    timer.daemon = True
+    timer.start()
+
+
+def _leased_conversion(cache_key: str, convert: Any) -> tuple[Optional[str], bool]:
+    """Run `convert` unless another instance holds the key's lease; returns (markdown, from_other_instance)."""
+    if not _env_flag("SINGLEFLIGHT_LEASE_ENABLED"):
+        return convert(), False
+    lease_seconds = min(max(_env_int("SINGLEFLIGHT_LEASE_SECONDS", 30), 15), 60)  # Azure's lease range
+    deadline = time.monotonic() + max(_env_int("SINGLEFLIGHT_WAIT_SECONDS", 120), 0)
+    try:
+        blob = _blob_container().get_blob_client(f"singleflight/{cache_key}.md")
+        with _stage("lease"):
+            text, lease = _acquire_conversion_lease(blob, lease_seconds, deadline)
+    except Exception as e:  # noqa: BLE001 - storage trouble must not fail the conversion
+        print(f"[singleflight] Lease unavailable for {cache_key[:12]}: {e}")
+        return convert(), False
+    if text is not None:
+        return text, True
+    if lease is None:  # waited SINGLEFLIGHT_WAIT_SECONDS for a slow leader
+        return convert(), False
+
+    stop = threading.Event()
+
+    def renew() -> None:
+        while not stop.wait(lease_seconds / 3):
+            try:
+                lease.renew()
+            except Exception as e:  # noqa: BLE001
+                print(f"[singleflight] Lease renewal failed for {cache_key[:12]}: {e}")
+                return
+
+    threading.Thread(target=renew, name="singleflight-lease", daemon=True).start()
+    published: Optional[dict[str, Any]] = None
+    try:
+        text = convert()
+        if text is not None:
+            try:
+                published = blob.upload_blob(text.encode("utf-8"), overwrite=True, metadata={"state": "done"},
+                                             lease=lease) or {}
+            except Exception as e:  # noqa: BLE001
+                print(f"[singleflight] Could not publish {cache_key[:12]}: {e}")
+        return text, False
+    finally:
+        stop.set()
+        try:
+            lease.release()
+        except Exception:  # noqa: BLE001 - it expires on its own
+            pass
+        if published is not None:
+            _expire_published_conversion(blob, published.get("etag"))
+
+
+# ---------------------------------------------------------------
+# Conversion.
+# Shared by process_file (in-process) and process_batch (process pool).
+# MarkItDown conversion is CPU-bound Python, so batch items are spread over
+# worker processes rather than threads to get past the GIL.
+# ---------------------------------------------------------------
+def _extraction_failed(exc: BaseException) -> str:
+    return f"(extraction_failed: {getattr(exc, 'kind', None) or exc.__class__.__name__})"
+
+
+def _convert_stream(stream: Any, filename: str, use_llm: bool) -> Optional[str]:
+    with _stage("converter"):
+        mid = _converters.get(use_llm=use_llm)
+    if mid is None:
+        raise RuntimeError("MarkItDown unavailable")
+    result = mid.convert(stream, filename=filename)
+    if isinstance(result, dict):
+        return result.get("markdown") or result.get("output")
+    return str(result)
+
+
+def _convert_bytes(filename: str, data: bytes, use_llm: bool) -> Optional[str]:
+    """Process pool entry point (must stay a picklable module-level function)."""
+    return _convert_stream(io.BytesIO(data), filename, use_llm)
+
+
+def _convert_file(filename: str, path: str, use_llm: bool) -> Optional[str]:
+    """Process pool entry point for spooled uploads: the worker reads the file itself."""
+    with open(path, "rb") as fh:
+        return _convert_stream(fh, filename, use_llm)
+
+
+# Fast paths for trivial formats: the same output MarkItDown's plain-text
+# and CSV converters produce, without building a converter (and loading
+# Magika) for every small text file. Only taken when the extension agrees
+# with the resolved content type, since MarkItDown dispatches on the
+# extension first; anything not valid UTF-8 goes to MarkItDown for charset
+# detection.
+_CSV_PIPE = re.compile(r"(?<!\\)(\\*)\|")
+
+
+def _fast_text(data: bytes) -> Optional[str]:
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+
+def _csv_cell(value: str) -> str:
+    value = _CSV_PIPE.sub(lambda m: m.group(1) * 2 + r"\|", value)
+    return value.replace("\r\n", " ").replace("\n", " ").replace("\r", " ")
+
+
+def _fast_csv(data: bytes) -> Optional[str]:
+    import csv
+
+    text = _fast_text(data)
+    if text is None:
+        return None
+    rows = list(csv.reader(io.StringIO(text.lstrip("\ufeff"), newline="")))
+    # Drop blank rows at both ends and directly under the header.
+    while rows and not rows[0]:
+        rows.pop(0)
+    while rows and not rows[-1]:
+        rows.pop()
+    while len(rows) > 1 and not rows[1]:
+        rows.pop(1)
+    if not rows:
+        return ""
+    width = max(len(row) for row in rows)
+    lines = []
+    for index, row in enumerate(rows):
+        lines.append("| " + " | ".join(_csv_cell(cell) for cell in row + [""] * (width - len(row))) + " |")
+        if index == 0:
+            lines.append("| " + " | ".join(["---"] * width) + " |")
+    return "\n".join(lines)
+
+
+_FAST_CONVERTERS = {
+    "text/plain": _fast_text,
+    "text/markdown": _fast_text,
+    "application/json": _fast_text,
+    "application/jsonl": _fast_text,
+    "text/csv": _fast_csv,
+}
+
+
+def _convert_fast(upload: _Upload) -> Optional[str]:
+    """Markdown for a plain-text/Markdown/CSV/JSON upload, or None to use MarkItDown."""
+    converter = _FAST_CONVERTERS.get(upload.content_type)
+    if converter is None or _infer_content_type(upload.filename) != upload.content_type:
+        return None
+    if not _env_flag("FAST_CONVERTERS_ENABLED", True):
+        return None
+    text = converter(upload.read_bytes())
+    return None if text is None else _normalize_markdown(text)
+
+
+def _lookup_conversion(upload: _Upload) -> tuple[str, bool, Optional[str], str]:
+    """Return (cache_key, use_llm, cached_markdown, cache_status) for an upload."""
+    use_llm = _is_image(upload.filename, upload.content_type)
+    cache_key = _conversion_cache_key(
+        upload.sha256, _conversion_settings(use_llm, upload.filename, upload.content_type)
+    )
+    if not _conversion_cache.enabled:
+        return cache_key, use_llm, None, "bypass"
+    with _stage("cache"):
+        markdown_text = _conversion_cache.get(cache_key)
+    return cache_key, use_llm, markdown_text, "hit" if markdown_text is not None else "miss"
+
+
+def _store_conversion(cache_key: str, markdown_text: Optional[str]) -> None:
+    # Only successful conversions are cached; failures are retried next time.
+    if _conversion_cache.enabled and markdown_text is not None:
+        _conversion_cache.put(cache_key, markdown_text)
+
+
+def _convert_in_process(upload: _Upload, use_llm: bool) -> Optional[str]:
+    """The uncached conversion of process_file: fast paths, page ranges, then MarkItDown."""
+    with _stage("convert", **{"file.name": upload.filename, "file.size": upload.size}):
+        text = None if use_llm else _convert_fast(upload)
+        if text is None and not use_llm:
+            text = _convert_parallel(upload)
+        if text is None and not use_llm and _isolation_enabled():
+            text = _convert_isolated(upload, use_llm)
+        elif text is None:
+            text = _convert_stream(upload.open(), upload.filename, use_llm)
+    return text
+
+
+def _convert_miss(cache_key: str, cache_status: str, convert: Any) -> tuple[Optional[str], str]:
+    """Run `convert` for a cache miss, coalesced with identical conversions in flight.
+
+    Returns (markdown, cache_status); the result is cached when this call converted it.
+    """
+    try:
+        if _env_flag("SINGLEFLIGHT_ENABLED", True):
+            (markdown_text, remote), ran = _conversion_flights.do(
+                cache_key, functools.partial(_leased_conversion, cache_key, convert),
+                timeout=max(_env_int("SINGLEFLIGHT_WAIT_SECONDS", 120), 0),
+            )
+            if remote or not ran:
+                cache_status = "coalesced"
+        else:
+            markdown_text, ran = convert(), True
+    except Exception as e:  # noqa: BLE001
+        return _extraction_failed(e), cache_status
+    if ran:
+        _store_conversion(cache_key, markdown_text)
+    return markdown_text, cache_status
+
+
+def _convert_upload(upload: _Upload) -> tuple[Optional[str], str]:
+    """Convert an upload in-process, going through the cache. Returns (markdown, cache_status)."""
+    cache_key, use_llm, markdown_text, cache_status = _lookup_conversion(upload)
+    if markdown_text is not None:
+        return markdown_text, cache_status
+    return _convert_miss(cache_key, cache_status, functools.partial(_convert_in_process, upload, use_llm))
+
+
+def _result_data(upload: _Upload, markdown_text: Optional[str], cache_status: str) -> dict[str, Any]:
+    """The `data` object of a ?format=json response."""
+    return {
+        "filename": upload.filename,
+        "size_bytes": upload.size,
+        "sha256": upload.sha256,
+        "content_type": upload.content_type,
+        "markdown": markdown_text,
+        "cache": cache_status,
+    }
+
+
+_process_pool: Any = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool():
+    """Return the shared, lazily created conversion process pool."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # spawn: the Functions worker is multi-threaded, so fork is unsafe.
+            _process_pool = ProcessPoolExecutor(
+                max_workers=max(1, _env_int("CONVERSION_MAX_WORKERS", os.cpu_count() or 1)),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _process_pool
+
+
+def _reset_process_pool(broken: Any = None) -> None:
+    """Drop a broken pool (e.g. a worker was OOM-killed) so the next call starts fresh.
+
+    With `broken`, only that pool is dropped: a replacement started by
+    another caller in the meantime is left alone.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if broken is not None and _process_pool is not broken:
+            return
+        pool, _process_pool = _process_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _convert_on_pool(pool: Any, upload: _Upload, use_llm: bool) -> Optional[str]:
+    """Convert on the shared process pool; spooled uploads are read from disk by the worker."""
+    from concurrent.futures.process import BrokenProcessPool
+
+    if upload.path:
+        future = pool.submit(_convert_file, upload.filename, upload.path, use_llm)
+    else:
+        future = pool.submit(_convert_bytes, upload.filename, upload.read_bytes(), use_llm)
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        _reset_process_pool(pool)
+        raise
+
+
+def _convert_pending(pending: list[tuple[int, _Upload, str, bool, str]],
+                     results: list[Optional[dict[str, Any]]]) -> None:
+    """Convert the cache misses of a batch, on the process pool when worthwhile.
+
+    Every item goes through single flight, so identical uploads (in this
+    batch or in concurrent requests) are converted once.
+    """
+    workers = _env_int("CONVERSION_MAX_WORKERS", os.cpu_count() or 1)
+    if len(pending) == 1 or workers <= 1:
+        # Not worth shipping bytes to another process.
+        for index, upload, cache_key, use_llm, cache_status in pending:
+            markdown_text, cache_status = _convert_miss(
+                cache_key, cache_status, functools.partial(_convert_in_process, upload, use_llm)
+            )
+            results[index] = {"status": "ok", "data": _result_data(upload, markdown_text, cache_status)}
+        return
+    if not pending:
+        return
+    from concurrent.futures import ThreadPoolExecutor
+
+    if _isolation_enabled():
+        convert_item: Any = _convert_in_process  # supervised per item
+        threads = _supervised_pool().size
+    else:
+        convert_item = functools.partial(_convert_on_pool, _get_process_pool())
+        threads = workers
+
+    def convert(item: tuple[int, _Upload, str, bool, str]) -> tuple[Optional[str], str]:
+        _index, upload, cache_key, use_llm, cache_status = item
+        return _convert_miss(cache_key, cache_status, functools.partial(convert_item, upload, use_llm))
+
+    # Each thread only waits on a worker process or on an identical conversion in flight.
+    with ThreadPoolExecutor(max_workers=min(len(pending), threads)) as executor:
+        converted = list(executor.map(convert, pending))
+    for (index, upload, _key, _use_llm, _status), (markdown_text, cache_status) in zip(pending, converted):
+        results[index] = {"status": "ok", "data": _result_data(upload, markdown_text, cache_status)}
+
+
+# ---------------------------------------------------------------
+# Memory admission.
+# Each conversion reserves an estimate of its peak memory (upload size x
+# CONVERSION_MEMORY_FACTOR) from a per-worker budget. Requests that cannot
+# get a reservation within CONVERSION_QUEUE_SECONDS are rejected with 429
+# instead of pushing the worker into an out-of-memory kill that would take
+# every in-flight request down with it.
+# ---------------------------------------------------------------
+class _MemoryBudget:
+    """A byte budget shared by the conversions running in this worker."""
+
+    def __init__(self, limit_bytes: int):
+        self.limit = limit_bytes
+        self.in_use = 0
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_env(cls) -> "_MemoryBudget":
+        return cls(max(_env_int("CONVERSION_MEMORY_BUDGET_MB", 1024), 0) * 1024 * 1024)
+
+    @contextlib.contextmanager
+    def reserve(self, cost: int, timeout: Optional[float]) -> Iterator[bool]:
+        """Yield True once `cost` bytes are reserved, or False after `timeout` seconds."""
+        if self.limit <= 0:
+            yield True
+            return
+        cost = min(max(cost, 0), self.limit)  # an oversized job may still run on its own
+        with self._cond:
+            admitted = self._cond.wait_for(lambda: self.in_use + cost <= self.limit, timeout)
+            if admitted:
+                self.in_use += cost
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                with self._cond:
+                    self.in_use -= cost
+                    self._cond.notify_all()
+
+
+_memory_budget = _MemoryBudget.from_env()
+
+
+def _conversion_cost(size: int) -> int:
+    return size * max(_env_int("CONVERSION_MEMORY_FACTOR", 4), 1)
+
+
+def _admission_wait() -> float:
+    return float(max(_env_int("CONVERSION_QUEUE_SECONDS", 10), 0))
+
+
+def _busy_headers() -> dict[str, str]:
+    return {"Retry-After": str(max(_env_int("CONVERSION_QUEUE_SECONDS", 10), 1))}
+
+
+# ---------------------------------------------------------------
+# Supervised conversion (CONVERSION_ISOLATION=true).
+# MarkItDown runs in a pool of reusable worker processes, one task at a
+# time each. The supervisor enforces a per-format wall-clock limit and an
+# RSS limit, and kills and replaces a worker that overruns either, so a
+# pathological document costs one worker process instead of a host slot.
+# A circuit breaker per format (and per LLM backend, for captions) opens
+# after repeated timeouts, overruns or crashes and fails fast until a
+# cool-down has passed; ordinary conversion errors do not count.
+# ---------------------------------------------------------------
+class _ConversionFailure(Exception):
+    """A supervised conversion did not produce a result; `kind` names why."""
+
+    def __init__(self, kind: str, detail: str = ""):
+        super().__init__(f"{kind}: {detail}" if detail else kind)
+        self.kind = kind
+
+
+# Failures that say something about the format or backend, not the file.
+_BREAKER_KINDS = ("ConversionTimeout", "ConversionMemoryExceeded", "WorkerCrashed", "LLMTimeout")
+
+
+class _CircuitBreaker:
+    """Per-key consecutive-failure breaker with a half-open trial after `cooldown` seconds."""
+
+    def __init__(self, threshold: int, cooldown: float, clock: Any = time.monotonic):
+        self.threshold = max(threshold, 1)
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures: dict[str, int] = {}
+        self._opened: dict[str, float] = {}
+        self._trial: set[str] = set()
+
+    @classmethod
+    def from_env(cls) -> "_CircuitBreaker":
+        return cls(_env_int("CIRCUIT_FAILURE_THRESHOLD", 3), float(_env_int("CIRCUIT_COOLDOWN_SECONDS", 60)))
+
+    def check(self, key: str) -> None:
+        """Raise _ConversionFailure("CircuitOpen") unless a call for `key` may proceed."""
+        with self._lock:
+            opened = self._opened.get(key)
+            if opened is None:
+                return
+            if self._clock() - opened >= self.cooldown and key not in self._trial:
+                self._trial.add(key)  # half-open: let one call through
+                return
+        raise _ConversionFailure("CircuitOpen", key)
+
+    def record(self, key: str, failure: Optional[BaseException] = None) -> None:
+        counts = isinstance(failure, _ConversionFailure) and failure.kind in _BREAKER_KINDS
+        with self._lock:
+            self._trial.discard(key)
+            if not counts:
+                self._failures.pop(key, None)
+                self._opened.pop(key, None)
+                return
+            self._failures[key] = self._failures.get(key, 0) + 1
+            if self._failures[key] >= self.threshold:
+                if key not in self._opened:
+                    print(f"[isolation] Circuit for {key} opened after {self._failures[key]} failures")
+                self._opened[key] = self._clock()
+
+    def state(self) -> dict[str, str]:
+        with self._lock:
+            return {key: "half_open" if key in self._trial else "open" for key in self._opened}
+
+
+_circuit_breaker = _CircuitBreaker.from_env()
+
+
+def _isolated_worker_main(conn: Any) -> None:
+    """Worker process loop: run (fn, args) tasks until the pipe closes."""
+    while True:
+        try:
+            fn, args = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            conn.send(("ok", fn(*args)))
+        except MemoryError:
+            conn.send(("error", "MemoryError"))
+            return  # the heap may be fragmented; let the supervisor start a fresh worker
+        except Exception as e:  # noqa: BLE001 - reported to the supervisor by class name
+            conn.send(("error", e.__class__.__name__))
+
+
+def _process_rss(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/statm", "rb") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None  # not Linux: only the time limit is enforced
+
+
+class _IsolatedWorker:
+    def __init__(self, ctx: Any):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_isolated_worker_main, args=(child_conn,),
+                                   name="conversion-worker", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+
+    def run(self, fn: Any, args: tuple, timeout: float, memory_limit: int) -> Any:
+        self.tasks += 1
+        self.conn.send((fn, args))
+        deadline = time.monotonic() + timeout
+        while not self.conn.poll(0.05):
+            if not self.process.is_alive():
+                raise _ConversionFailure("WorkerCrashed", f"exit code {self.process.exitcode}")
+            if time.monotonic() > deadline:
+                self.kill()
+                raise _ConversionFailure("ConversionTimeout", f"{timeout:g}s")
+            rss = _process_rss(self.process.pid) if memory_limit else None
+            if rss is not None and rss > memory_limit:
+                self.kill()
+                raise _ConversionFailure("ConversionMemoryExceeded", f"{rss} bytes")
+        try:
+            status, value = self.conn.recv()
+        except (EOFError, OSError):
+            raise _ConversionFailure("WorkerCrashed", "no result") from None
+        if status != "ok":
+            raise _ConversionFailure(value)
+        return value
+
+
+class _SupervisedPool:
+    """Reusable worker processes; each task gets a time and memory limit."""
+
+    def __init__(self, size: int, max_tasks: int = 200):
+        self.size = max(size, 1)
+        self.max_tasks = max_tasks
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle: list[_IsolatedWorker] = []
+        self._lock = threading.Lock()
+        self._ctx: Any = None
+
+    def _checkout(self) -> _IsolatedWorker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.process.is_alive():
+                    return worker
+                worker.conn.close()
+            if self._ctx is None:
+                import multiprocessing
+
+                self._ctx = multiprocessing.get_context("spawn")  # see _get_process_pool
+        return _IsolatedWorker(self._ctx)
+
+    def close(self) -> None:
+        """Stop the idle workers (busy ones are stopped when their task returns)."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.kill()
+
+    def run(self, fn: Any, args: tuple, timeout: float, memory_limit: int = 0) -> Any:
+        with self._slots:
+            worker = self._checkout()
+            try:
+                result = worker.run(fn, args, timeout, memory_limit)
+            except _ConversionFailure as e:
+                if e.kind in _BREAKER_KINDS or e.kind == "MemoryError":
+                    worker.kill()
+                    worker = None
+                raise
+            finally:
+                if worker is not None:
+                    if worker.tasks >= self.max_tasks or not worker.process.is_alive():
+                        worker.kill()
+                    else:
+                        with self._lock:
+                            self._idle.append(worker)
+            return result
+
+
+_supervised_pool_obj: Optional[_SupervisedPool] = None
+_supervised_pool_lock = threading.Lock()
+
+
+def _supervised_pool() -> _SupervisedPool:
+    global _supervised_pool_obj
+    with _supervised_pool_lock:
+        if _supervised_pool_obj is None:
+            _supervised_pool_obj = _SupervisedPool(
+                _env_int("CONVERSION_ISOLATED_WORKERS", _env_int("CONVERSION_MAX_WORKERS", os.cpu_count() or 1)),
+                _env_int("CONVERSION_WORKER_MAX_TASKS", 200),
+            )
+        return _supervised_pool_obj
+
+
+def _isolation_enabled() -> bool:
+    return _env_flag("CONVERSION_ISOLATION")
+
+
+def _format_key(upload: _Upload) -> str:
+    """Short format name used for per-format limits and circuit breakers."""
+    content_type = upload.content_type
+    if content_type in _PDF_TYPES:
+        return "pdf"
+    for key, known in (("docx", _DOCX_TYPE), ("pptx", _PPTX_TYPE), ("xlsx", _XLSX_TYPE)):
+        if content_type == known:
+            return key
+    if content_type.startswith("image/"):
+        return "image"
+    extension = os.path.splitext(upload.filename.lower())[1].lstrip(".")
+    return extension if extension.isalnum() and len(extension) <= 8 else "other"
+
+
+def _format_limits(fmt: str) -> tuple[float, int]:
+    """(timeout_seconds, memory_limit_bytes) for a format; e.g. CONVERSION_TIMEOUT_SECONDS_PDF overrides."""
+    suffix = fmt.upper()
+    timeout = _env_int(f"CONVERSION_TIMEOUT_SECONDS_{suffix}", _env_int("CONVERSION_TIMEOUT_SECONDS", 120))
+    memory_mb = _env_int(f"CONVERSION_MEMORY_LIMIT_MB_{suffix}", _env_int("CONVERSION_MEMORY_LIMIT_MB", 2048))
+    return float(max(timeout, 1)), max(memory_mb, 0) * 1024 * 1024
+
+
+def _run_isolated(fmt: str, fn: Any, *args: Any) -> Any:
+    """Run fn(*args) on the supervised pool under the limits and breaker of `fmt`."""
+    _circuit_breaker.check(fmt)
+    timeout, memory_limit = _format_limits(fmt)
+    try:
+        with _stage("isolated", **{"conversion.format": fmt}):
+            result = _supervised_pool().run(fn, args, timeout, memory_limit)
+    except _ConversionFailure as e:
+        _circuit_breaker.record(fmt, e)
+        if e.kind in _BREAKER_KINDS:
+            print(f"[isolation] {fmt} conversion aborted: {e}")
+        raise
+    _circuit_breaker.record(fmt)
+    return result
+
+
+def _convert_isolated(upload: _Upload, use_llm: bool) -> Optional[str]:
+    """Whole-document conversion in a supervised worker (spooled uploads are read by path)."""
+    path = upload.path
+    if path is not None:
+        return _run_isolated(_format_key(upload), _convert_file, upload.filename, path, use_llm)
+    return _run_isolated(_format_key(upload), _convert_bytes, upload.filename, upload.read_bytes(), use_llm)
+
+
+# ---------------------------------------------------------------
+# GitHub HTTP transport.
+# GitHub calls are async (httpx): write_to_repo awaits them on the host's
+# event loop, so one worker overlaps many GitHub round trips instead of
+# parking a thread on each. Every event loop gets one keep-alive client
+# (connection pool) instead of a new TCP+TLS handshake per call. Sync
+# callers (the queue-triggered persist stage) go through `_run_github`,
+# which uses a private loop thread so its pool is reused as well. Requests
+# are retried with jittered exponential backoff for transient 5xx and for
+# primary/secondary rate limits (honouring Retry-After and
+# X-RateLimit-Reset). The last seen quota is kept so the endpoint can
+# report it to callers for pacing.
+# ---------------------------------------------------------------
+_RETRYABLE_STATUSES = (500, 502, 503, 504)
+_github_clients: Any = weakref.WeakKeyDictionary()  # event loop -> httpx.AsyncClient
+_github_session_lock = threading.Lock()
+_github_loop: Any = None
+_github_rate_limit: dict[str, Any] = {}
+
+
+def _github_session():
+    """The httpx.AsyncClient for the running event loop."""
+    loop = asyncio.get_running_loop()
+    with _github_session_lock:
+        client = _github_clients.get(loop)
+        if client is None:
+            import httpx
+
+            pool_size = max(1, _env_int("GITHUB_POOL_SIZE", 16))
+            client = httpx.AsyncClient(limits=httpx.Limits(max_connections=pool_size,
+                                                           max_keepalive_connections=pool_size))
+            _github_clients[loop] = client
+        return client
+
+
+def _run_github(coro: Any) -> Any:
+    """Run a GitHub coroutine from synchronous code on the shared GitHub loop thread."""
+    global _github_loop
+    with _github_session_lock:
+        if _github_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="github-client", daemon=True).start()
+            _github_loop = loop
+    return asyncio.run_coroutine_threadsafe(coro, _github_loop).result()
+
+
+def _record_rate_limit(resp: Any) -> None:
+    global _github_rate_limit
+    headers = resp.headers
+    if "X-RateLimit-Remaining" not in headers:
+        return
+    snapshot: dict[str, Any] = {}
+    for field in ("limit", "remaining", "used", "reset"):
+        value = headers.get(f"X-RateLimit-{field.capitalize()}")
+        if value is not None and value.isdigit():
+            snapshot[field] = int(value)
+    if headers.get("X-RateLimit-Resource"):
+        snapshot["resource"] = headers["X-RateLimit-Resource"]
+    _github_rate_limit = snapshot  # rebinding keeps readers from seeing a half-updated dict
+
+
+def _github_retry_delay(resp: Any, attempt: int) -> Optional[float]:
+    """Seconds to wait before retrying `resp`, or None if it should not be retried."""
+    status = resp.status_code
+    headers = resp.headers
+    rate_limited = status == 429 or (
+        status == 403 and (
+            "Retry-After" in headers
+            or headers.get("X-RateLimit-Remaining") == "0"
+            or "rate limit" in (resp.text or "").lower()
+        )
+    )
+    if status not in _RETRYABLE_STATUSES and not rate_limited:
+        return None
+    retry_after = headers.get("Retry-After")
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    reset = headers.get("X-RateLimit-Reset")
+    if rate_limited and headers.get("X-RateLimit-Remaining") == "0" and reset and reset.isdigit():
+        return max(0.0, int(reset) - time.time()) + 1.0
+    return _backoff(attempt)
+
+
+def _backoff(attempt: int) -> float:
+    # "Full jitter": spreads retries from concurrent invocations apart.
+    return random.uniform(0, min(8.0, 0.5 * (2 ** attempt)))
+
+
+async def _github_request(method: str, url: str, **kwargs: Any):
+    """Send a GitHub API request on the shared client, retrying transient failures."""
+    max_retries = max(0, _env_int("GITHUB_MAX_RETRIES", 3))
+    max_wait = _env_int("GITHUB_MAX_RETRY_WAIT_SECONDS", 30)
+    session = _github_session()
+    import httpx
+    attempt = 0
+    while True:
+        try:
+            with _stage(f"github_{method.lower()}", **{"http.method": method.upper(), "http.url": url}):
+                resp = await session.request(method.upper(), url, **kwargs)
+        except httpx.TransportError:
+            if attempt >= max_retries:
+                raise
+            await asyncio.sleep(_backoff(attempt))
+            attempt += 1
+            continue
+        _record_rate_limit(resp)
+        delay = _github_retry_delay(resp, attempt)
+        # Give up rather than hold a worker for a long reset window; the
+        # caller gets the rate-limit figures and can reschedule.
+        if delay is None or attempt >= max_retries or delay > max_wait:
+            return resp
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+# ---------------------------------------------------------------
+# GitHub writes.
+# Single files go through the contents API (one PUT, one commit). For batches we
+# read the branch snapshot (see below), then create a single tree (blobs
+# are created server-side from inline content), one commit, and move the
+# branch ref. If the branch moved in the meantime the ref update is rejected
+# as a non fast-forward and the whole sequence is retried on the new head.
+# ---------------------------------------------------------------
+_GITHUB_API = "https://api.github.com"
+
+
+class _GitHubError(Exception):
+    def __init__(self, message: str, status: int = 502):
+        super().__init__(message)
+        self.status = status
+
+
+def _github_headers(token: str) -> dict[str, str]:
+    return {
+        "Authorization": f"Bearer {token}",
+        "Accept": "application/vnd.github+json",
+        "User-Agent": "enterprise-artifacts-indexing-func",
+    }
+
+
+def _git_blob_sha(data: bytes) -> str:
+    """SHA-1 git assigns to a blob with this content (`git hash-object`)."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+async def _github_api(method: str, url: str, headers: dict[str, str], ok: tuple[int, ...] = (200,), **kwargs: Any):
+    try:
+        resp = await _github_request(method, url, headers=headers, timeout=15, **kwargs)
+    except Exception as e:  # noqa: BLE001
+        raise _GitHubError(f"Failed to contact GitHub: {e}") from e
+    if resp.status_code not in ok:
+        endpoint = url.replace(_GITHUB_API, "")
+        raise _GitHubError(
+            f"GitHub {method.upper()} {endpoint} failed: {resp.status_code} {resp.text[:300]}",
+            resp.status_code,
+        )
+    return resp
+
+
+class _BranchSnapshot:
+    """Head commit and flattened blob tree ({path: blob sha}) of one branch."""
+
+    def __init__(self, head_sha: str, tree_sha: str, blobs: dict[str, dict[str, Any]],
+                 truncated: bool, etag: Optional[str]):
+        self.head_sha = head_sha
+        self.tree_sha = tree_sha
+        self.blobs = blobs  # path -> tree entry (sha, mode)
+        self.truncated = truncated  # GitHub caps recursive trees; missing paths are then unknown
+        self.etag = etag
+
+    def record_write(self, path: str, blob_sha: str) -> None:
+        """Apply our own successful write so the next request needs no tree fetch."""
+        entry = self.blobs.setdefault(path, {"path": path, "mode": "100644", "type": "blob"})
+        entry["sha"] = blob_sha
+
+
+_branch_snapshots: dict[tuple[str, str], _BranchSnapshot] = {}
+_branch_snapshots_lock = threading.Lock()
+
+
+def _invalidate_branch_snapshot(owner_repo: str, branch: str) -> None:
+    with _branch_snapshots_lock:
+        _branch_snapshots.pop((owner_repo, branch), None)
+
+
+async def _branch_snapshot(owner_repo: str, branch: str, headers: dict[str, str]) -> _BranchSnapshot:
+    """Return an up-to-date snapshot of `branch`, refreshing the cached one cheaply.
+
+    The ref is polled with If-None-Match; a 304 does not count against the
+    rate limit. The (potentially large) recursive tree is only fetched when
+    the head moved to a commit we did not write ourselves.
+    """
+    repo_url = f"{_GITHUB_API}/repos/{owner_repo}"
+    with _branch_snapshots_lock:
+        cached = _branch_snapshots.get((owner_repo, branch))
+    ref_headers = dict(headers)
+    if cached is not None and cached.etag:
+        ref_headers["If-None-Match"] = cached.etag
+    r_ref = await _github_api("get", f"{repo_url}/git/ref/heads/{branch}", ref_headers, ok=(200, 304))
+    if r_ref.status_code == 304 and cached is not None:
+        return cached
+
+    try:
+        head_sha = r_ref.json()["object"]["sha"]
+    except Exception as e:  # noqa: BLE001
+        raise _GitHubError(f"Unexpected ref response for {branch}") from e
+    etag = (getattr(r_ref, "headers", None) or {}).get("ETag")
+    if cached is not None and cached.head_sha == head_sha:
+        cached.etag = etag
+        return cached
+
+    try:
+        commit = (await _github_api("get", f"{repo_url}/git/commits/{head_sha}", headers)).json()
+        tree_sha = commit["tree"]["sha"]
+        tree = (await _github_api(
+            "get", f"{repo_url}/git/trees/{tree_sha}", headers, params={"recursive": "1"}
+        )).json()
+        blobs = {entry["path"]: entry for entry in tree.get("tree", []) if entry.get("type") == "blob"}
+    except (KeyError, TypeError, ValueError) as e:
+        raise _GitHubError(f"Unexpected tree response for {branch}") from e
+    snapshot = _BranchSnapshot(head_sha, tree_sha, blobs, bool(tree.get("truncated")), etag)
+    with _branch_snapshots_lock:
+        _branch_snapshots[(owner_repo, branch)] = snapshot
+    return snapshot
+
+
+async def _contents_entry(owner_repo: str, ref: str, path: str, headers: dict[str, str]) -> Optional[dict[str, Any]]:
+    """Tree entry of one path at `ref` via the contents API, or None if it does not exist."""
+    resp = await _github_api("get", f"{_GITHUB_API}/repos/{owner_repo}/contents/{path}", headers,
+                             ok=(200, 404), params={"ref": ref})
+    if resp.status_code == 404:
+        return None
+    data = resp.json()
+    if not isinstance(data, dict) or data.get("type") != "file":
+        raise _GitHubError(f"{path} exists at {ref} but is not a file", 409)
+    return {"path": path, "sha": data.get("sha"), "mode": "100644", "type": "blob"}
+
+
+async def _write_files_one_by_one(owner_repo: str, branch: str, files: dict[str, str], message: str,
+                                  headers: dict[str, str]) -> dict[str, Any]:
+    """Batch fallback through the contents API: one commit per changed file, in order."""
+    results: list[dict[str, Any]] = []
+    commit_sha: Optional[str] = None
+    for path, text in files.items():
+        written = await _write_file(owner_repo, branch, path, text, message, headers)
+        commit_sha = written["commit_sha"] or commit_sha
+        results.append({"path": path, "action": written["action"],
+                        "blob_sha": _git_blob_sha(text.encode("utf-8")), "commit_sha": written["commit_sha"]})
+    return {"commit_sha": commit_sha, "html_url": None, "files": results, "attempts": 1}
+
+
+async def _commit_files(owner_repo: str, branch: str, files: dict[str, str], message: str,
+                  headers: dict[str, str]) -> dict[str, Any]:
+    """Write all `files` ({path: text}) to `branch` as a single commit."""
+    repo_url = f"{_GITHUB_API}/repos/{owner_repo}"
+    max_attempts = max(1, _env_int("GITHUB_COMMIT_MAX_ATTEMPTS", 3))
+    encoded = {path: text.encode("utf-8") for path, text in files.items()}
+    local_shas = {path: _git_blob_sha(data) for path, data in encoded.items()}
+
+    for attempt in range(1, max_attempts + 1):
+        try:
+            snapshot = await _branch_snapshot(owner_repo, branch, headers)
+        except _GitHubError as e:
+            if attempt > 1:
+                raise
+            # No ref or base tree to build on (e.g. an empty repository).
+            print(f"[batch] Snapshot of {owner_repo}@{branch} unavailable ({e}); writing files one by one")
+            return await _write_files_one_by_one(owner_repo, branch, files, message, headers)
+        head_sha = snapshot.head_sha
+        existing = snapshot.blobs
+
+        results: list[dict[str, Any]] = []
+        tree_entries: list[dict[str, Any]] = []
+        for path, text in files.items():
+            current = existing.get(path)
+            if current is None and snapshot.truncated:
+                # The tree listing was cut short: absence proves nothing, so ask for this path.
+                current = await _contents_entry(owner_repo, head_sha, path, headers)
+                if current is not None:
+                    existing[path] = current  # known at this head from now on
+            if current is None:
+                action = "created"
+            elif current.get("sha") == local_shas[path]:
+                action = "unchanged"
+            else:
+                action = "updated"
+            results.append({"path": path, "action": action, "blob_sha": local_shas[path]})
+            if action != "unchanged":
+                tree_entries.append({
+                    "path": path,
+                    "mode": (current or {}).get("mode", "100644"),
+                    "type": "blob",
+                    "content": text,
+                })
+
+        if not tree_entries:
+            return {"commit_sha": None, "files": results, "attempts": attempt}
+
+        new_tree = (await _github_api(
+            "post", f"{repo_url}/git/trees", headers, ok=(201,),
+            json={"base_tree": snapshot.tree_sha, "tree": tree_entries},
+        )).json()
+        new_commit = (await _github_api(
+            "post", f"{repo_url}/git/commits", headers, ok=(201,),
+            json={"message": message, "tree": new_tree["sha"], "parents": [head_sha]},
+        )).json()
+        try:
+            await _github_api(
+                "patch", f"{repo_url}/git/refs/heads/{branch}", headers,
+                json={"sha": new_commit["sha"], "force": False},
+            )
+        except _GitHubError as e:
+            # 422 "Update is not a fast forward": someone else committed; rebuild on the new head.
+            _invalidate_branch_snapshot(owner_repo, branch)
+            if e.status in (409, 422) and attempt < max_attempts:
+                continue
+            raise
+        for entry in results:
+            if entry["action"] != "unchanged":
+                snapshot.record_write(entry["path"], entry["blob_sha"])
+        snapshot.head_sha, snapshot.tree_sha = new_commit["sha"], new_tree["sha"]
+        return {
+            "commit_sha": new_commit["sha"],
+            "html_url": new_commit.get("html_url"),
+            "files": results,
+            "attempts": attempt,
+        }
+    raise _GitHubError("Branch head kept moving; giving up", 409)  # pragma: no cover - loop always returns
+
+
+async def _write_file(owner_repo: str, branch: str, path: str, content_text: str, commit_message: str,
+                headers: dict[str, str]) -> dict[str, Any]:
+    """Create or update one file through the contents API; raises _GitHubError."""
+    content_bytes = content_text.encode("utf-8")
+    local_sha = _git_blob_sha(content_bytes)
+    get_url = f"{_GITHUB_API}/repos/{owner_repo}/contents/{path}"
+
+    # Step 1: find the existing blob sha from the cached branch snapshot. An
+    # identical blob means there is nothing to commit. If the snapshot is
+    # unavailable (e.g. empty repo) or truncated, ask the contents API.
+    sha: str | None = None
+    known = False
+    try:
+        snapshot: Optional[_BranchSnapshot] = await _branch_snapshot(owner_repo, branch, headers)
+    except _GitHubError:
+        snapshot = None
+    if snapshot is not None:
+        entry = snapshot.blobs.get(path)
+        if entry is not None:
+            if entry.get("sha") == local_sha:
+                return {
+                    "status": "ok",
+                    "action": "unchanged",
+                    "repo": owner_repo,
+                    "path": path,
+                    "branch": branch,
+                    "commit_sha": None,
+                    "html_url": f"https://github.com/{owner_repo}/blob/{branch}/{path}",
+                }
+            sha, known = entry.get("sha"), True
+        elif not snapshot.truncated:
+            known = True
+
+    b64_content = _b64.b64encode(content_bytes).decode("ascii")
+    for attempt in (1, 2):
+        if not known:
+            params = {"ref": branch}
+            try:
+                r_get = await _github_request("get", get_url, headers=headers, params=params, timeout=10)
+            except Exception as e:  # noqa: BLE001
+                raise _GitHubError(f"Failed to contact GitHub: {e}") from e
+
+            if r_get.status_code == 200:
+                try:
+                    data_existing = r_get.json()
+                    sha = data_existing.get("sha")
+                except Exception:  # pragma: no cover - defensive
+                    pass
+            elif r_get.status_code not in (404,):  # other errors propagate
+                raise _GitHubError(f"GitHub GET failed: {r_get.status_code} {r_get.text[:300]}")
+            if sha == local_sha:
+                return {
+                    "status": "ok",
+                    "action": "unchanged",
+                    "repo": owner_repo,
+                    "path": path,
+                    "branch": branch,
+                    "commit_sha": None,
+                    "html_url": f"https://github.com/{owner_repo}/blob/{branch}/{path}",
+                }
+
+        put_url = get_url
+        payload_put: dict[str, Any] = {
+            "message": commit_message,
+            "content": b64_content,
+            "branch": branch,
+        }
+        if sha:
+            payload_put["sha"] = sha
+
+        try:
+            r_put = await _github_request("put", put_url, headers=headers, json=payload_put, timeout=15)
+        except Exception as e:  # noqa: BLE001
+            raise _GitHubError(f"GitHub PUT failed: {e}") from e
+
+        if r_put.status_code in (409, 422) and known and attempt == 1:
+            # The snapshot was stale (someone else wrote the file); re-read its sha.
+            _invalidate_branch_snapshot(owner_repo, branch)
+            snapshot, known, sha = None, False, None
+            continue
+        break
+
+    if r_put.status_code not in (200, 201):
+        raise _GitHubError(f"GitHub PUT failed: {r_put.status_code} {r_put.text[:300]}")
+
+    try:
+        result = r_put.json()
+    except Exception:  # pragma: no cover - defensive
+        result = {}
+
+    commit_sha = (
+        (result.get("commit") or {}).get("sha")
+        if isinstance(result.get("commit"), dict) else None
+    )
+    html_url = result.get("content", {}).get("html_url") if isinstance(result.get("content"), dict) else None
+    new_tree_sha = ((result.get("commit") or {}).get("tree") or {}).get("sha") \
+        if isinstance(result.get("commit"), dict) else None
+    parents = (result.get("commit") or {}).get("parents") if isinstance(result.get("commit"), dict) else None
+    parent_sha = parents[0].get("sha") if parents and isinstance(parents[0], dict) else None
+    # Only fast-forward the snapshot over our own commit: if another writer
+    # landed in between, the snapshot is missing their changes.
+    if snapshot is not None and commit_sha and new_tree_sha and parent_sha == snapshot.head_sha:
+        snapshot.record_write(path, local_sha)
+        snapshot.head_sha, snapshot.tree_sha = commit_sha, new_tree_sha
+    else:
+        _invalidate_branch_snapshot(owner_repo, branch)
+
+    action = "updated" if sha else "created"
+    return {
+        "status": "ok",
+        "action": action,
+        "repo": owner_repo,
+        "path": path,
+        "branch": branch,
+        "commit_sha": commit_sha,
+        "html_url": html_url,
+    }
+
+
+# ---------------------------------------------------------------
+# Debounced commit coalescing.
+# A sync cycle sends a burst of single-file writes, each of which used to be
+# its own contents-API commit and could race other writers on the same path
+# (409). With WRITE_COALESCE_WINDOW_MS > 0, single-file writes are buffered
+# per (repo, branch) until no new write has arrived for the window (or
+# WRITE_COALESCE_MAX_WAIT_MS after the first one), then flushed as one Git
+# Data API commit with last-write-wins per path. Flushes of one branch run
+# one at a time. Every caller waits for the flush and gets its commit sha.
+# ---------------------------------------------------------------
+def _as_github_error(e: Exception) -> _GitHubError:
+    """Flush failures reach callers as _GitHubError, which write_to_repo reports as a 502."""
+    if isinstance(e, _GitHubError):
+        return e
+    error = _GitHubError(f"Commit failed: {e.__class__.__name__}: {e}")
+    error.__cause__ = e
+    return error
+
+
+class _PendingCommit:
+    def __init__(self, headers: dict[str, str], deadline: float):
+        self.headers = headers
+        self.deadline = deadline
+        self.files: dict[str, str] = {}
+        self.messages: dict[str, str] = {}
+        self.waiters: list[tuple[str, Any]] = []  # (path, asyncio.Future) in arrival order
+        self.timer: Any = None
+
+    def commit_message(self) -> str:
+        if len(self.files) == 1:
+            return next(iter(self.messages.values()))
+        lines = [f"- {path}: {message}" for path, message in self.messages.items()]
+        return f"Update {len(self.files)} file(s)\n\n" + "\n".join(lines)
+
+
+class _CommitCoalescer:
+    """Per event loop buffers of pending single-file writes, keyed by (repo, branch)."""
+
+    def __init__(self) -> None:
+        self._loops: Any = weakref.WeakKeyDictionary()  # loop -> (pending, branch locks, flush tasks)
+
+    def _state(self, loop: Any) -> tuple[dict[tuple[str, str], _PendingCommit], dict[tuple[str, str], Any], set[Any]]:
+        state = self._loops.get(loop)
+        if state is None:
+            state = self._loops[loop] = ({}, {}, set())
+        return state
+
+    async def write(self, owner_repo: str, branch: str, path: str, content_text: str, commit_message: str,
+                    headers: dict[str, str]) -> dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        pending, _locks, _tasks = self._state(loop)
+        window = max(_env_int("WRITE_COALESCE_WINDOW_MS", 0), 0) / 1000
+        max_wait = max(_env_int("WRITE_COALESCE_MAX_WAIT_MS", 5000), 0) / 1000
+        key = (owner_repo, branch)
+        batch = pending.get(key)
+        if batch is None:
+            batch = pending[key] = _PendingCommit(headers, loop.time() + max_wait)
+        batch.files[path] = content_text  # last write wins
+        batch.messages[path] = commit_message
+        future = loop.create_future()
+        batch.waiters.append((path, future))
+        if batch.timer is not None:
+            batch.timer.cancel()
+        delay = max(min(window, batch.deadline - loop.time()), 0)
+        # Flush in an empty context so the GitHub stages are not billed to whichever caller came last.
+        batch.timer = loop.call_later(delay, self._close, loop, key, batch, context=contextvars.Context())
+        with _stage("commit_coalesce"):
+            return await future
+
+    def _close(self, loop: Any, key: tuple[str, str], batch: _PendingCommit) -> None:
+        pending, _locks, tasks = self._state(loop)
+        if pending.get(key) is batch:
+            del pending[key]
+        task = loop.create_task(self._flush(loop, key, batch))
+        tasks.add(task)  # keep a reference until it finishes
+        task.add_done_callback(tasks.discard)
+
+    async def _flush(self, loop: Any, key: tuple[str, str], batch: _PendingCommit) -> None:
+        _pending, locks, _tasks = self._state(loop)
+        owner_repo, branch = key
+        lock = locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                results = await self._commit(owner_repo, branch, batch)
+        except Exception as e:  # noqa: BLE001 - every waiter gets the failure
+            error = _as_github_error(e)
+            for _path, future in batch.waiters:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        last_writer = {path: index for index, (path, _future) in enumerate(batch.waiters)}
+        for index, (path, future) in enumerate(batch.waiters):
+            if future.done():  # caller went away
+                continue
+            result = results[path]
+            if last_writer[path] != index:
+                result = {**result, "action": "superseded"}
+            future.set_result({**result, "coalesced_writes": len(batch.waiters)})
+
+    @staticmethod
+    async def _commit(owner_repo: str, branch: str, batch: _PendingCommit) -> dict[str, Any]:
+        """{path: write result} for the buffered files of one branch."""
+        outcome = await _commit_files(owner_repo, branch, batch.files, batch.commit_message(), batch.headers)
+        return {
+            entry["path"]: {
+                "status": "ok",
+                "action": entry["action"],
+                "repo": owner_repo,
+                "path": entry["path"],
+                "branch": branch,
+                # Set per file when the batch fell back to one contents-API commit per file.
+                "commit_sha": entry.get("commit_sha", outcome["commit_sha"]),
+                "html_url": f"https://github.com/{owner_repo}/blob/{branch}/{entry['path']}",
+            }
+            for entry in outcome["files"]
+        }
+
+_commit_coalescer = _CommitCoalescer()
+
+
+async def _write_repo_file(owner_repo: str, branch: str, path: str, content_text: str, commit_message: str,
+                           headers: dict[str, str]) -> dict[str, Any]:
+    """Write one file, through the commit coalescer when WRITE_COALESCE_WINDOW_MS is set."""
+    if _env_int("WRITE_COALESCE_WINDOW_MS", 0) > 0:
+        return await _commit_coalescer.write(owner_repo, branch, path, content_text, commit_message, headers)
+    return await _write_file(owner_repo, branch, path, content_text, commit_message, headers)
+
+
+# ---------------------------------------------------------------
+# Asynchronous ingestion pipeline (Azure Storage queues).
+#   POST /api/ingest     -> upload blob + status, enqueue on ingest-convert
+#   ingest-convert queue -> convert, store markdown blob, enqueue ingest-persist
+#   ingest-persist queue -> write markdown to the GitHub repo
+# Intake only stores bytes, so it is independent of conversion latency and
+# not subject to Logic App HTTP timeouts. Conversion concurrency is bounded
+# by host.json (queues.batchSize / newBatchThreshold); intake applies
+# backpressure (HTTP 429) when the convert queue is too deep. Messages that
+# fail maxDequeueCount times land in the *-poison queues and mark the job failed.
+# Works against Azurite locally (AzureWebJobsStorage=UseDevelopmentStorage=true).
+# ---------------------------------------------------------------
+_INGEST_CONTAINER = "ingest"
+_CONVERT_QUEUE = "ingest-convert"
+_PERSIST_QUEUE = "ingest-persist"
+_storage_clients: dict[str, Any] = {}
+_storage_clients_lock = threading.Lock()
+
+
+def _storage_connection() -> str:
+    conn = os.getenv("AzureWebJobsStorage")
+    if not conn:
+        raise RuntimeError("AzureWebJobsStorage is not configured")
+    return conn
+
+
+def _storage_client(key: str, create: Any) -> Any:
+    """Shared storage client built by `create()` on first use.
+
+    A failed setup (storage configured but unreachable) is remembered for
+    STORAGE_RETRY_SECONDS, so callers that fall back to local state fail
+    fast instead of each paying a connection timeout.
+    """
+    with _storage_clients_lock:
+        client = _storage_clients.get(key)
+        if client is not None:
+            return client
+        failed = _storage_clients.get(f"failed:{key}")
+        if failed is not None and time.monotonic() < failed[0]:
+            raise RuntimeError(f"Storage unavailable, not retrying yet: {failed[1]}")
+        try:
+            client = create()
+        except Exception as e:
+            _storage_clients[f"failed:{key}"] = (time.monotonic() + _env_int("STORAGE_RETRY_SECONDS", 30), str(e))
+            raise
+        _storage_clients.pop(f"failed:{key}", None)
+        _storage_clients[key] = client
+        return client
+
+
+def _blob_container():
+    """Shared ContainerClient for pipeline blobs (created on first use)."""
+    def create():
+        from azure.core.exceptions import ResourceExistsError  # type: ignore
+        from azure.storage.blob import BlobServiceClient  # type: ignore
+
+        service = BlobServiceClient.from_connection_string(_storage_connection())
+        client = service.get_container_client(_INGEST_CONTAINER)
+        try:
+            client.create_container()
+        except ResourceExistsError:
+            pass
+        return client
+
+    return _storage_client("container", create)
+
+
+def _queue_client(name: str):
+    """Shared QueueClient whose messages are base64 encoded, as queue triggers expect."""
+    def create():
+        from azure.core.exceptions import ResourceExistsError  # type: ignore
+        from azure.storage.queue import QueueClient, TextBase64EncodePolicy  # type: ignore
+
+        client = QueueClient.from_connection_string(
+            _storage_connection(), name, message_encode_policy=TextBase64EncodePolicy()
+        )
+        try:
+            client.create_queue()
+        except ResourceExistsError:
+            pass
+        return client
+
+    return _storage_client(f"queue:{name}", create)
+
+
+def _save_job(job: dict[str, Any]) -> None:
+    job["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    _blob_container().upload_blob(f"status/{job['job_id']}.json", json.dumps(job), overwrite=True)
+
+
+def _load_job(job_id: str) -> Optional[dict[str, Any]]:
+    from azure.core.exceptions import ResourceNotFoundError  # type: ignore
+
+    try:
+        raw = _blob_container().download_blob(f"status/{job_id}.json").readall()
+    except ResourceNotFoundError:
+        return None
+    return json.loads(raw)
+
+
+def _update_job(job_id: str, **changes: Any) -> dict[str, Any]:
+    job = _load_job(job_id) or {"job_id": job_id}
+    job.update(changes)
+    _save_job(job)
+    return job
+
+
+def _ingest_convert(job_id: str) -> None:
+    """Convert stage: uploaded blob -> markdown blob, then hand off to persist."""
+    job = _load_job(job_id)
+    if job is None or job.get("state") in ("completed", "failed"):
+        return  # duplicate delivery of an already finished job
+    _update_job(job_id, state="converting")
+    downloader = _blob_container().download_blob(f"uploads/{job_id}")
+    if downloader.size > _upload_limits()[1]:
+        spool = _spool_file(job["filename"])
+        downloader.readinto(spool)
+        spool.flush()
+        upload = _Upload(job["filename"], job.get("content_type"), job["sha256"], downloader.size,
+                         stream=spool, spooled=True)
+    else:
+        data = downloader.readall()
+        upload = _Upload(job["filename"], job.get("content_type"), job["sha256"], len(data), data=data)
+    # Queue work waits for memory rather than being rejected; the message stays invisible meanwhile.
+    with contextlib.closing(upload), _memory_budget.reserve(_conversion_cost(upload.size), None):
+        markdown_text, cache_status = _convert_upload(upload)
+    _blob_container().upload_blob(f"markdown/{job_id}.md", markdown_text or "", overwrite=True)
+    if job.get("target"):
+        _update_job(job_id, state="converted", cache=cache_status)
+        _queue_client(_PERSIST_QUEUE).send_message(json.dumps({"job_id": job_id}))
+    else:
+        _update_job(job_id, state="completed", cache=cache_status)
+
+
+def _ingest_persist(job_id: str) -> None:
+    """Persist stage: write the markdown blob to the job's GitHub target."""
+    job = _load_job(job_id)
+    if job is None or job.get("state") in ("completed", "failed"):
+        return
+    target = job["target"]
+    token = os.getenv("GITHUB_TOKEN")
+    if not token:
+        raise RuntimeError("GITHUB_TOKEN environment variable not set")
+    markdown_text = _blob_container().download_blob(f"markdown/{job_id}.md").readall().decode("utf-8")
+    _update_job(job_id, state="persisting")
+    try:
+        result = _run_github(_write_repo_file(
+            target["repo"], target.get("branch") or "main", target["path"], markdown_text,
+            target.get("commit_message") or f"Update {target['path']}", _github_headers(token),
+        ))
+    except _GitHubError as e:
+        _update_job(job_id, state="converted", last_error=str(e))
+        raise  # let the host retry; repeated failures end in the poison queue
+    _update_job(job_id, state="completed", result=result)
+    _manifest_record({**(job.get("source") or {}), "sha256": job.get("sha256")}, result)
+
+
+# ---------------------------------------------------------------
+# Incremental sync manifest (Azure Table storage).
+# One row per source item (PartitionKey=source, RowKey=item id) recording
+# the source ETag / sha256, the converter version and where the Markdown was
+# written. The Logic App asks /api/should_process before downloading a file,
+# so unchanged items are skipped without transferring or converting bytes.
+# Rows are written after a successful repo write (write_to_repo or the
+# ingest pipeline) when the caller supplies an item_id.
+# ---------------------------------------------------------------
+_MANIFEST_TABLE = "ingestmanifest"
+
+
+def _manifest_table():
+    with _storage_clients_lock:
+        client = _storage_clients.get("manifest")
+        if client is None:
+            from azure.data.tables import TableClient  # type: ignore
+
+            client = TableClient.from_connection_string(_storage_connection(), _MANIFEST_TABLE)
+            try:
+                client.create_table()
+            except Exception:  # noqa: BLE001 - already exists
+                pass
+            _storage_clients["manifest"] = client
+        return client
+
+
+def _manifest_keys(item_id: str, source: Optional[str]) -> tuple[str, str]:
+    from urllib.parse import quote
+
+    # '/', '\\', '#' and '?' are not allowed in table keys.
+    return quote(source or "sharepoint", safe=""), quote(str(item_id), safe="")
+
+
+def _manifest_get(item_id: str, source: Optional[str] = None) -> Optional[dict[str, Any]]:
+    from azure.core.exceptions import ResourceNotFoundError  # type: ignore
+
+    partition, row = _manifest_keys(item_id, source)
+    try:
+        entity = _manifest_table().get_entity(partition_key=partition, row_key=row)
+    except ResourceNotFoundError:
+        return None
+    return {k: v for k, v in dict(entity).items() if k not in ("PartitionKey", "RowKey")}
+
+
+def _manifest_record(fields: dict[str, Any], output: dict[str, Any]) -> None:
+    """Best-effort upsert of the manifest row for a successfully written item."""
+    item_id = fields.get("item_id")
+    if not item_id:
+        return
+    partition, row = _manifest_keys(item_id, fields.get("source"))
+    entity = {
+        "PartitionKey": partition,
+        "RowKey": row,
+        "item_id": str(item_id),
+        "source_etag": fields.get("source_etag") or "",
+        "sha256": fields.get("sha256") or "",
+        "converter_version": _converter_version(),
+        "output_repo": output.get("repo") or "",
+        "output_branch": output.get("branch") or "",
+        "output_path": output.get("path") or "",
+        "commit_sha": output.get("commit_sha") or "",
+        "indexed_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    try:
+        with _stage("manifest"):
+            _manifest_table().upsert_entity(entity)
+    except Exception as e:  # noqa: BLE001 - never fail a write because of bookkeeping
+        print(f"[manifest] Failed to record {item_id}: {e}")
+
+
+def _manifest_decision(record: Optional[dict[str, Any]], etag: Optional[str],
+                       sha256: Optional[str]) -> tuple[bool, str]:
+    """Return (should_process, reason) for an item given its manifest row."""
+    if record is None:
+        return True, "new"
+    if record.get("converter_version") != _converter_version():
+        return True, "converter_changed"
+    if etag and record.get("source_etag") != etag:
+        return True, "etag_changed"
+    if sha256 and record.get("sha256") != sha256:
+        return True, "sha256_changed"
+    if not etag and not sha256:
+        return True, "no_fingerprint"
+    return False, "unchanged"
+
+
+# ---------------------------------------------------------------
+# Page-level extraction (?format=ndjson).
+# Yields Markdown per PDF page / PPTX slide so callers can index per page
+# and restrict work to a page range. The records are collected into one
+# response body (func.HttpResponse cannot stream).
+# PDFs are walked page by page (pdfplumber for form-style pages, pdfminer
+# otherwise, mirroring MarkItDown's PDF converter) and pages outside the
+# requested range are never extracted. Other formats yield one record.
+# ---------------------------------------------------------------
+_PDF_TYPES = ("application/pdf", "application/x-pdf")
+_PPTX_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+_SLIDE_MARKER = re.compile(r"\n*<!-- Slide number: (\d+) -->\n")
+
+
+class _PageSelection:
+    """Predicate over 1-based page numbers; picklable so it can cross to a worker."""
+
+    def __init__(self, ranges: Optional[list[tuple[int, Optional[int]]]] = None):
+        self.ranges = ranges  # None = all pages
+
+    def __call__(self, page: int) -> bool:
+        if self.ranges is None:
+            return True
+        return any(lo <= page and (hi is None or page <= hi) for lo, hi in self.ranges)
+
+
+def _parse_page_ranges(spec: Optional[str]) -> _PageSelection:
+    """Parse "1-3,5,8-" into a predicate over 1-based page numbers (None = all pages)."""
+    if not spec:
+        return _PageSelection()
+    ranges: list[tuple[int, Optional[int]]] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, sep, end = part.partition("-")
+        lo = int(start) if start.strip() else 1
+        hi = (int(end) if end.strip() else None) if sep else lo
+        if lo < 1 or (hi is not None and hi < lo):
+            raise ValueError(f"invalid page range '{part}'")
+        ranges.append((lo, hi))
+    return _PageSelection(ranges)
+
+
+def _pdf_page_helpers():
+    """MarkItDown's per-page PDF helpers, or plain fallbacks if its internals move."""
+    try:
+        from markitdown.converters._pdf_converter import (  # type: ignore
+            _extract_form_content_from_words,
+            _merge_partial_numbering_lines,
+        )
+        return _extract_form_content_from_words, _merge_partial_numbering_lines
+    except ImportError:  # pragma: no cover - depends on markitdown version
+        return (lambda page: None), (lambda text: text)
+
+
+def _iter_pdf_pages(stream: Any, wanted) -> Iterator[tuple[int, str]]:
+    import pdfplumber  # type: ignore
+    from pdfminer.converter import TextConverter  # type: ignore
+    from pdfminer.layout import LAParams  # type: ignore
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager  # type: ignore
+
+    form_content, merge_numbering = _pdf_page_helpers()
+    resources = PDFResourceManager()
+    buffer = io.StringIO()
+    device = TextConverter(resources, buffer, laparams=LAParams())
+    interpreter = PDFPageInterpreter(resources, device)
+    try:
+        with pdfplumber.open(stream) as pdf:
+            for number, page in enumerate(pdf.pages, start=1):
+                if not wanted(number):
+                    continue
+                try:
+                    text = form_content(page)
+                    if text is None:
+                        interpreter.process_page(page.page_obj)
+                        text = buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate()
+                finally:
+                    page.close()  # keep memory flat across pages
+                yield number, merge_numbering(text).strip()
+    finally:
+        device.close()
+
+
+def _pdf_pages_bytes(data: bytes, wanted: _PageSelection) -> list[tuple[int, str]]:
+    """Supervised-pool entry point: the selected pages of an in-memory PDF."""
+    return list(_iter_pdf_pages(io.BytesIO(data), wanted))
+
+
+def _pdf_pages_file(path: str, wanted: _PageSelection) -> list[tuple[int, str]]:
+    """Supervised-pool entry point for spooled PDFs: the worker reads the file itself."""
+    with open(path, "rb") as fh:
+        return list(_iter_pdf_pages(fh, wanted))
+
+
+def _split_slides(markdown_text: str) -> Iterator[tuple[int, str]]:
+    parts = _SLIDE_MARKER.split(markdown_text)
+    # parts = [preamble, num1, body1, num2, body2, ...]
+    for i in range(1, len(parts) - 1, 2):
+        yield int(parts[i]), parts[i + 1].strip()
+
+
+def _iter_pages(upload: _Upload, wanted) -> Iterator[tuple[int, str]]:
+    """Yield (page_number, markdown) for the pages of `upload` selected by `wanted`."""
+    lower = upload.filename.lower()
+    if upload.content_type in _PDF_TYPES or lower.endswith(".pdf"):
+        try:
+            if _isolation_enabled():
+                # Pages are collected in the worker, so the whole walk is bounded.
+                path = upload.path
+                if path is not None:
+                    yield from _run_isolated(_format_key(upload), _pdf_pages_file, path, wanted)
+                else:
+                    yield from _run_isolated(_format_key(upload), _pdf_pages_bytes, upload.read_bytes(), wanted)
+            else:
+                yield from _iter_pdf_pages(upload.open(), wanted)
+            return
+        except Exception as e:  # noqa: BLE001
+            yield 1, _extraction_failed(e)
+            return
+    markdown_text, _cache_status = _convert_upload(upload)
+    markdown_text = markdown_text or ""
+    if upload.content_type == _PPTX_TYPE or lower.endswith(".pptx"):
+        for number, text in _split_slides(markdown_text):
+            if wanted(number):
+                yield number, text
+        return
+    if wanted(1):
+        yield 1, markdown_text.strip()
+
+
+# ---------------------------------------------------------------
+# Parallel page-range conversion.
+# Large PDFs and decks are split into contiguous page/slide ranges that are
+# converted on the shared process pool and stitched back in order. The
+# stitching reproduces MarkItDown's serial output; anything unexpected
+# (unreadable file, a failed range) falls back to the serial path.
+# ---------------------------------------------------------------
+_MIN_RANGE_PAGES = 4
+_SLIDE_NUMBER = re.compile(r"<!-- Slide number: (\d+) -->")
+
+
+def _page_ranges(count: int, max_ranges: int) -> list[tuple[int, int]]:
+    """Split pages [0, count) into up to `max_ranges` contiguous, near-equal ranges."""
+    chunks = max(1, min(max_ranges, count // _MIN_RANGE_PAGES))
+    size, extra = divmod(count, chunks)
+    ranges: list[tuple[int, int]] = []
+    start = 0
+    for i in range(chunks):
+        stop = start + size + (1 if i < extra else 0)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def _normalize_markdown(text: str) -> str:
+    # Same normalisation MarkItDown applies to every converter result.
+    text = "\n".join(line.rstrip() for line in re.split(r"\r?\n", text))
+    return re.sub(r"\n{3,}", "\n\n", text)
+
+
+def _pdf_page_count(path: str) -> int:
+    from pdfminer.pdfdocument import PDFDocument  # type: ignore
+    from pdfminer.pdfpage import PDFPage  # type: ignore
+    from pdfminer.pdfparser import PDFParser  # type: ignore
+
+    with open(path, "rb") as fh:
+        return sum(1 for _ in PDFPage.create_pages(PDFDocument(PDFParser(fh))))
+
+
+def _convert_pdf_range(path: str, start: int, stop: int) -> tuple[list[str], bool, Optional[str]]:
+    """Process pool entry point: MarkItDown's PDF passes over pages [start, stop).
+
+    Returns (chunks, has_form_pages, pdfminer_text). The pdfminer text is
+    only produced when the range has no form-style pages, because a single
+    form page anywhere makes the serial converter use the chunks instead.
+    """
+    import pdfminer.high_level  # type: ignore
+    import pdfplumber  # type: ignore
+
+    form_content, _merge_numbering = _pdf_page_helpers()
+    chunks: list[str] = []
+    has_form = False
+    with pdfplumber.open(path, pages=list(range(start + 1, stop + 1))) as pdf:
+        for page in pdf.pages:
+            content = form_content(page)
+            if content is not None:
+                has_form = True
+                if content.strip():
+                    chunks.append(content)
+            else:
+                text = page.extract_text()
+                if text and text.strip():
+                    chunks.append(text.strip())
+            page.close()
+    if has_form:
+        return chunks, True, None
+    return chunks, False, pdfminer.high_level.extract_text(path, page_numbers=range(start, stop))
+
+
+def _stitch_pdf(parts: list[tuple[list[str], bool, Optional[str]]]) -> Optional[str]:
+    if any(has_form for _chunks, has_form, _text in parts):
+        markdown = "\n\n".join(chunk for chunks, _has_form, _text in parts for chunk in chunks).strip()
+    else:
+        markdown = "".join(text or "" for _chunks, _has_form, text in parts)
+    if not markdown:
+        return None  # let the serial converter apply its own empty-document fallback
+    _form_content, merge_numbering = _pdf_page_helpers()
+    return _normalize_markdown(merge_numbering(markdown))
+
+
+def _convert_pptx_range(path: str, start: int, stop: int) -> str:
+    """Process pool entry point: convert slides [start, stop) with their original numbers."""
+    import pptx  # type: ignore
+
+    deck = pptx.Presentation(path)
+    slide_ids = deck.slides._sldIdLst  # noqa: SLF001 - python-pptx has no public slide removal
+    for index, slide_id in reversed(list(enumerate(slide_ids))):
+        if not start <= index < stop:
+            # Dropping the relationship too keeps the slide part (and its media) out of the saved copy.
+            deck.part.drop_rel(slide_id.rId)
+            slide_ids.remove(slide_id)
+    buffer = io.BytesIO()
+    deck.save(buffer)
+    buffer.seek(0)
+    markdown_text = _convert_stream(buffer, "slides.pptx", use_llm=False) or ""
+    return _SLIDE_NUMBER.sub(lambda m: f"<!-- Slide number: {int(m.group(1)) + start} -->", markdown_text)
+
+
+def _pptx_slide_count(path: str) -> int:
+    import pptx  # type: ignore
+
+    return len(pptx.Presentation(path).slides)
+
+
+def _join_ranges(convert_range: Any, parts: list[Any]) -> Optional[str]:
+    if convert_range is _convert_pdf_range:
+        return _stitch_pdf(parts)
+    return _normalize_markdown("\n\n".join(part for part in parts if part))
+
+
+def _convert_ranges_isolated(upload: _Upload, convert_range: Any, path: str, count: int,
+                             max_ranges: int) -> Optional[str]:
+    """Page ranges on the supervised pool; a range that overruns fails the document."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    fmt = _format_key(upload)
+    ranges = _page_ranges(count, max_ranges)
+    with ThreadPoolExecutor(max_workers=len(ranges)) as threads:
+        futures = [threads.submit(_run_isolated, fmt, convert_range, path, start, stop) for start, stop in ranges]
+        try:
+            parts = [future.result() for future in futures]
+        except _ConversionFailure as e:
+            if e.kind in _BREAKER_KINDS or e.kind == "CircuitOpen":
+                raise
+            return None  # an ordinary error: let the serial converter report it
+    return _join_ranges(convert_range, parts)
+
+
+def _convert_parallel(upload: _Upload) -> Optional[str]:
+    """Convert a large PDF/PPTX as parallel page ranges; None means "use the serial path"."""
+    min_pages = _env_int("PAGE_PARALLEL_MIN_PAGES", 24)
+    max_ranges = _env_int("PAGE_PARALLEL_MAX_RANGES", _env_int("CONVERSION_MAX_WORKERS", os.cpu_count() or 1))
+    if min_pages <= 0 or max_ranges <= 1:
+        return None
+    if upload.size < _env_int("PAGE_PARALLEL_MIN_MB", 1) * 1024 * 1024:
+        return None  # small files convert quickly; skip the temp copy and page count
+    lower = upload.filename.lower()
+    if upload.content_type in _PDF_TYPES or lower.endswith(".pdf"):
+        count_pages, convert_range, suffix = _pdf_page_count, _convert_pdf_range, ".pdf"
+    elif upload.content_type == _PPTX_TYPE or lower.endswith(".pptx"):
+        count_pages, convert_range, suffix = _pptx_slide_count, _convert_pptx_range, ".pptx"
+    else:
+        return None
+
+    # Workers read the document from a temp file rather than receiving a
+    # pickled copy of the bytes per range; spooled uploads already have one.
+    spooled = upload.path
+    if spooled is not None:
+        path = spooled
+    else:
+        fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        if spooled is None:
+            src = upload.open()  # shared with the caller; must not be closed here
+            with os.fdopen(fd, "wb") as fh:
+                while chunk := src.read(_READ_CHUNK_BYTES):
+                    fh.write(chunk)
+        try:
+            count = count_pages(path)
+        except Exception:  # noqa: BLE001 - let the serial converter report it
+            return None
+        if count < min_pages:
+            return None
+        if _isolation_enabled():
+            return _convert_ranges_isolated(upload, convert_range, path, count, max_ranges)
+        from concurrent.futures.process import BrokenProcessPool
+
+        pool = _get_process_pool()
+        futures = [pool.submit(convert_range, path, start, stop) for start, stop in _page_ranges(count, max_ranges)]
+        try:
+            parts = [future.result() for future in futures]
+        except BrokenProcessPool:
+            _reset_process_pool()
+            return None
+        except Exception:  # noqa: BLE001
+            return None
+        finally:
+            for future in futures:
+                future.cancel()
+        return _join_ranges(convert_range, parts)
+    finally:
+        if spooled is None:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+# ---------------------------------------------------------------
+# Chunked output (?format=chunks).
+# Splits Markdown into heading-aware chunks under a token budget. Each
+# chunk ID is a hash of its heading path and text, so unchanged chunks keep
+# their IDs across document versions. The ordered ID list of every version
+# is stored under its sha256 and, optionally, a caller-supplied key, so the
+# next version can be diffed and only added chunks need re-embedding. Chunk
+# sets are kept in the ingest blob container when storage is configured,
+# and in the local conversion cache otherwise.
+# ---------------------------------------------------------------
+_HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_FENCE = re.compile(r"^\s*(```|~~~)")
+
+
+@functools.lru_cache(maxsize=1)
+def _token_encoding():
+    """tiktoken's cl100k_base encoding if installed, else None (approximate counts)."""
+    try:
+        import tiktoken  # type: ignore
 
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:  # noqa: BLE001 - optional dependency or offline
+        return None
 
-_load_local_dotenv()
 
-app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
+def _count_tokens(text: str) -> int:
+    encoding = _token_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4  # ~4 characters per token
 
 
-@app.function_name(name="process_file")
-@app.route(route="process_file", methods=[func.HttpMethod.POST], auth_level=func.AuthLevel.ANONYMOUS)
-def process_file(req: func.HttpRequest) -> func.HttpResponse:
-    """Process an uploaded document and return Markdown (default) or JSON.
+def _markdown_sections(markdown_text: str) -> list[tuple[list[str], str]]:
+    """Split Markdown at headings (outside code fences) into (heading_path, text) sections."""
+    sections: list[tuple[list[str], str]] = []
+    path: list[tuple[int, str]] = []
+    lines: list[str] = []
+    in_fence = False
 
-    Expected JSON body:
-      {
-        "filename": "example.docx",
-        "content_base64": "<base64>",
-        "content_type": "<mime type>"  # optional
-      }
+    def flush() -> None:
+        text = "\n".join(lines).strip()
+        if text:
+            sections.append(([title for _level, title in path], text))
+        lines.clear()
 
-    Default response: text/markdown (with an HTML comment header).
-    Add ?format=json for a JSON envelope.
-    """
-    import base64
-    import hashlib
+    for line in markdown_text.splitlines():
+        if _FENCE.match(line):
+            in_fence = not in_fence
+        match = None if in_fence else _HEADING.match(line)
+        if match:
+            flush()
+            level = len(match.group(1))
+            path = [entry for entry in path if entry[0] < level] + [(level, match.group(2))]
+        lines.append(line)
+    flush()
+    return sections
 
-    # ----------------------- Helper (LLM integration) ----------------------- #
-    def _is_image(fname: str, ctype: Optional[str]) -> bool:
-        if ctype and ctype.startswith("image/"):
-            return True
-        fname_lower = fname.lower()
-        return any(fname_lower.endswith(ext) for ext in (".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp", ".tiff"))
 
-    def _build_markitdown_with_optional_llm(use_llm: bool):
-        """Return a MarkItDown instance.
+def _split_to_budget(text: str, max_tokens: int) -> list[str]:
+    """Pack paragraphs (then lines, then words) into pieces of at most max_tokens."""
+    if _count_tokens(text) <= max_tokens:
+        return [text]
+    for separator, pattern in (("\n\n", r"\n\s*\n"), ("\n", r"\n"), (" ", r"\s+")):
+        parts = [p for p in re.split(pattern, text) if p.strip()]
+        if len(parts) > 1:
+            break
+    else:
+        return [text]  # a single unbreakable token run
+    pieces: list[str] = []
+    current: list[str] = []
+    for part in parts:
+        candidate = separator.join(current + [part])
+        if current and _count_tokens(candidate) > max_tokens:
+            pieces.append(separator.join(current))
+            current = []
+        current.append(part)
+    if current:
+        pieces.append(separator.join(current))
+    return [small for piece in pieces for small in _split_to_budget(piece, max_tokens)]
+
+
+def _chunk_markdown(markdown_text: str, max_tokens: int) -> list[dict[str, Any]]:
+    chunks: list[dict[str, Any]] = []
+    seen: dict[str, int] = {}
+    for heading_path, section in _markdown_sections(markdown_text):
+        for text in _split_to_budget(section, max_tokens):
+            text = text.strip()
+            basis = "\n".join(heading_path) + "\n\n" + text
+            occurrence = seen.get(basis, 0)
+            seen[basis] = occurrence + 1
+            if occurrence:  # identical repeated chunks still get distinct, stable IDs
+                basis += f"\n\n#{occurrence}"
+            chunks.append({
+                "id": hashlib.sha256(basis.encode("utf-8")).hexdigest()[:32],
+                "index": len(chunks),
+                "heading_path": heading_path,
+                "tokens": _count_tokens(text),
+                "markdown": text,
+            })
+    return chunks
+
+
+def _chunk_set_name(sha256_hash: Optional[str] = None, key: Optional[str] = None) -> str:
+    from urllib.parse import quote
+
+    if key is not None:
+        return f"chunks/by-key/{quote(key, safe='')}.json"
+    return f"chunks/by-sha/{sha256_hash}.json"
+
+
+def _chunk_set_get(name: str) -> Optional[list[str]]:
+    try:
+        from azure.core.exceptions import ResourceNotFoundError  # type: ignore
 
-        If use_llm=True and Azure/OpenAI env vars are present, attempt to enable LLM enrichment.
-        Falls back silently if anything fails. We avoid hard dependency on openai at import time so tests
-        (which don't set these vars) remain fast and offline.
-        """
         try:
-            from markitdown import MarkItDown  # type: ignore
-        except Exception:  # pragma: no cover - should not happen unless package missing
+            return json.loads(_blob_container().download_blob(name).readall())
+        except ResourceNotFoundError:
             return None
+    except Exception:  # noqa: BLE001 - storage not configured/reachable: use the local copy
+        cached = _conversion_cache.get(hashlib.sha256(name.encode("utf-8")).hexdigest())
+        return json.loads(cached) if cached is not None else None
 
-        if not use_llm:
-            # Always plain MarkItDown for non-image documents per updated requirement.
-            return MarkItDown()
 
-        # Prefer Azure OpenAI if endpoint provided
-        azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-        azure_api_key = os.getenv("AZURE_OPENAI_API_KEY")
-        azure_deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT")
-        azure_api_version = os.getenv("AZURE_OPENAI_API_VERSION")
+def _chunk_set_put(name: str, ids: list[str]) -> None:
+    value = json.dumps(ids)
+    _conversion_cache.put(hashlib.sha256(name.encode("utf-8")).hexdigest(), value)
+    try:
+        _blob_container().upload_blob(name, value.encode("utf-8"), overwrite=True)
+    except Exception as e:  # noqa: BLE001 - the local copy still serves this instance
+        print(f"[chunks] Could not persist {name}: {e}")
 
-        # Simplified prompt for images only (avoid diagram generation for non-images now)
-        llm_prompt = (
-            "If the input represents an image or visual diagram, optionally add a concise mermaid code block that approximates structural relationships. "
-            "If not appropriate, return only the extracted content with no additions."
-        )
 
-        client = None
-        model_name = None
-        # Attempt Azure first
-        if azure_endpoint and azure_api_key:
-            try:  # pragma: no cover - network not executed in tests
-                from openai import AzureOpenAI  # type: ignore
-                client = AzureOpenAI(
-                    api_key=azure_api_key,
-                    azure_endpoint=azure_endpoint,
-                    api_version=azure_api_version,
-                )
-                model_name = azure_deployment
-            except Exception as e:  # noqa: BLE001
-                print(f"[process_file] AzureOpenAI init failed: {e}")
-                client = None
+def _chunk_response(upload: _Upload, markdown_text: str, key: Optional[str],
+                    previous_sha256: Optional[str]) -> dict[str, Any]:
+    """Chunk a converted document and diff it against the previous version's chunk set."""
+    max_tokens = max(_env_int("CHUNK_MAX_TOKENS", 512), 16)
+    with _stage("chunk"):
+        chunks = _chunk_markdown(markdown_text, max_tokens)
+    ids = [chunk["id"] for chunk in chunks]
 
-        try:
-            # MarkItDown currently supports passing llm_client + llm_model + llm_prompt.
-            return MarkItDown(llm_client=client, llm_model=model_name, llm_prompt=llm_prompt)
-        except Exception as e:  # noqa: BLE001
-            print(f"[process_file] MarkItDown LLM integration failed, falling back: {e}")
+    previous_ref: Optional[str] = None
+    previous: Optional[list[str]] = None
+    with _stage("chunk_diff"):
+        if previous_sha256:
+            previous_ref, previous = f"sha256:{previous_sha256}", _chunk_set_get(_chunk_set_name(previous_sha256))
+        elif key:
+            previous_ref, previous = f"key:{key}", _chunk_set_get(_chunk_set_name(key=key))
+        previous_ids = set(previous or [])
+        for chunk in chunks:
+            chunk["status"] = "unchanged" if chunk["id"] in previous_ids else "added"
+        current_ids = set(ids)
+        _chunk_set_put(_chunk_set_name(upload.sha256), ids)
+        if key:
+            _chunk_set_put(_chunk_set_name(key=key), ids)
+
+    return {
+        "chunking": {
+            "max_tokens": max_tokens,
+            "tokenizer": "cl100k_base" if _token_encoding() is not None else "approx",
+        },
+        "chunks": chunks,
+        "diff": {
+            "previous": previous_ref if previous is not None else None,
+            "added": [i for i in ids if i not in previous_ids],
+            "removed": [i for i in (previous or []) if i not in current_ids],
+            "unchanged": [i for i in ids if i in previous_ids],
+        },
+    }
+
+
+# ---------------------------------------------------------------
+# Full-text search index (/api/search).
+# A segmented BM25 index on local disk (SEARCH_INDEX_DIR):
+# - index.json lists the immutable segments, the live document of every key
+#   (with its sha256, so re-sent unchanged documents are skipped) and the
+#   deleted (replaced) rows of each segment.
+# - New documents are appended to a write-ahead log (pending.jsonl) and
+#   become a segment once SEARCH_FLUSH_DOCS are pending; small segments are
+#   merged once there are more than SEARCH_MAX_SEGMENTS.
+# - Segment files are memory-mapped: a sorted term table searched by
+#   bisection, per-term postings (doc ids + term frequencies, uint32) scored
+#   with numpy, document lengths, and the stored Markdown for snippets.
+# Writers serialize on an flock()ed lock file, so several worker processes
+# can share one directory; readers pick up changes by watching file sizes
+# and mtimes.
+# ---------------------------------------------------------------
+_SEARCH_TOKEN = re.compile(r"\w{2,40}")
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+_TERM_RECORD = [("term_off", "<u8"), ("term_len", "<u4"), ("post_off", "<u8"), ("count", "<u4")]
+
+
+def _search_terms(text: str) -> list[str]:
+    return _SEARCH_TOKEN.findall(text.lower())
+
+
+class _Segment:
+    """Read-only, memory-mapped view of one index segment."""
+
+    def __init__(self, directory: str, name: str):
+        import mmap
+
+        import numpy as np  # type: ignore
+
+        self.name = name
+        base = os.path.join(directory, name)
+        with open(f"{base}.docs.json", "r", encoding="utf-8") as fh:
+            self.docs: list[dict[str, Any]] = json.load(fh)
+        maps: list[Any] = []
+        for suffix in ("terms", "tidx", "post", "lens", "text"):
+            with open(f"{base}.{suffix}", "rb") as fh:
+                size = os.fstat(fh.fileno()).st_size
+                maps.append(mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) if size else b"")
+        # The maps stay open for the life of the object (files are never
+        # modified, and unlinking a merged segment does not affect them).
+        self._terms, tidx, self._post, lens, self._text = maps
+        self._tidx = np.frombuffer(tidx, dtype=np.dtype(_TERM_RECORD))
+        self.lengths = np.frombuffer(lens, dtype="<u4")
+
+    def _term_at(self, index: int) -> bytes:
+        record = self._tidx[index]
+        start = int(record["term_off"])
+        return self._terms[start:start + int(record["term_len"])]
+
+    def postings(self, term: str):
+        """(doc_ids, term_frequencies) arrays for a term, or None."""
+        import numpy as np  # type: ignore
+
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self._tidx)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(self._tidx) or self._term_at(lo) != key:
+            return None
+        record = self._tidx[lo]
+        offset, count = int(record["post_off"]), int(record["count"])
+        doc_ids = np.frombuffer(self._post, dtype="<u4", count=count, offset=offset)
+        freqs = np.frombuffer(self._post, dtype="<u4", count=count, offset=offset + 4 * count)
+        return doc_ids, freqs
+
+    def text(self, doc_id: int) -> str:
+        doc = self.docs[doc_id]
+        return bytes(self._text[doc["text_off"]:doc["text_off"] + doc["text_len"]]).decode("utf-8", "replace")
+
+
+
+def _write_segment(directory: str, name: str, docs: list[dict[str, Any]]) -> list[int]:
+    """Write `docs` ({key, sha256, title, text}) as a new immutable segment; returns doc lengths."""
+    import numpy as np  # type: ignore
+
+    postings: dict[str, list[tuple[int, int]]] = {}
+    lengths: list[int] = []
+    records: list[dict[str, Any]] = []
+    text_parts: list[bytes] = []
+    text_off = 0
+    for doc_id, doc in enumerate(docs):
+        terms = _search_terms(doc["text"])
+        lengths.append(len(terms))
+        counts: dict[str, int] = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((doc_id, tf))
+        encoded = doc["text"].encode("utf-8")
+        records.append({"key": doc["key"], "sha256": doc["sha256"], "title": doc.get("title") or "",
+                        "text_off": text_off, "text_len": len(encoded)})
+        text_parts.append(encoded)
+        text_off += len(encoded)
+
+    base = os.path.join(directory, name)
+    terms_blob = bytearray()
+    post_blob = bytearray()
+    table = np.zeros(len(postings), dtype=np.dtype(_TERM_RECORD))
+    for index, term in enumerate(sorted(postings, key=lambda t: t.encode("utf-8"))):
+        entries = postings[term]
+        encoded_term = term.encode("utf-8")
+        table[index] = (len(terms_blob), len(encoded_term), len(post_blob), len(entries))
+        terms_blob += encoded_term
+        post_blob += np.array([d for d, _ in entries], dtype="<u4").tobytes()
+        post_blob += np.array([tf for _, tf in entries], dtype="<u4").tobytes()
+    outputs = {
+        "terms": bytes(terms_blob),
+        "tidx": table.tobytes(),
+        "post": bytes(post_blob),
+        "lens": np.array(lengths, dtype="<u4").tobytes(),
+        "text": b"".join(text_parts),
+        "docs.json": json.dumps(records).encode("utf-8"),
+    }
+    for suffix, data in outputs.items():
+        with open(f"{base}.{suffix}", "wb") as fh:
+            fh.write(data)
+    return lengths
+
+
+class _SearchIndex:
+    """Incremental BM25 index over converted Markdown, shared through a directory."""
+
+    def __init__(self, directory: str, flush_docs: int = 200, max_segments: int = 8):
+        self.directory = directory
+        self.flush_docs = max(flush_docs, 1)
+        self.max_segments = max(max_segments, 2)
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._manifest: dict[str, Any] = {"segments": [], "next": 0, "docs": {}, "deleted": {}, "live_length": 0}
+        self._manifest_stamp: Any = None
+        self._segments: dict[str, _Segment] = {}
+        self._deleted_masks: dict[str, Any] = {}
+        self._pending: list[dict[str, Any]] = []
+        self._wal_offset = 0
+        self._flushing = False
+
+    @classmethod
+    def from_env(cls) -> Optional["_SearchIndex"]:
+        if not _env_flag("SEARCH_INDEX_ENABLED"):
+            return None
+        directory = os.getenv("SEARCH_INDEX_DIR") or os.path.join(tempfile.gettempdir(), "artifacts-indexing-search")
+        return cls(directory, _env_int("SEARCH_FLUSH_DOCS", 200), _env_int("SEARCH_MAX_SEGMENTS", 8))
+
+    # -- files -------------------------------------------------------
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @contextlib.contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        with self._lock, open(self._path("index.lock"), "a+") as fh:
             try:
-                return MarkItDown()
-            except Exception:
-                return None
+                import fcntl
+
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            except ImportError:  # pragma: no cover - non-POSIX: in-process lock only
+                pass
+            yield
+
+    def _refresh(self) -> None:
+        """Pick up segments flushed and documents logged by any process."""
+        import numpy as np  # type: ignore
+
+        with self._lock:
+            try:
+                st = os.stat(self._path("index.json"))
+                stamp = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                stamp = None
+            if stamp != self._manifest_stamp:
+                if stamp is not None:
+                    with open(self._path("index.json"), "r", encoding="utf-8") as fh:
+                        self._manifest = json.load(fh)
+                for name in list(self._segments):
+                    if name not in self._manifest["segments"]:
+                        del self._segments[name]
+                for name in self._manifest["segments"]:
+                    if name not in self._segments:
+                        self._segments[name] = _Segment(self.directory, name)
+                self._deleted_masks = {}
+                for name, rows in self._manifest["deleted"].items():
+                    mask = np.zeros(len(self._segments[name].docs), dtype=bool)
+                    mask[rows] = True
+                    self._deleted_masks[name] = mask
+                self._manifest_stamp = stamp
+            try:
+                wal_size = os.path.getsize(self._path("pending.jsonl"))
+            except OSError:
+                wal_size = 0
+            if wal_size < self._wal_offset:  # flushed (truncated) by another process
+                self._pending, self._wal_offset = [], 0
+            if wal_size > self._wal_offset:
+                with open(self._path("pending.jsonl"), "rb") as fh:
+                    fh.seek(self._wal_offset)
+                    data = fh.read(wal_size - self._wal_offset)
+                complete = data[:data.rfind(b"\n") + 1]  # ignore a line still being written
+                for line in complete.splitlines():
+                    doc = json.loads(line)
+                    terms = _search_terms(doc["text"])
+                    counts: dict[str, int] = {}
+                    for term in terms:
+                        counts[term] = counts.get(term, 0) + 1
+                    doc["_counts"], doc["_length"] = counts, len(terms)
+                    self._pending.append(doc)
+                self._wal_offset += len(complete)
+
+    def _write_manifest(self) -> None:
+        tmp_path = self._path(f"index.json.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(self._manifest, fh)
+        os.replace(tmp_path, self._path("index.json"))
+
+    # -- writes ------------------------------------------------------
+    def add(self, key: str, sha256_hash: str, text: str, title: str = "") -> str:
+        """Index a document version; returns "indexed" or "unchanged"."""
+        with self._file_lock():
+            self._refresh()
+            latest = next((d for d in reversed(self._pending) if d["key"] == key), None)
+            current_sha = latest["sha256"] if latest else (self._manifest["docs"].get(key) or [None, None, None])[2]
+            if current_sha == sha256_hash:
+                return "unchanged"
+            line = json.dumps({"key": key, "sha256": sha256_hash, "title": title, "text": text}) + "\n"
+            with open(self._path("pending.jsonl"), "ab") as fh:
+                fh.write(line.encode("utf-8"))
+            self._refresh()
+            should_flush = len(self._pending) >= self.flush_docs and not self._flushing
+            if should_flush:
+                self._flushing = True
+        if should_flush:
+            threading.Thread(target=self._background_flush, name="search-flush", daemon=True).start()
+        return "indexed"
+
+    def _background_flush(self) -> None:
+        try:
+            self.flush()
+        except Exception as e:  # noqa: BLE001 - documents stay in the log and are retried
+            print(f"[search] Flush failed: {e}")
+        finally:
+            self._flushing = False
+
+    def flush(self) -> None:
+        """Turn the pending log into a segment, then merge small segments if needed."""
+        with self._file_lock():
+            self._refresh()
+            if not self._pending:
+                return
+            latest: dict[str, dict[str, Any]] = {}
+            for doc in self._pending:
+                latest[doc["key"]] = doc
+            self._commit_segment(list(latest.values()))
+            os.truncate(self._path("pending.jsonl"), 0)
+            self._pending, self._wal_offset = [], 0
+            if len(self._manifest["segments"]) > self.max_segments:
+                self._merge()
+
+    def _commit_segment(self, docs: list[dict[str, Any]], replaced: Optional[list[str]] = None) -> None:
+        manifest = self._manifest
+        name = f"seg{manifest['next']:06d}"
+        manifest["next"] += 1
+        lengths = _write_segment(self.directory, name, docs)
+        for doc_id, doc in enumerate(docs):
+            previous = manifest["docs"].get(doc["key"])
+            if previous is not None:  # a new version replaces the old row
+                manifest["deleted"].setdefault(previous[0], []).append(previous[1])
+                manifest["live_length"] -= previous[3]
+            manifest["docs"][doc["key"]] = [name, doc_id, doc["sha256"], lengths[doc_id]]
+            manifest["live_length"] += lengths[doc_id]
+        for old in replaced or []:
+            manifest["deleted"].pop(old, None)
+        manifest["segments"] = [s for s in manifest["segments"] if s not in (replaced or [])] + [name]
+        self._write_manifest()
+        self._refresh()
+        for old in replaced or []:
+            for suffix in ("terms", "tidx", "post", "lens", "text", "docs.json"):
+                try:
+                    os.remove(self._path(f"{old}.{suffix}"))
+                except OSError:
+                    pass
+
+    def _merge(self) -> None:
+        by_size = sorted(self._manifest["segments"], key=lambda n: len(self._segments[n].docs))
+        victims = by_size[: max(2, len(by_size) // 2)]
+        live: list[dict[str, Any]] = []
+        for name in victims:
+            segment = self._segments[name]
+            deleted = set(self._manifest["deleted"].get(name, []))
+            for doc_id, doc in enumerate(segment.docs):
+                if doc_id not in deleted:
+                    live.append({"key": doc["key"], "sha256": doc["sha256"], "title": doc["title"],
+                                 "text": segment.text(doc_id)})
+        for doc in live:  # the rows move; they are not new versions
+            entry = self._manifest["docs"][doc["key"]]
+            self._manifest["live_length"] -= entry[3]
+            self._manifest["docs"].pop(doc["key"])
+        self._commit_segment(live, replaced=victims)
+
+    # -- reads -------------------------------------------------------
+    def search(self, query: str, top: int = 10) -> tuple[int, list[dict[str, Any]]]:
+        """Return (matching document count, top results with snippets)."""
+        import math
+
+        import numpy as np  # type: ignore
+
+        self._refresh()
+        terms = list(dict.fromkeys(_search_terms(query)))
+        if not terms:
+            return 0, []
+        with self._lock:
+            segments = [self._segments[name] for name in self._manifest["segments"]]
+            masks = dict(self._deleted_masks)
+            pending = list(self._pending)
+            manifest_docs = self._manifest["docs"]
+            live_length = self._manifest["live_length"]
+        latest_pending = {d["key"]: d for d in pending}
+        # Rows superseded by a newer, not yet flushed version.
+        superseded: dict[str, list[int]] = {}
+        for key in latest_pending:
+            if key in manifest_docs:
+                superseded.setdefault(manifest_docs[key][0], []).append(manifest_docs[key][1])
+        total_docs = len(manifest_docs) + sum(1 for key in latest_pending if key not in manifest_docs)
+        total_length = live_length + sum(d["_length"] for d in latest_pending.values())
+        avg_length = (total_length / total_docs) if total_docs else 1.0
+
+        # Deleted rows and rows superseded by a pending version do not count.
+        dead: dict[str, Any] = {}
+        for segment in segments:
+            mask = masks.get(segment.name)
+            if segment.name in superseded:
+                mask = np.zeros(len(segment.docs), dtype=bool) if mask is None else mask.copy()
+                mask[superseded[segment.name]] = True
+            if mask is not None:
+                dead[segment.name] = mask
+
+        postings = {(t, seg.name): seg.postings(t) for t in terms for seg in segments}
+        idf = {}
+        for term in terms:
+            df = sum(1 for d in latest_pending.values() if term in d["_counts"])
+            for (t, name), found in postings.items():
+                if t == term and found is not None:
+                    df += int((~dead[name][found[0]]).sum()) if name in dead else len(found[0])
+            idf[term] = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+
+        candidates: list[tuple[float, Any, int]] = []
+        matched = 0
+        for segment in segments:
+            if not len(segment.docs):
+                continue
+            scores = np.zeros(len(segment.docs), dtype=np.float64)
+            norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * segment.lengths / avg_length)
+            for term in terms:
+                found = postings[(term, segment.name)]
+                if found is None:
+                    continue
+                doc_ids, freqs = found
+                tf = freqs.astype(np.float64)
+                scores += np.bincount(doc_ids, weights=idf[term] * tf * (_BM25_K1 + 1) / (tf + norm[doc_ids]),
+                                      minlength=len(segment.docs))
+            if segment.name in dead:
+                scores[dead[segment.name]] = 0
+            hits = np.flatnonzero(scores)
+            matched += len(hits)
+            if len(hits) > top:
+                hits = hits[np.argpartition(-scores[hits], top)[:top]]
+            candidates.extend((float(scores[i]), segment, int(i)) for i in hits)
+
+        for doc in latest_pending.values():
+            norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * doc["_length"] / avg_length)
+            score = sum(idf[t] * doc["_counts"][t] * (_BM25_K1 + 1) / (doc["_counts"][t] + norm)
+                        for t in terms if t in doc["_counts"])
+            if score > 0:
+                matched += 1
+                candidates.append((score, None, doc))
+
+        candidates.sort(key=lambda c: -c[0])
+        results = []
+        for score, segment, ref in candidates[:top]:
+            if segment is None:
+                doc, text = ref, ref["text"]
+            else:
+                doc, text = segment.docs[ref], segment.text(ref)
+            results.append({
+                "key": doc["key"],
+                "sha256": doc["sha256"],
+                "title": doc.get("title") or "",
+                "score": round(score, 4),
+                "snippet": _search_snippet(text, terms),
+            })
+        return matched, results
+
+
+def _search_snippet(text: str, terms: list[str], width: int = 240) -> str:
+    pattern = re.compile(r"\b(" + "|".join(re.escape(t) for t in terms) + r")\b", re.IGNORECASE)
+    match = pattern.search(text)
+    start = max(0, (match.start() if match else 0) - width // 3)
+    window = text[start:start + width]
+    snippet = " ".join(pattern.sub(lambda m: f"**{m.group(0)}**", window).split())
+    return ("…" if start else "") + snippet + ("…" if start + width < len(text) else "")
+
+
+_search_index_instance: Optional[_SearchIndex] = None
+_search_index_lock = threading.Lock()
+
+
+def _search_index() -> Optional[_SearchIndex]:
+    """The process-wide search index, or None when SEARCH_INDEX_ENABLED is off."""
+    global _search_index_instance
+    if _search_index_instance is None and _env_flag("SEARCH_INDEX_ENABLED"):
+        with _search_index_lock:
+            if _search_index_instance is None:
+                _search_index_instance = _SearchIndex.from_env()
+    return _search_index_instance
+
+
+def _index_document(key: str, sha256_hash: str, markdown_text: Optional[str], title: str) -> None:
+    """Best-effort: add a converted/written document to the search index."""
+    index = _search_index()
+    if index is None or not markdown_text or markdown_text.startswith("(extraction_failed"):
+        return
+    try:
+        with _stage("index"):
+            index.add(key, sha256_hash, markdown_text, title)
+    except Exception as e:  # noqa: BLE001 - indexing must never fail the request
+        print(f"[search] Indexing {key} failed: {e}")
+
+
+def _index_repo_file(owner_repo: str, branch: str, path: str, content_text: str) -> None:
+    sha256_hash = hashlib.sha256(content_text.encode("utf-8")).hexdigest()
+    _index_document(f"{owner_repo}@{branch}:{path}", sha256_hash, content_text, path)
+
+
+app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
+
+
+@app.function_name(name="process_file")
+@app.route(route="process_file", methods=[func.HttpMethod.POST], auth_level=func.AuthLevel.ANONYMOUS)
+@_timed
+@_compressible
+async def process_file(req: func.HttpRequest) -> func.HttpResponse:
+    """Process an uploaded document and return Markdown (default) or JSON.
+
+    Expected JSON body:
+      {
+        "filename": "example.docx",
+        "content_base64": "<base64>",
+        "content_type": "<mime type>"  # optional
+      }
+
+    Alternatively send the raw file as application/octet-stream (filename in
+    X-Filename / Content-Disposition / ?filename=, optional X-File-Content-Type)
+    or as multipart/form-data with a "file" part (optional "filename" and
+    "content_type" form fields).
 
+    Default response: text/markdown (with an HTML comment header).
+    Add ?format=json for a JSON envelope, or ?format=ndjson for one JSON
+    record per PDF page / PPTX slide (optionally limited with ?pages=1-3,7).
+    ?format=chunks adds heading-aware, hash-addressed chunks to the JSON
+    envelope, diffed against the previous version located by ?chunk_key= or
+    ?previous_sha256=.
 
-    # When invoking azure.functions.HttpRequest directly in tests, the params dict
-    # may not be auto-populated from the URL query string, so fall back to parsing
-    # the raw URL for '?format=json'.
-    want_json = req.params.get("format") == "json" or ("?format=json" in req.url.lower())
+    Uploads over UPLOAD_MAX_MB get 413; when the worker's conversion memory
+    budget stays exhausted for CONVERSION_QUEUE_SECONDS the answer is 429.
+    The body may be gzip/zstd Content-Encoded; responses honour Accept-Encoding.
+    """
+    output_format = (_query_param(req, "format") or "").lower()
+    want_json = output_format in ("json", "chunks")
 
-    def error(message: str, code: int = 400) -> func.HttpResponse:
+    def error(message: str, code: int = 400, headers: Optional[dict[str, str]] = None) -> func.HttpResponse:
         if want_json:
             return func.HttpResponse(
                 json.dumps({"status": "error", "error": message}),
                 status_code=code,
                 mimetype="application/json",
+                headers=headers,
             )
         return func.HttpResponse(
             f"ERROR: {message}\n",
             status_code=code,
             mimetype="text/plain",
+            headers=headers,
         )
 
     try:
-        body_raw = req.get_body()
-        if not body_raw:
-            return error("Empty request body")
-        payload: Any = json.loads(body_raw)
-    except json.JSONDecodeError as e:
-        # Provide the underlying JSON error message to aid debugging (e.g. invalid escapes)
-        return error(f"Body must be JSON ({e.msg})")
+        upload, upload_error = await _offload(_read_upload, req)
+    except _UploadTooLarge as e:
+        return error(str(e), 413)
+    except _ContentEncodingError as e:
+        return error(str(e), e.status)
+    if upload is None:
+        return error(upload_error or "Invalid request")
+    return await _offload(_respond_with_conversion, req, upload, output_format, error)
 
-    if not isinstance(payload, dict):
-        return error("JSON body must be an object")
 
-    filename = payload.get("filename")
-    content_b64 = payload.get("content_base64")
-    content_type = payload.get("content_type")
+def _respond_with_conversion(req: func.HttpRequest, upload: _Upload, output_format: str,
+                             error: Any) -> func.HttpResponse:
+    """Blocking part of process_file: admission, conversion and the response body."""
+    want_json = output_format in ("json", "chunks")
+    with (
+        contextlib.closing(upload),
+        _memory_budget.reserve(_conversion_cost(upload.size), _admission_wait()) as admitted,
+    ):
+        if not admitted:
+            return error("Too many large conversions in progress; retry later", 429, _busy_headers())
 
-    if not filename or not content_b64:
-        return error("Missing filename or content_base64")
+        if output_format == "ndjson":
+            try:
+                wanted = _parse_page_ranges(_query_param(req, "pages"))
+            except ValueError as e:
+                return error(str(e))
+            document = {
+                "type": "document",
+                "filename": upload.filename,
+                "size_bytes": upload.size,
+                "sha256": upload.sha256,
+                "content_type": upload.content_type,
+            }
+            lines = [json.dumps(document)]
+            count = 0
+            for number, text in _iter_pages(upload, wanted):
+                lines.append(json.dumps({"type": "page", "page": number, "markdown": text}))
+                count += 1
+            lines.append(json.dumps({"type": "end", "pages": count}))
+            return func.HttpResponse("\n".join(lines) + "\n", status_code=200, mimetype="application/x-ndjson")
 
-    try:
-        file_bytes = base64.b64decode(content_b64, validate=True)
-    except Exception:  # noqa: BLE001
-        return error("content_base64 is not valid base64")
-
-    if not content_type:
-        lower = filename.lower()
-        if lower.endswith(".pdf"):
-            content_type = "application/pdf"
-        elif lower.endswith(".docx"):
-            content_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        elif lower.endswith(".pptx"):
-            content_type = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
-        else:
-            content_type = "application/octet-stream"
+        preprocessing: list[dict[str, Any]] = []
+        token = _image_preprocessing.set(preprocessing)
+        try:
+            markdown_text, cache_status = _convert_upload(upload)
+        finally:
+            _image_preprocessing.reset(token)
+        index_key = upload.fields.get("item_id") or f"sha256:{upload.sha256}"
+        _index_document(str(index_key), upload.sha256, markdown_text, upload.filename)
+
+        cache_headers = {"X-Conversion-Cache": cache_status}
+        if not want_json:
+            return func.HttpResponse(
+                (markdown_text or ""),
+                status_code=200,
+                mimetype="text/markdown",
+                headers=cache_headers,
+            )
+
+        resp = {
+            "status": "ok",
+            "data": _result_data(upload, markdown_text, cache_status),
+        }
+        if preprocessing:
+            resp["data"]["image_preprocessing"] = preprocessing
+        if output_format == "chunks":
+            key = _query_param(req, "chunk_key") or upload.fields.get("chunk_key")
+            previous_sha256 = _query_param(req, "previous_sha256") or upload.fields.get("previous_sha256")
+            resp["data"].update(_chunk_response(upload, markdown_text or "", key, previous_sha256))
+        resp["timings"] = _request_timings()
+        with _stage("serialize"):
+            body = json.dumps(resp)
+        return func.HttpResponse(body, status_code=200, mimetype="application/json", headers=cache_headers)
+
+
+@app.function_name(name="process_batch")
+@app.route(route="process_batch", methods=[func.HttpMethod.POST], auth_level=func.AuthLevel.ANONYMOUS)
+@_timed
+@_compressible
+def process_batch(req: func.HttpRequest) -> func.HttpResponse:
+    """Convert many documents in one call, in parallel on a bounded process pool.
+
+    Request JSON body:
+      {
+        "files": [
+          {"filename": "a.docx", "content_base64": "<base64>", "content_type": "<mime>"},
+          ...
+        ]
+      }
 
-    sha256_hash = hashlib.sha256(file_bytes).hexdigest()
+    Response: {"status": "ok", "count": N, "results": [...]} where each result
+    has the same shape as a process_file ?format=json response and results are
+    in request order. Invalid items get {"status": "error", ...} without
+    failing the rest of the batch.
+    """
+    def respond(obj: Any, status: int = 200, headers: Optional[dict[str, str]] = None) -> func.HttpResponse:
+        return func.HttpResponse(json.dumps(obj), status_code=status, mimetype="application/json",
+                                 headers=headers)
 
-    markdown_text = None
     try:
-        is_image = _is_image(filename, content_type)
-        mid = _build_markitdown_with_optional_llm(use_llm=is_image)
-        if mid is None:
-            raise RuntimeError("MarkItDown unavailable")
-        result = mid.convert(io.BytesIO(file_bytes), filename=filename)
-        if isinstance(result, dict):
-            markdown_text = result.get("markdown") or result.get("output")
+        payload = json.loads(_request_body(req) or b"{}")
+    except json.JSONDecodeError as e:
+        return respond({"status": "error", "error": f"Body must be JSON ({e.msg})"}, 400)
+    except _UploadTooLarge as e:
+        return respond({"status": "error", "error": str(e)}, 413)
+    except _ContentEncodingError as e:
+        return respond({"status": "error", "error": str(e)}, e.status)
+
+    files = payload.get("files") if isinstance(payload, dict) else None
+    if not isinstance(files, list) or not files:
+        return respond({"status": "error", "error": "Body must contain a non-empty 'files' array"}, 400)
+    max_files = _env_int("BATCH_MAX_FILES", 100)
+    if len(files) > max_files:
+        return respond({"status": "error", "error": f"Too many files (max {max_files})"}, 413)
+
+    results: list[Optional[dict[str, Any]]] = [None] * len(files)
+    pending: list[tuple[int, _Upload, str, bool, str]] = []
+    for index, item in enumerate(files):
+        if not isinstance(item, dict):
+            results[index] = {"status": "error", "error": "File entry must be an object"}
+            continue
+        try:
+            upload, upload_error = _upload_from_payload(item)
+        except _UploadTooLarge as e:
+            results[index] = {"status": "error", "error": str(e)}
+            continue
+        if upload is None:
+            results[index] = {"status": "error", "error": upload_error or "Invalid file entry"}
+            continue
+        cache_key, use_llm, markdown_text, cache_status = _lookup_conversion(upload)
+        if markdown_text is None and not use_llm:
+            markdown_text = _convert_fast(upload)  # cheaper than shipping it to the pool
+            _store_conversion(cache_key, markdown_text)
+        if markdown_text is not None:
+            results[index] = {"status": "ok", "data": _result_data(upload, markdown_text, cache_status)}
+            upload.close()
         else:
-            markdown_text = str(result)
-    except Exception as e:  # noqa: BLE001
-        markdown_text = f"(extraction_failed: {e.__class__.__name__})"
+            pending.append((index, upload, cache_key, use_llm, cache_status))
 
-    if not want_json:
-        return func.HttpResponse(
-            (markdown_text or ""),
-            status_code=200,
-            mimetype="text/markdown",
-        )
+    with contextlib.ExitStack() as cleanup:
+        for _index, upload, _key, _use_llm, _status in pending:
+            cleanup.callback(upload.close)
+        cost = sum(_conversion_cost(upload.size) for _index, upload, _key, _use_llm, _status in pending)
+        admitted = cleanup.enter_context(_memory_budget.reserve(cost, _admission_wait()))
+        if not admitted:
+            return respond({"status": "error", "error": "Too many large conversions in progress; retry later"},
+                           429, headers=_busy_headers())
+        _convert_pending(pending, results)
 
-    resp = {
-        "status": "ok",
-        "data": {
-            "filename": filename,
-            "size_bytes": len(file_bytes),
-            "sha256": sha256_hash,
-            "content_type": content_type,
-            "markdown": markdown_text,
-        },
-    }
-    return func.HttpResponse(json.dumps(resp), status_code=200, mimetype="application/json")
+    return respond({"status": "ok", "count": len(results), "results": results})
 
 # New endpoint: create or replace a markdown (or any text) file in a GitHub repo
 @app.function_name(name="write_to_repo")
 @app.route(route="write_to_repo", methods=[func.HttpMethod.POST], auth_level=func.AuthLevel.ANONYMOUS)
-def write_to_repo(req: func.HttpRequest) -> func.HttpResponse:
+@_timed
+@_compressible
+async def write_to_repo(req: func.HttpRequest) -> func.HttpResponse:
     """Write (create or replace) a file in a GitHub repository using the REST API.
 
     Request JSON body:
@@ -232,19 +4116,47 @@ def write_to_repo(req: func.HttpRequest) -> func.HttpResponse:
           "commit_message": "..."         # optional
         }
 
+    Optional manifest fields (per request, or per entry in batch mode):
+    item_id, source_etag, sha256, source. When item_id is given, a successful
+    write is recorded in the sync manifest used by /api/should_process.
+
+    Batch mode: replace path/content with
+        "files": [{"path": "docs/a.md", "content": "..."}, ...]
+    to write every file in a single commit via the Git Data API. The
+    response lists each path as created, updated or unchanged.
+
     Behavior:
-      - If file exists (GET returns 200), capture its sha and overwrite.
-      - If not found (404), create new file.
+      - The existing blob sha is looked up in a cached snapshot of the branch
+        tree (refreshed with ETag-conditional requests), falling back to a
+        contents API GET when no snapshot is available.
+      - If the content is byte-identical, nothing is written (action "unchanged").
+      - If file exists, overwrite it using its sha; otherwise create it.
+      - With WRITE_COALESCE_WINDOW_MS set, single-file writes are debounced
+        per repo/branch into one commit; the response then carries
+        "coalesced_writes", and writes overridden by a later write to the
+        same path report action "superseded".
       - Returns JSON metadata with commit SHA and HTML URL.
     """
     def respond(obj: Any, status: int = 200) -> func.HttpResponse:
+        if _github_rate_limit:  # latest GitHub quota, so callers can pace themselves
+            obj = {**obj, "rate_limit": _github_rate_limit}
+        timings = _request_timings()
+        if timings is not None:
+            obj = {**obj, "timings": timings}
         return func.HttpResponse(json.dumps(obj), status_code=status, mimetype="application/json")
 
     try:
-        body_raw = req.get_body() or b"{}"
+        if req.headers.get("Content-Encoding"):
+            body_raw = await _offload(_request_body, req) or b"{}"
+        else:
+            body_raw = req.get_body() or b"{}"
         payload = json.loads(body_raw)
     except json.JSONDecodeError as e:  # pragma: no cover - simple validation
         return respond({"status": "error", "error": f"Invalid JSON body: {e.msg}"}, 400)
+    except _UploadTooLarge as e:
+        return respond({"status": "error", "error": str(e)}, 413)
+    except _ContentEncodingError as e:
+        return respond({"status": "error", "error": str(e)}, e.status)
 
     if not isinstance(payload, dict):
         return respond({"status": "error", "error": "JSON body must be an object"}, 400)
@@ -252,16 +4164,37 @@ def write_to_repo(req: func.HttpRequest) -> func.HttpResponse:
     repo = payload.get("repo")
     path = payload.get("path")
     content_text = payload.get("content")
+    files = payload.get("files")
     branch = payload.get("branch") or "main"
     commit_message = payload.get("commit_message")
 
     # Determine missing required fields
-    required_pairs = [("repo", repo), ("path", path), ("content", content_text)]
-    missing = [k for k, v in required_pairs if v in (None, "")]
+    if files is not None:
+        required_pairs = [("repo", repo), ("files", files)]
+    else:
+        required_pairs = [("repo", repo), ("path", path), ("content", content_text)]
+    missing = [k for k, v in required_pairs if v in (None, "", [])]
     if missing:
         return respond({"status": "error", "error": f"Missing required field(s): {', '.join(missing)}"}, 400)
 
-    # Safe now: repo, path, content_text are non-empty strings
+    batch: dict[str, str] = {}
+    manifest_entries: list[dict[str, Any]] = []
+    if files is not None:
+        if not isinstance(files, list):
+            return respond({"status": "error", "error": "files must be an array"}, 400)
+        for entry in files:
+            if not isinstance(entry, dict) or not isinstance(entry.get("path"), str) \
+                    or not entry["path"] or not isinstance(entry.get("content"), str):
+                return respond({"status": "error", "error": "Each files entry needs string 'path' and 'content'"}, 400)
+            if ".." in entry["path"].split("/"):
+                return respond({"status": "error", "error": "Path may not contain '..' segments"}, 400)
+            batch[entry["path"]] = entry["content"]  # last write wins for duplicate paths
+            manifest_entries.append(entry)
+        if not commit_message:
+            commit_message = f"Update {len(batch)} file(s)"
+        path, content_text = "", ""
+
+    # Safe now: repo, path, content_text are strings
     assert isinstance(path, str) and isinstance(repo, str) and isinstance(content_text, str)
 
     if ".." in path.split("/"):
@@ -278,74 +4211,228 @@ def write_to_repo(req: func.HttpRequest) -> func.HttpResponse:
     if owner_repo.count("/") != 1:
         return respond({"status": "error", "error": "repo must be in form 'owner/name'"}, 400)
 
-    api_base = "https://api.github.com"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/vnd.github+json",
-        "User-Agent": "enterprise-artifacts-indexing-func",
-    }
-
-    # Step 1: check if file exists
-    get_url = f"{api_base}/repos/{owner_repo}/contents/{path}"
-    params = {"ref": branch}
-    sha: str | None = None
-    try:
-        r_get = requests.get(get_url, headers=headers, params=params, timeout=10)
-    except Exception as e:  # noqa: BLE001
-        return respond({"status": "error", "error": f"Failed to contact GitHub: {e}"}, 502)
+    headers = _github_headers(token)
 
-    if r_get.status_code == 200:
+    if batch:
         try:
-            data_existing = r_get.json()
-            sha = data_existing.get("sha")
-        except Exception:  # pragma: no cover - defensive
-            pass
-    elif r_get.status_code not in (404,):  # other errors propagate
-        return respond({
-            "status": "error",
-            "error": f"GitHub GET failed: {r_get.status_code} {r_get.text[:300]}"
-        }, 502)
-
-    b64_content = _b64.b64encode(content_text.encode("utf-8")).decode("ascii")
-    put_url = get_url
-    payload_put: dict[str, Any] = {
-        "message": commit_message,
-        "content": b64_content,
-        "branch": branch,
-    }
-    if sha:
-        payload_put["sha"] = sha
+            outcome = await _commit_files(owner_repo, branch, batch, commit_message, headers)
+        except _GitHubError as e:
+            return respond({"status": "error", "error": str(e)}, 502)
 
-    try:
-        r_put = requests.put(put_url, headers=headers, json=payload_put, timeout=15)
-    except Exception as e:  # noqa: BLE001
-        return respond({"status": "error", "error": f"GitHub PUT failed: {e}"}, 502)
+        def record_batch() -> None:
+            for entry in manifest_entries:
+                _manifest_record(entry, {"repo": owner_repo, "branch": branch, "path": entry["path"],
+                                         "commit_sha": outcome["commit_sha"]})
+            for file_path, file_content in batch.items():
+                _index_repo_file(owner_repo, branch, file_path, file_content)
 
-    if r_put.status_code not in (200, 201):
+        await _offload(record_batch)
         return respond({
-            "status": "error",
-            "error": f"GitHub PUT failed: {r_put.status_code} {r_put.text[:300]}"
-        }, 502)
+            "status": "ok",
+            "action": "committed" if outcome["commit_sha"] else "unchanged",
+            "repo": owner_repo,
+            "branch": branch,
+            **outcome,
+        })
 
     try:
-        result = r_put.json()
-    except Exception:  # pragma: no cover - defensive
-        result = {}
+        outcome = await _write_repo_file(owner_repo, branch, path, content_text, commit_message, headers)
+    except _GitHubError as e:
+        return respond({"status": "error", "error": str(e)}, 502)
+    if outcome["action"] != "superseded":  # a later write to the same path went into the commit instead
+        await _offload(_manifest_record, payload, outcome)
+        await _offload(_index_repo_file, owner_repo, branch, path, content_text)
+    return respond(outcome)
 
-    commit_sha = (
-        (result.get("commit") or {}).get("sha")
-        if isinstance(result.get("commit"), dict) else None
-    )
-    html_url = result.get("content", {}).get("html_url") if isinstance(result.get("content"), dict) else None
 
-    action = "updated" if sha else "created"
+@app.function_name(name="search")
+@app.route(route="search", methods=[func.HttpMethod.GET, func.HttpMethod.POST], auth_level=func.AuthLevel.ANONYMOUS)
+@_timed
+def search(req: func.HttpRequest) -> func.HttpResponse:
+    """Full-text (BM25) search over converted and written Markdown.
+
+    GET /api/search?q=deployment+slots&top=10, or POST {"q": "...", "top": 10}.
+    Response: {"status": "ok", "query", "total", "took_ms", "results": [
+    {"key", "sha256", "title", "score", "snippet"}, ...]}
+    """
+    def respond(obj: Any, status: int = 200) -> func.HttpResponse:
+        return func.HttpResponse(json.dumps(obj), status_code=status, mimetype="application/json")
+
+    index = _search_index()
+    if index is None:
+        return respond({"status": "error", "error": "Search index is disabled (set SEARCH_INDEX_ENABLED=true)"}, 503)
+
+    payload: Any = {}
+    if req.method == "POST":
+        try:
+            payload = json.loads(req.get_body() or b"{}")
+        except json.JSONDecodeError as e:
+            return respond({"status": "error", "error": f"Body must be JSON ({e.msg})"}, 400)
+        if not isinstance(payload, dict):
+            return respond({"status": "error", "error": "JSON body must be an object"}, 400)
+    query = payload.get("q") or _query_param(req, "q")
+    if not query or not isinstance(query, str):
+        return respond({"status": "error", "error": "Missing query (q)"}, 400)
+    try:
+        top = int(payload.get("top") or _query_param(req, "top") or 10)
+    except (TypeError, ValueError):
+        return respond({"status": "error", "error": "top must be an integer"}, 400)
+    top = min(max(top, 1), 100)
+
+    started = time.perf_counter()
+    with _stage("search"):
+        total, results = index.search(query, top)
     return respond({
         "status": "ok",
-        "action": action,
-        "repo": owner_repo,
-        "path": path,
-        "branch": branch,
-        "commit_sha": commit_sha,
-        "html_url": html_url,
+        "query": query,
+        "total": total,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2),
+        "results": results,
     })
 
+
+@app.function_name(name="should_process")
+@app.route(route="should_process", methods=[func.HttpMethod.POST], auth_level=func.AuthLevel.ANONYMOUS)
+def should_process(req: func.HttpRequest) -> func.HttpResponse:
+    """Tell the caller whether a source item needs to be (re)processed.
+
+    Request JSON body:
+        {
+          "item_id": "42",           # required (e.g. SharePoint item ID)
+          "etag": "\"{...},3\"",     # source ETag (and/or sha256)
+          "sha256": "<64hex>",       # optional
+          "source": "sharepoint"     # optional manifest partition
+        }
+
+    Response: {"status": "ok", "process": true|false, "reason": "...", "record": {...}|null}.
+    If the manifest cannot be reached the answer is process=true (fail open).
+    """
+    def respond(obj: Any, status: int = 200) -> func.HttpResponse:
+        return func.HttpResponse(json.dumps(obj), status_code=status, mimetype="application/json")
+
+    try:
+        payload = json.loads(req.get_body() or b"{}")
+    except json.JSONDecodeError as e:
+        return respond({"status": "error", "error": f"Invalid JSON body: {e.msg}"}, 400)
+    if not isinstance(payload, dict) or not payload.get("item_id"):
+        return respond({"status": "error", "error": "Missing required field(s): item_id"}, 400)
+
+    try:
+        record = _manifest_get(str(payload["item_id"]), payload.get("source"))
+    except Exception as e:  # noqa: BLE001
+        print(f"[manifest] Lookup failed: {e}")
+        return respond({"status": "ok", "process": True, "reason": "manifest_unavailable", "record": None})
+    process, reason = _manifest_decision(record, payload.get("etag"), payload.get("sha256"))
+    return respond({"status": "ok", "process": process, "reason": reason, "record": record})
+
+
+@app.function_name(name="ingest")
+@app.route(route="ingest", methods=[func.HttpMethod.POST], auth_level=func.AuthLevel.ANONYMOUS)
+def ingest(req: func.HttpRequest) -> func.HttpResponse:
+    """Queue a document for asynchronous conversion (and optional repo write).
+
+    Accepts the same bodies as process_file (JSON/base64, raw or multipart).
+    Optional target fields (JSON keys, form fields or query params):
+    repo, path, branch, commit_message; item_id / source_etag / source are
+    recorded in the sync manifest once the write succeeds. Returns 202 with a job id; poll
+    /api/ingest_status/{job_id} for progress.
+    """
+    def respond(obj: Any, status: int = 200, headers: Optional[dict[str, str]] = None) -> func.HttpResponse:
+        return func.HttpResponse(json.dumps(obj), status_code=status, mimetype="application/json",
+                                 headers=headers)
+
+    try:
+        upload, upload_error = _read_upload(req)
+    except _UploadTooLarge as e:
+        return respond({"status": "error", "error": str(e)}, 413)
+    except _ContentEncodingError as e:
+        return respond({"status": "error", "error": str(e)}, e.status)
+    if upload is None:
+        return respond({"status": "error", "error": upload_error or "Invalid request"}, 400)
+
+    with contextlib.closing(upload):
+        target = None
+        if upload.fields.get("repo") or upload.fields.get("path"):
+            repo, path = upload.fields.get("repo"), upload.fields.get("path")
+            if not repo or not path or str(repo).count("/") != 1 or ".." in str(path).split("/"):
+                return respond({"status": "error", "error": "Target needs repo 'owner/name' and a path without '..'"},
+                               400)
+            target = {k: upload.fields[k] for k in ("repo", "path", "branch", "commit_message")
+                      if upload.fields.get(k)}
+
+        try:
+            convert_queue = _queue_client(_CONVERT_QUEUE)
+            max_depth = _env_int("INGEST_MAX_QUEUE_DEPTH", 500)
+            depth = convert_queue.get_queue_properties().approximate_message_count or 0
+            if depth >= max_depth:
+                return respond(
+                    {"status": "error", "error": f"Ingestion queue is full ({depth} pending); retry later"},
+                    429, headers={"Retry-After": str(_env_int("INGEST_RETRY_AFTER_SECONDS", 30))},
+                )
+
+            import uuid
+
+            job_id = uuid.uuid4().hex
+            _blob_container().upload_blob(f"uploads/{job_id}", upload.open(), length=upload.size, overwrite=True)
+            _save_job({
+                "job_id": job_id,
+                "state": "queued",
+                "filename": upload.filename,
+                "content_type": upload.content_type,
+                "size_bytes": upload.size,
+                "sha256": upload.sha256,
+                "target": target,
+                "source": {k: upload.fields[k] for k in ("item_id", "source_etag", "source")
+                           if upload.fields.get(k)},
+            })
+            convert_queue.send_message(json.dumps({"job_id": job_id}))
+        except Exception as e:  # noqa: BLE001
+            return respond({"status": "error", "error": f"Failed to queue document: {e}"}, 503)
+
+        return respond({
+            "status": "accepted",
+            "job_id": job_id,
+            "status_url": f"/api/ingest_status/{job_id}",
+        }, 202)
+
+
+@app.function_name(name="ingest_status")
+@app.route(route="ingest_status/{job_id}", methods=[func.HttpMethod.GET], auth_level=func.AuthLevel.ANONYMOUS)
+def ingest_status(req: func.HttpRequest) -> func.HttpResponse:
+    """Return the status record of an ingestion job."""
+    job_id = req.route_params.get("job_id") or req.params.get("job_id") or ""
+    if not job_id.isalnum():
+        body, status = {"status": "error", "error": "Invalid job_id"}, 400
+    else:
+        job = _load_job(job_id)
+        if job is None:
+            body, status = {"status": "error", "error": "Unknown job_id"}, 404
+        else:
+            body, status = {"status": "ok", "job": job}, 200
+    return func.HttpResponse(json.dumps(body), status_code=status, mimetype="application/json")
+
+
+@app.function_name(name="ingest_convert")
+@app.queue_trigger(arg_name="msg", queue_name=_CONVERT_QUEUE, connection="AzureWebJobsStorage")
+def ingest_convert(msg: func.QueueMessage) -> None:
+    # Exceptions propagate so the host retries; after maxDequeueCount the
+    # message is moved to ingest-convert-poison.
+    _ingest_convert(msg.get_json()["job_id"])
+
+
+@app.function_name(name="ingest_persist")
+@app.queue_trigger(arg_name="msg", queue_name=_PERSIST_QUEUE, connection="AzureWebJobsStorage")
+def ingest_persist(msg: func.QueueMessage) -> None:
+    _ingest_persist(msg.get_json()["job_id"])
+
+
+@app.function_name(name="ingest_convert_poison")
+@app.queue_trigger(arg_name="msg", queue_name=f"{_CONVERT_QUEUE}-poison", connection="AzureWebJobsStorage")
+def ingest_convert_poison(msg: func.QueueMessage) -> None:
+    _update_job(msg.get_json()["job_id"], state="failed", error="conversion failed repeatedly (moved to poison queue)")
+
+
+@app.function_name(name="ingest_persist_poison")
+@app.queue_trigger(arg_name="msg", queue_name=f"{_PERSIST_QUEUE}-poison", connection="AzureWebJobsStorage")
+def ingest_persist_poison(msg: func.QueueMessage) -> None:
+    _update_job(msg.get_json()["job_id"], state="failed", error="repo write failed repeatedly (moved to poison queue)")
@@ -0,0 +1,203 @@
+"""Benchmark harness: wall time and allocations, compared against baseline.json.
+
+Benchmarks are skipped unless BENCHMARK=1. Useful settings:
+- BENCHMARK_ROUNDS (default 5): timed rounds per benchmark (after one warm-up).
+- BENCHMARK_TOLERANCE (default 0.5): allowed slowdown / allocation growth vs the baseline (0.5 = +50%).
+- BENCHMARK_SAVE=1: write the measured numbers to baseline.json instead of comparing.
+
+Times are compared relative to a fixed calibration workload measured in the
+same session, so a baseline saved on one machine still applies on a faster
+or slower one.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+import pytest
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+CALIBRATION = "_calibration"
+# Timings below this many milliseconds are dominated by noise and only checked against this floor.
+NOISE_FLOOR_MS = 2.0
+
+
+def _calibration_ms(rounds: int = 7) -> float:
+    """Median time of a fixed mix of interpreter and hashing work: this machine's speed."""
+    data = bytes(range(256)) * 4096
+
+    def work():
+        sum(i * i for i in range(200_000))
+        json.dumps([{"key": i, "value": str(i)} for i in range(20_000)])
+        hashlib.sha256(data).digest()
+
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        work()
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(timings), 3)
+
+
+class Recorder:
+    def __init__(self, rounds: int, tolerance: float, baseline: dict, save: bool):
+        self.rounds = rounds
+        self.tolerance = tolerance
+        self.baseline = baseline
+        self.save = save
+        self.calibration_ms = _calibration_ms()
+        expected = baseline.get(CALIBRATION, {}).get("median_ms")
+        # Baseline times are scaled by how much faster or slower this machine is.
+        self.speed = self.calibration_ms / expected if expected else 1.0
+        self.results: dict[str, dict] = {CALIBRATION: {"median_ms": self.calibration_ms}}
+
+    def __call__(self, name: str, fn, rounds: int | None = None) -> dict:
+        fn()  # warm-up: imports, lazily built converters, first-touch allocations
+        timings = []
+        for _ in range(rounds or self.rounds):
+            started = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - started) * 1000)
+        tracemalloc.start()
+        try:
+            fn()
+            _current, alloc_peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result = {
+            "median_ms": round(statistics.median(timings), 3),
+            "min_ms": round(min(timings), 3),
+            "alloc_peak_bytes": alloc_peak,
+        }
+        self.results[name] = result
+        print(f"\n[bench] {name}: {result['median_ms']} ms median, {alloc_peak / 1e6:.2f} MB allocated peak")
+        if not self.save:
+            self._compare(name, result)
+        return result
+
+    def _compare(self, name: str, result: dict) -> None:
+        expected = self.baseline.get(name)
+        if expected is None:
+            return  # new benchmark: nothing to compare yet
+        limit_ms = max(expected["median_ms"] * self.speed * (1 + self.tolerance), NOISE_FLOOR_MS)
+        assert result["median_ms"] <= limit_ms, (
+            f"{name}: {result['median_ms']} ms median vs baseline {expected['median_ms']} ms "
+            f"x {self.speed:.2f} machine speed (limit {limit_ms:.3f} ms)"
+        )
+        limit_alloc = expected["alloc_peak_bytes"] * (1 + self.tolerance) + 64 * 1024
+        assert result["alloc_peak_bytes"] <= limit_alloc, (
+            f"{name}: {result['alloc_peak_bytes']} bytes allocated peak vs baseline {expected['alloc_peak_bytes']}"
+        )
+
+
+@pytest.fixture(scope="session")
+def bench():
+    baseline = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+    recorder = Recorder(
+        rounds=int(os.getenv("BENCHMARK_ROUNDS", "5")),
+        tolerance=float(os.getenv("BENCHMARK_TOLERANCE", "0.5")),
+        baseline=baseline,
+        save=os.getenv("BENCHMARK_SAVE") == "1",
+    )
+    yield recorder
+    if recorder.save and len(recorder.results) > 1:
+        # Entries not re-measured this run are rescaled to the new calibration.
+        kept = {
+            name: {"median_ms": round(entry["median_ms"] * recorder.speed, 3),
+                   "min_ms": round(entry["min_ms"] * recorder.speed, 3),
+                   "alloc_peak_bytes": entry["alloc_peak_bytes"]}
+            for name, entry in baseline.items() if name != CALIBRATION
+        }
+        merged = {**kept, **recorder.results}
+        BASELINE_PATH.write_text(json.dumps(dict(sorted(merged.items())), indent=2) + "\n")
+
+
+class FakeAsyncOpenAI:
+    """Local stand-in for AsyncAzureOpenAI: answers captions instantly without network."""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, model, messages):
+        await asyncio.sleep(0)
+        message = SimpleNamespace(content="A diagram showing services connected by arrows.")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class DummyResp:
+    def __init__(self, status_code: int, json_obj=None):
+        self.status_code = status_code
+        self._json = json_obj or {}
+        self.text = json.dumps(self._json)
+        self.headers = {}
+
+    def json(self):
+        return self._json
+
+
+class FakeGitHub:
+    """In-memory stand-in for the GitHub contents and Git Data API endpoints."""
+
+    def __init__(self):
+        self.head = "c0"
+        self.trees = {"t0": []}
+        self.commits = {"c0": "t0"}
+
+    async def request(self, method, url, json=None, **_kw):
+        if method == "GET":
+            if "/git/ref/heads/" in url:
+                return DummyResp(200, {"object": {"sha": self.head}})
+            if "/git/commits/" in url:
+                return DummyResp(200, {"tree": {"sha": self.commits[url.rsplit("/", 1)[1]]}})
+            if "/git/trees/" in url:
+                return DummyResp(200, {"tree": self.trees[url.rsplit("/", 1)[1]], "truncated": False})
+            return DummyResp(404)
+        if method == "PUT":
+            sha, parent = f"c{len(self.commits)}", self.head
+            self.commits[sha], self.head = "t0", sha
+            return DummyResp(201, {"content": {"html_url": "https://github.com/o/r/blob/main/x.md"},
+                                   "commit": {"sha": sha, "tree": {"sha": "t0"}, "parents": [{"sha": parent}]}})
+        if method == "POST" and url.endswith("/git/trees"):
+            sha = f"t{len(self.trees)}"
+            self.trees[sha] = [{**entry, "sha": entry.get("sha") or "0" * 40} for entry in json["tree"]]
+            return DummyResp(201, {"sha": sha})
+        if method == "POST" and url.endswith("/git/commits"):
+            sha = f"c{len(self.commits)}"
+            self.commits[sha] = json["tree"]
+            return DummyResp(201, {"sha": sha, "html_url": f"https://github.com/o/r/commit/{sha}"})
+        if method == "PATCH":
+            self.head = json["sha"]
+            return DummyResp(200, {"object": {"sha": json["sha"]}})
+        return DummyResp(404)
+
+
+@pytest.fixture
+def github(monkeypatch):
+    """Route write_to_repo's GitHub traffic to an in-memory FakeGitHub."""
+    import function_app
+
+    fake = FakeGitHub()
+    monkeypatch.setattr(function_app, "_github_session", lambda: fake)
+    monkeypatch.setenv("GITHUB_TOKEN", "benchmark-token")
+    function_app._branch_snapshots.clear()
+    return fake
+
+
+@pytest.fixture
+def llm_converter(monkeypatch):
+    """Install an LLM-enabled converter whose captions come from FakeAsyncOpenAI."""
+    import function_app
+    from markitdown import MarkItDown
+
+    store = function_app._TwoTierCache(None, 0, 0)
+    client = function_app._CaptionClient(FakeAsyncOpenAI, cache=function_app._CaptionCache(store, max_distance=0))
+    instance = MarkItDown(llm_client=client, llm_model="gpt-4o", llm_prompt=function_app._LLM_PROMPT)
+    registry = function_app._ConverterRegistry()
+    registry._llm = (function_app._azure_openai_settings(), instance)
+    monkeypatch.setattr(function_app, "_converters", registry)
+    return instance
@@ -0,0 +1,161 @@
+"""Stage-by-stage micro-benchmarks for process_file and write_to_repo (BENCHMARK=1 to run)."""
+
+import asyncio
+import base64
+import io
+import itertools
+import json
+import os
+import random
+import zipfile
+from pathlib import Path
+from xml.sax.saxutils import escape
+import azure.functions as func
+import pytest
+import function_app
+
+pytestmark = pytest.mark.skipif(os.getenv("BENCHMARK") != "1", reason="set BENCHMARK=1 to run benchmarks")
+
+FIXTURES = Path(__file__).resolve().parent.parent / "fixtures"
+DOCX_FIXTURE = FIXTURES / "documents" / "Architecture Guidelines.docx"
+PNG_FIXTURE = FIXTURES / "images" / "architecture overview.png"
+
+
+def synthetic_docx(paragraphs: int = 2000) -> bytes:
+    """A deterministic DOCX with headings, body paragraphs and one table."""
+    body = []
+    for i in range(paragraphs):
+        text = escape(f"Paragraph {i}: the service publishes events to the ingestion queue and retries on failure.")
+        if i % 50 == 0:
+            body.append(f'<w:p><w:pPr><w:pStyle w:val="Heading1"/></w:pPr><w:r><w:t>Section {i // 50}</w:t></w:r></w:p>')
+        body.append(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>")
+    rows = "".join(
+        f"<w:tr>{''.join(f'<w:tc><w:p><w:r><w:t>r{r}c{c}</w:t></w:r></w:p></w:tc>' for c in range(5))}</w:tr>"
+        for r in range(40)
+    )
+    body.append(f"<w:tbl>{rows}</w:tbl>")
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{''.join(body)}</w:body></w:document>"
+    )
+    content_types = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/word/document.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+        "</Types>"
+    )
+    rels = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="word/document.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        "</Relationships>"
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", content_types)
+        zf.writestr("_rels/.rels", rels)
+        zf.writestr("word/document.xml", document)
+    return buffer.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def no_caching(monkeypatch):
+    """Measure real work: no conversion cache, no parallel page ranges."""
+    monkeypatch.setattr(function_app, "_conversion_cache", function_app._TwoTierCache(None, 0, 0))
+    monkeypatch.setenv("PAGE_PARALLEL_MIN_PAGES", "0")
+
+
+@pytest.fixture(scope="module")
+def documents(make_pdf):
+    return {
+        "docx_fixture": ("Architecture Guidelines.docx", DOCX_FIXTURE.read_bytes()),
+        "png_fixture": ("architecture overview.png", PNG_FIXTURE.read_bytes()),
+        "pdf_60_pages": ("synthetic.pdf", make_pdf([f"Page {i} of the synthetic report" for i in range(60)])),
+        "docx_2000_paragraphs": ("synthetic.docx", synthetic_docx()),
+    }
+
+
+def process_file_request(filename: str, data: bytes) -> func.HttpRequest:
+    body = json.dumps({"filename": filename, "content_base64": base64.b64encode(data).decode()}).encode()
+    return func.HttpRequest(method="POST", url="http://localhost/api/process_file?format=json", params={}, body=body)
+
+
+def test_base64_decode(bench):
+    data = random.Random(0).randbytes(8 * 1024 * 1024)
+    payload = {"filename": "large.bin", "content_base64": base64.b64encode(data).decode()}
+    bench("decode.base64_8mb", lambda: function_app._upload_from_payload(payload))
+
+
+def test_sha256(bench):
+    data = bytes(range(256)) * (32 * 1024 * 4)  # 32 MiB
+    bench("hash.sha256_32mb", lambda: function_app._hash_bytes(data))
+
+
+def test_converter_construction(bench):
+    bench("converter.build_plain", lambda: function_app._build_markitdown_with_optional_llm(use_llm=False))
+
+
+@pytest.mark.parametrize("name", ["docx_fixture", "pdf_60_pages", "docx_2000_paragraphs"])
+def test_conversion(bench, documents, name):
+    filename, data = documents[name]
+    bench(f"convert.{name}", lambda: function_app._convert_stream(io.BytesIO(data), filename, use_llm=False))
+
+
+def test_image_conversion_with_llm_stand_in(bench, documents, llm_converter):
+    filename, data = documents["png_fixture"]
+    bench("convert.png_fixture_llm", lambda: function_app._convert_stream(io.BytesIO(data), filename, use_llm=True))
+
+
+def test_process_file_end_to_end(bench, documents):
+    filename, data = documents["docx_2000_paragraphs"]
+    request = process_file_request(filename, data)
+
+    def run():
+        assert asyncio.run(function_app.process_file(request)).status_code == 200
+
+    bench("process_file.docx_2000_paragraphs_json", run)
+
+
+def test_response_serialization(bench, documents):
+    filename, data = documents["docx_2000_paragraphs"]
+    upload, _ = function_app._upload_from_payload({"filename": filename, "content_base64": base64.b64encode(data).decode()})
+    markdown_text = function_app._convert_stream(io.BytesIO(data), filename, use_llm=False)
+    result = {"status": "ok", "data": function_app._result_data(upload, markdown_text, "bypass")}
+    bench("serialize.json_response", lambda: json.dumps(result))
+
+
+def write_request(payload: dict) -> func.HttpRequest:
+    return func.HttpRequest(method="POST", url="http://localhost/api/write_to_repo", params={},
+                            body=json.dumps(payload).encode())
+
+
+def test_write_to_repo_single(bench, github):
+    rounds = itertools.count()
+
+    def run():
+        # New content every round, so each one takes the GET + PUT path instead of "unchanged".
+        request = write_request({"repo": "owner/repo", "path": "docs/page.md",
+                                 "content": f"# Page {next(rounds)}\n" + "text " * 20000})
+        payload = json.loads(asyncio.run(function_app.write_to_repo(request)).get_body())
+        assert payload["action"] in ("created", "updated"), payload
+
+    bench("write_to_repo.single", run)
+
+
+def test_write_to_repo_batch(bench, github):
+    rounds = itertools.count()
+
+    def run():
+        revision = next(rounds)
+        files = [{"path": f"docs/page-{i}.md", "content": f"# Page {i} r{revision}\n" + "text " * 2000}
+                 for i in range(50)]
+        request = write_request({"repo": "owner/repo", "files": files})
+        payload = json.loads(asyncio.run(function_app.write_to_repo(request)).get_body())
+        assert payload["action"] == "committed", payload
+
+    bench("write_to_repo.batch_50_files", run)
@@ -0,0 +1,63 @@
+import io
+import pytest
+import function_app
+
+
+def _build_pdf(page_texts: list[str]) -> bytes:
+    """Build a tiny multi-page PDF with one line of Helvetica text per page."""
+    n = len(page_texts)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        ("<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{3 + 2 * i} 0 R" for i in range(n)), n)).encode(),
+    ]
+    font_ref = 3 + 2 * n
+    for i, text in enumerate(page_texts):
+        objects.append(
+            (
+                "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                f"/Resources << /Font << /F1 {font_ref} 0 R >> >> /Contents {4 + 2 * i} 0 R >>"
+            ).encode()
+        )
+        stream = f"BT /F1 18 Tf 72 720 Td ({text}) Tj ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for num, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % num + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for off in offsets:
+        out.write(b"%010d 00000 n \n" % off)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+@pytest.fixture(scope="session")
+def make_pdf():
+    """Factory for small text-only PDFs: make_pdf(["page 1 text", "page 2 text"])."""
+    return _build_pdf
+
+
+@pytest.fixture(autouse=True)
+def isolated_conversion_cache(monkeypatch, tmp_path_factory):
+    """Give every test an empty conversion cache so results never leak between tests or runs."""
+    directory = str(tmp_path_factory.mktemp("conversion-cache"))
+    monkeypatch.setenv("CONVERSION_CACHE_DIR", directory)
+    cache = function_app._TwoTierCache(directory, memory_bytes=64 * 1024 * 1024, disk_bytes=64 * 1024 * 1024)
+    monkeypatch.setattr(function_app, "_conversion_cache", cache)
+    monkeypatch.setattr(function_app, "_caption_cache", function_app._CaptionCache(
+        cache, max_distance=function_app._env_int("CAPTION_PHASH_MAX_DISTANCE", 4)))
+    return cache
+
+
+@pytest.fixture(autouse=True, scope="session")
+def shutdown_process_pool():
+    """Stop conversion worker processes before interpreter teardown."""
+    yield
+    pool = function_app._process_pool
+    if pool is not None:
+        pool.shutdown(wait=True)
@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import os
 import azure.functions as func
@@ -30,7 +31,7 @@ def test_process_file_architecture_guidelines_docx_json():
         ),
     )
 
-    resp = process_file(req)
+    resp = asyncio.run(process_file(req))
     assert resp.status_code == 200, resp.get_body()
 
     import json
@@ -75,7 +76,7 @@ def test_process_file_architecture_guidelines_docx_markdown():
         ),
     )
 
-    resp = process_file(req)
+    resp = asyncio.run(process_file(req))
     assert resp.status_code == 200, resp.get_body()[:200]
     body = resp.get_body().decode(errors="replace")
 
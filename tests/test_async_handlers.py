@@ -0,0 +1,96 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+import azure.functions as func
+import function_app
+from function_app import process_file, write_to_repo  # type: ignore
+
+
+class DummyResp:
+    def __init__(self, status_code: int, json_obj=None):
+        self.status_code = status_code
+        self._json = json_obj or {}
+        self.text = json.dumps(self._json)
+        self.headers = {}
+
+    def json(self):
+        return self._json
+
+
+class SlowSession:
+    """GitHub stand-in whose calls take `delay` seconds without blocking the loop."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.in_flight = 0
+        self.peak = 0
+
+    async def request(self, method, url, **kw):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        if method == "GET":
+            return DummyResp(404)
+        return DummyResp(201, {"content": {"html_url": "u"}, "commit": {"sha": "abc"}})
+
+
+def make_request(route: str, body: dict, url_suffix: str = ""):
+    return func.HttpRequest(method="POST", url=f"http://localhost/api/{route}{url_suffix}", params={},
+                            body=json.dumps(body).encode("utf-8"))
+
+
+def test_write_to_repo_overlaps_github_calls_on_one_loop(monkeypatch):
+    monkeypatch.setenv("GITHUB_TOKEN", "testtoken")
+    session = SlowSession(0.2)
+    monkeypatch.setattr(function_app, "_github_session", lambda: session)
+    function_app._branch_snapshots.clear()
+
+    async def main():
+        requests = [make_request("write_to_repo", {"repo": f"o/r{i}", "path": "a.md", "content": "x"})
+                    for i in range(10)]
+        return await asyncio.gather(*(write_to_repo(req) for req in requests))
+
+    started = time.perf_counter()
+    responses = asyncio.run(main())
+    elapsed = time.perf_counter() - started
+
+    assert [r.status_code for r in responses] == [200] * 10
+    assert session.peak == 10
+    assert elapsed < 2.0  # 10 x (ref GET + contents GET + PUT) x 0.2 s would be 6 s serially
+
+
+def test_process_file_converts_off_the_event_loop(monkeypatch):
+    loop_thread = []
+    convert_threads = []
+    real_convert = function_app._convert_upload
+
+    def convert(upload):
+        convert_threads.append(threading.get_ident())
+        return real_convert(upload)
+
+    monkeypatch.setattr(function_app, "_convert_upload", convert)
+    body = {"filename": "notes.md", "content_base64": base64.b64encode(b"# Notes").decode()}
+
+    async def main():
+        loop_thread.append(threading.get_ident())
+        return await process_file(make_request("process_file", body, "?format=json"))
+
+    resp = asyncio.run(main())
+
+    payload = json.loads(resp.get_body())
+    assert resp.status_code == 200 and payload["data"]["markdown"] == "# Notes"
+    assert convert_threads and convert_threads[0] != loop_thread[0]
+    assert {"decode", "cache"} <= set(payload["timings"])  # stages from the worker thread still count
+
+
+def test_persist_stage_runs_github_coroutines_from_sync_code():
+    async def write():
+        await asyncio.sleep(0)
+        return threading.current_thread().name
+
+    assert function_app._run_github(write()) == "github-client"
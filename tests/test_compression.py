@@ -0,0 +1,129 @@
+import asyncio
+import base64
+import gzip
+import json
+import azure.functions as func
+import pytest
+import function_app
+from function_app import ingest, process_batch, process_file, write_to_repo  # type: ignore
+
+MB = 1024 * 1024
+NOTES = ("# Notes\n\n" + "Compressible paragraph about deployment slots.\n" * 200).encode()
+
+
+def request(route: str, body: bytes, headers: dict, url_suffix: str = ""):
+    return func.HttpRequest(method="POST", url=f"http://localhost/api/{route}{url_suffix}", params={},
+                            headers=headers, body=body)
+
+
+def json_body(filename: str = "notes.md", data: bytes = NOTES) -> bytes:
+    return json.dumps({"filename": filename, "content_base64": base64.b64encode(data).decode()}).encode()
+
+
+def zstd():
+    return pytest.importorskip("zstandard")
+
+
+def test_gzip_json_request_and_response():
+    req = request("process_file", gzip.compress(json_body()),
+                  {"Content-Encoding": "gzip", "Accept-Encoding": "gzip"}, "?format=json")
+
+    resp = asyncio.run(process_file(req))
+
+    assert resp.status_code == 200
+    assert resp.headers["Content-Encoding"] == "gzip" and resp.headers["Vary"] == "Accept-Encoding"
+    assert json.loads(gzip.decompress(resp.get_body()))["data"]["markdown"] == NOTES.decode()
+    assert "compress" in resp.headers["Server-Timing"]
+
+
+def test_zstd_raw_upload_is_inflated_and_response_prefers_zstd(monkeypatch):
+    zstandard = zstd()
+    monkeypatch.setenv("UPLOAD_SPOOL_MB", "0")  # force the inflate-to-disk path
+    req = request("process_file", zstandard.ZstdCompressor().compress(NOTES),
+                  {"Content-Type": "application/octet-stream", "X-Filename": "notes.md",
+                   "Content-Encoding": "zstd", "Accept-Encoding": "gzip;q=1, zstd;q=1"})
+
+    resp = asyncio.run(process_file(req))
+
+    assert resp.status_code == 200 and resp.headers["Content-Encoding"] == "zstd"
+    assert zstandard.ZstdDecompressor().decompress(resp.get_body()).decode() == NOTES.decode()
+
+
+def test_decompression_bomb_is_rejected_early(monkeypatch):
+    monkeypatch.setenv("REQUEST_MAX_DECOMPRESSED_MB", "1")
+    bomb = gzip.compress(b"\0" * (64 * MB))
+    inflated = []
+    real_inflate = function_app._inflate
+
+    def counting(data, encoding):
+        for chunk in real_inflate(data, encoding):
+            inflated.append(len(chunk))
+            yield chunk
+
+    monkeypatch.setattr(function_app, "_inflate", counting)
+    resp = asyncio.run(process_file(request("process_file", bomb, {"Content-Encoding": "gzip"}, "?format=json")))
+
+    assert resp.status_code == 413
+    assert sum(inflated) <= 2 * MB
+
+
+def test_invalid_and_unsupported_encodings():
+    garbage = asyncio.run(process_file(request("process_file", b"not gzip", {"Content-Encoding": "gzip"})))
+    brotli = asyncio.run(process_file(request("process_file", b"...", {"Content-Encoding": "br"})))
+    assert garbage.status_code == 400 and b"Invalid gzip body" in garbage.get_body()
+    assert brotli.status_code == 415
+
+
+def test_ingest_rejects_bad_encodings_with_client_errors():
+    garbage = ingest(request("ingest", b"not gzip", {"Content-Encoding": "gzip"}))
+    brotli = ingest(request("ingest", b"...", {"Content-Encoding": "br"}))
+    assert garbage.status_code == 400 and b"Invalid gzip body" in garbage.get_body()
+    assert brotli.status_code == 415
+
+
+def test_multi_member_gzip_body():
+    data = json_body()
+    body = gzip.compress(data[:100]) + gzip.compress(data[100:])
+    assert function_app._request_body(request("process_file", body, {"Content-Encoding": "gzip"})) == data
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip, zstd;q=0.5", "gzip"),
+    ("*", "zstd"),
+    ("gzip;q=0, *;q=0.1", "zstd"),
+    ("br", None),
+])
+def test_accept_encoding_negotiation(accept, expected):
+    zstd()
+    assert function_app._negotiate_encoding(accept) == expected
+
+
+def test_small_and_unaccepted_responses_are_left_alone():
+    body = json.dumps({"files": [json.loads(json_body("tiny.md", b"hi"))]}).encode()
+    small = process_batch(request("process_batch", body, {"Accept-Encoding": "gzip"}))
+    assert "Content-Encoding" not in small.headers
+
+    big = process_batch(request("process_batch", json.dumps({"files": [json.loads(json_body())]}).encode(), {}))
+    assert "Content-Encoding" not in big.headers and big.headers["Vary"] == "Accept-Encoding"
+
+
+def test_write_to_repo_accepts_gzip_body(monkeypatch):
+    written = {}
+
+    async def fake_write(repo, branch, path, content, message, headers):
+        written[path] = content
+        return {"status": "ok", "action": "created", "repo": repo, "path": path, "branch": branch,
+                "commit_sha": "abc", "html_url": None}
+
+    monkeypatch.setattr(function_app, "_write_file", fake_write)
+    monkeypatch.setenv("GITHUB_TOKEN", "testtoken")
+    payload = {"repo": "o/r", "path": "docs/a.md", "content": NOTES.decode()}
+    req = request("write_to_repo", gzip.compress(json.dumps(payload).encode()), {"Content-Encoding": "gzip"})
+
+    resp = asyncio.run(write_to_repo(req))
+
+    assert resp.status_code == 200, resp.get_body()
+    assert written == {"docs/a.md": NOTES.decode()}
@@ -0,0 +1,72 @@
+import asyncio
+import base64
+import io
+import json
+from pathlib import Path
+import azure.functions as func
+import pytest
+import function_app
+from function_app import process_file  # type: ignore
+
+FIXTURES = Path(__file__).parent / "fixtures"
+DOCX = (FIXTURES / "documents" / "Architecture Guidelines.docx").read_bytes()
+PNG = (FIXTURES / "images" / "architecture overview.png").read_bytes()
+
+
+def upload(filename: str, data: bytes, content_type: str | None = None):
+    payload = {"filename": filename, "content_base64": base64.b64encode(data).decode()}
+    if content_type:
+        payload["content_type"] = content_type
+    result, error = function_app._upload_from_payload(payload)
+    assert error is None
+    return result
+
+
+@pytest.mark.parametrize("filename, data, expected", [
+    ("report.bin", b"%PDF-1.7\n...", "application/pdf"),
+    ("upload", DOCX, function_app._DOCX_TYPE),
+    ("scan.dat", PNG, "image/png"),
+    ("page", b"  <!DOCTYPE html><html><body>Hi</body></html>", "text/html"),
+    ("notes", "plain UTF-8 notes – café".encode(), "text/plain"),
+    ("table.csv", b"a,b\n1,2\n", "text/csv"),
+    ("blob", bytes(range(256)), "application/octet-stream"),
+])
+def test_content_type_from_magic_bytes(filename, data, expected):
+    assert upload(filename, data).content_type == expected
+
+
+def test_declared_type_wins_unless_generic():
+    assert upload("a.bin", b"%PDF-1.4", "application/x-custom").content_type == "application/x-custom"
+    assert upload("a.bin", b"%PDF-1.4", "application/octet-stream").content_type == "application/pdf"
+
+
+@pytest.mark.parametrize("filename, text", [
+    ("notes.txt", "first line  \r\nsecond\n\n\n\nlast\t\n"),
+    ("readme.md", "﻿# Title\n\nSome *text* with ünïcode\n"),
+    ("data.json", '{"a": [1, 2, 3],\n  "b": "c"}\n'),
+    ("rows.csv", '﻿name,desc\n\n\na|b,"multi\nline"\nx\\|y,z,extra\n\n'),
+])
+def test_fast_path_matches_markitdown(filename, text):
+    data = text.encode("utf-8")
+    expected = function_app._convert_stream(io.BytesIO(data), filename, use_llm=False)
+    assert function_app._convert_fast(upload(filename, data)) == expected
+
+
+def test_text_uploads_skip_markitdown(monkeypatch):
+    def no_converter(**kwargs):
+        raise AssertionError("MarkItDown should not be built for plain text")
+
+    monkeypatch.setattr(function_app._converters, "get", no_converter)
+    monkeypatch.setattr(function_app, "_conversion_cache", function_app._TwoTierCache(None, 0, 0))
+    body = {"filename": "notes.md", "content_base64": base64.b64encode(b"# Notes\n\nfast").decode()}
+    resp = asyncio.run(process_file(func.HttpRequest(method="POST", url="http://localhost/api/process_file?format=json",
+                                         params={}, body=json.dumps(body).encode())))
+    data = json.loads(resp.get_body())["data"]
+    assert data["markdown"] == "# Notes\n\nfast" and data["content_type"] == "text/markdown"
+
+
+def test_fast_path_defers_to_markitdown(monkeypatch):
+    assert function_app._convert_fast(upload("legacy.txt", "café".encode("cp1252"))) is None
+    assert function_app._convert_fast(upload("notes", b"no extension")) is None
+    monkeypatch.setenv("FAST_CONVERTERS_ENABLED", "false")
+    assert function_app._convert_fast(upload("notes.txt", b"hello")) is None
@@ -0,0 +1,80 @@
+import asyncio
+import base64
+import json
+import azure.functions as func
+import function_app
+from function_app import process_file  # type: ignore
+
+
+def make_request(body: dict, url_suffix: str = "?format=json"):
+    return func.HttpRequest(
+        method="POST",
+        url=f"http://localhost/api/process_file{url_suffix}",
+        params={},
+        body=json.dumps(body).encode("utf-8"),
+    )
+
+
+def use_fresh_cache(monkeypatch, tmp_path):
+    cache = function_app._TwoTierCache(str(tmp_path), memory_bytes=1024 * 1024, disk_bytes=1024 * 1024)
+    monkeypatch.setattr(function_app, "_conversion_cache", cache)
+    return cache
+
+
+def test_process_file_reports_cache_miss_then_hit(monkeypatch, tmp_path):
+    use_fresh_cache(monkeypatch, tmp_path)
+    body = {"filename": "notes.txt", "content_base64": base64.b64encode(b"cached body").decode()}
+
+    first = asyncio.run(process_file(make_request(body)))
+    second = asyncio.run(process_file(make_request(body)))
+
+    first_data = json.loads(first.get_body())["data"]
+    second_data = json.loads(second.get_body())["data"]
+    assert first_data["cache"] == "miss"
+    assert second_data["cache"] == "hit"
+    assert second_data["markdown"] == first_data["markdown"]
+    assert second.headers["X-Conversion-Cache"] == "hit"
+
+
+def test_disk_tier_survives_new_process(monkeypatch, tmp_path):
+    use_fresh_cache(monkeypatch, tmp_path)
+    body = {"filename": "notes.txt", "content_base64": base64.b64encode(b"persisted body").decode()}
+    asyncio.run(process_file(make_request(body)))
+
+    # Simulate a recycled worker: empty memory tier, same directory.
+    use_fresh_cache(monkeypatch, tmp_path)
+    resp = asyncio.run(process_file(make_request(body, url_suffix="")))
+    assert resp.headers["X-Conversion-Cache"] == "hit"
+    assert "persisted body" in resp.get_body().decode()
+
+
+def test_cache_key_includes_llm_settings(monkeypatch):
+    sha = "0" * 64
+    monkeypatch.setenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o")
+    key_a = function_app._conversion_cache_key(sha, function_app._conversion_settings(use_llm=True))
+    monkeypatch.setenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini")
+    key_b = function_app._conversion_cache_key(sha, function_app._conversion_settings(use_llm=True))
+    key_plain = function_app._conversion_cache_key(sha, function_app._conversion_settings(use_llm=False))
+    assert len({key_a, key_b, key_plain}) == 3
+
+
+def test_cache_key_includes_extension_and_content_type(monkeypatch, tmp_path):
+    use_fresh_cache(monkeypatch, tmp_path)
+    data = base64.b64encode(b"a,b\n1,2\n").decode()
+    as_text = asyncio.run(process_file(make_request({"filename": "x.txt", "content_base64": data})))
+    as_csv = asyncio.run(process_file(make_request({"filename": "x.csv", "content_base64": data})))
+
+    assert json.loads(as_csv.get_body())["data"]["cache"] == "miss"
+    assert json.loads(as_text.get_body())["data"]["markdown"] != json.loads(as_csv.get_body())["data"]["markdown"]
+    keys = {function_app._lookup_conversion(function_app._upload_from_payload(
+        {"filename": name, "content_base64": data})[0])[0] for name in ("x.txt", "x.csv")}
+    assert len(keys) == 2
+
+
+def test_disk_tier_is_bounded(tmp_path):
+    cache = function_app._TwoTierCache(str(tmp_path), memory_bytes=0, disk_bytes=2048)
+    for i in range(10):
+        cache.put(f"{i:02d}" + "a" * 62, "x" * 500)
+    total = sum(p.stat().st_size for p in tmp_path.rglob("*.md"))
+    assert total <= 2048
+    assert cache.get("09" + "a" * 62) == "x" * 500
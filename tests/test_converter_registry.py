@@ -0,0 +1,45 @@
+import threading
+import function_app
+
+
+def counting_builder(monkeypatch):
+    calls = []
+
+    def fake_build(use_llm: bool):
+        calls.append(use_llm)
+        return object()
+
+    monkeypatch.setattr(function_app, "_build_markitdown_with_optional_llm", fake_build)
+    return calls
+
+
+def test_plain_converter_is_built_once_across_threads(monkeypatch):
+    calls = counting_builder(monkeypatch)
+    registry = function_app._ConverterRegistry()
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(registry.get(use_llm=False))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == [False]
+    assert len({id(x) for x in seen}) == 1
+
+
+def test_llm_converter_rebuilt_only_when_settings_change(monkeypatch):
+    calls = counting_builder(monkeypatch)
+    registry = function_app._ConverterRegistry()
+    monkeypatch.setenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o")
+    first = registry.get(use_llm=True)
+    assert registry.get(use_llm=True) is first
+    monkeypatch.setenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini")
+    second = registry.get(use_llm=True)
+    assert second is not first
+    assert calls == [True, True]
+
+
+def test_prewarm_builds_both_variants(monkeypatch):
+    calls = counting_builder(monkeypatch)
+    registry = function_app._ConverterRegistry()
+    registry.prewarm()
+    assert sorted(calls) == [False, True]
@@ -0,0 +1,170 @@
+import asyncio
+import base64
+import io
+import threading
+from types import SimpleNamespace
+from PIL import Image
+import function_app
+
+
+class FakeAsyncClient:
+    """Async stand-in for AzureOpenAI chat completions that records concurrency."""
+
+    def __init__(self, delay: float = 0.0):
+        self.calls = 0
+        self.messages = []
+        self.active = 0
+        self.max_active = 0
+        self.delay = delay
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, model, messages):
+        with self._lock:
+            self.calls += 1
+            self.messages.append(messages)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+        content = SimpleNamespace(content=f"description #{self.calls}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=content)])
+
+
+def diagram_png(size: int = 256, fmt: str = "PNG", variant: int = 0) -> bytes:
+    img = Image.new("RGB", (size, size), "white")
+    top = size * (1 + 2 * variant) // 10
+    for x in range(size):
+        for y in range(top, top + size // 6):
+            img.putpixel((x, y), (x * 255 // size, 0, 80))
+    for y in range(size):
+        img.putpixel(((variant + 1) * size // 5, y), (0, 0, 0))
+    buffer = io.BytesIO()
+    img.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def caption_messages(image: bytes, prompt: str = "Describe"):
+    uri = "data:image/png;base64," + base64.b64encode(image).decode()
+    return [{"role": "user", "content": [{"type": "text", "text": prompt}, {"type": "image_url", "image_url": {"url": uri}}]}]
+
+
+def make_client(tmp_path, fake, concurrency=4):
+    store = function_app._TwoTierCache(str(tmp_path), memory_bytes=1024 * 1024, disk_bytes=1024 * 1024)
+    cache = function_app._CaptionCache(store, max_distance=4)
+    return function_app._CaptionClient(lambda: fake, endpoint="https://example", concurrency=concurrency, cache=cache)
+
+
+def test_near_duplicate_images_reuse_description(tmp_path):
+    fake = FakeAsyncClient()
+    client = make_client(tmp_path, fake)
+
+    first = client.chat.completions.create(model="gpt-4o", messages=caption_messages(diagram_png()))
+    # Same diagram, downscaled and re-encoded as JPEG.
+    second = client.chat.completions.create(model="gpt-4o", messages=caption_messages(diagram_png(128, "JPEG")))
+
+    assert fake.calls == 1
+    assert second.choices[0].message.content == first.choices[0].message.content
+
+
+def test_exact_matches_are_served_without_the_conversion_cache():
+    cache = function_app._CaptionCache(function_app._TwoTierCache(None, 0, 0), max_distance=0)
+    cache.put("scope", 0xABCDEF, "a diagram")
+    assert cache.get("scope", 0xABCDEF) == "a diagram"
+    assert cache.get("scope", 0xABCDEE) is None
+    assert cache.get("other", 0xABCDEF) is None
+
+
+def test_near_duplicates_are_found_by_band_and_evicted_cleanly():
+    cache = function_app._CaptionCache(function_app._TwoTierCache(None, 0, 0), max_distance=4, max_entries=2)
+    base = 0x0123456789ABCDEF
+    cache.put("scope", base, "first")
+    assert cache.get("scope", base ^ 0b1011) == "first"  # 3 bits apart
+    assert cache.get("scope", base ^ (1 | 1 << 20 | 1 << 40 | 1 << 50 | 1 << 63)) is None  # 5 bits apart
+
+    cache.put("scope", 1, "second")
+    cache.put("scope", 2, "third")  # evicts `base`
+    assert cache.get("scope", base ^ 0b1011) is None
+    assert all(base not in bucket for bucket in cache._buckets.values())
+
+
+def test_prompt_and_deployment_are_part_of_the_key(tmp_path):
+    fake = FakeAsyncClient()
+    client = make_client(tmp_path, fake)
+    image = diagram_png()
+
+    client.chat.completions.create(model="gpt-4o", messages=caption_messages(image))
+    client.chat.completions.create(model="gpt-4o", messages=caption_messages(image, prompt="Other prompt"))
+    client.chat.completions.create(model="gpt-4o-mini", messages=caption_messages(image))
+    assert fake.calls == 3
+
+
+def test_concurrency_is_bounded_and_inflight_calls_shared(tmp_path):
+    fake = FakeAsyncClient(delay=0.05)
+    client = make_client(tmp_path, fake, concurrency=2)
+    images = [diagram_png(variant=i) for i in range(4)]
+    # Each distinct image requested by two threads at once.
+    jobs = [images[i % 4] for i in range(8)]
+    results = {}
+
+    def run(index, image):
+        resp = client.chat.completions.create(model="gpt-4o", messages=caption_messages(image))
+        results[index] = resp.choices[0].message.content
+
+    threads = [threading.Thread(target=run, args=(i, img)) for i, img in enumerate(jobs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(results) == 8
+    assert fake.calls == 4
+    assert fake.max_active == 2
+
+
+def test_perceptual_hash_rejects_non_images():
+    assert function_app._perceptual_hash(b"not an image") is None
+    assert isinstance(function_app._perceptual_hash(diagram_png()), int)
+
+
+def large_photo_png() -> bytes:
+    gradient = Image.linear_gradient("L").resize((3000, 2000))
+    img = Image.merge("RGB", (gradient, gradient.rotate(90, expand=False), gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    exif = Image.Exif()
+    exif[0x010E] = "secret description"  # ImageDescription
+    buffer = io.BytesIO()
+    img.save(buffer, "PNG", exif=exif)
+    return buffer.getvalue()
+
+
+def test_large_image_is_shrunk_before_captioning(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLM_IMAGE_MAX_DIMENSION", "1024")
+    fake = FakeAsyncClient()
+    client = make_client(tmp_path, fake)
+    original = large_photo_png()
+    recorded = []
+    token = function_app._image_preprocessing.set(recorded)
+    try:
+        client.chat.completions.create(model="gpt-4o", messages=caption_messages(original))
+    finally:
+        function_app._image_preprocessing.reset(token)
+
+    uri = fake.messages[0][0]["content"][1]["image_url"]["url"]
+    assert uri.startswith("data:image/webp;base64,")
+    sent = base64.b64decode(uri.split(",", 1)[1])
+    with Image.open(io.BytesIO(sent)) as img:
+        assert max(img.size) == 1024
+        assert not img.getexif()
+    assert recorded[0]["original_bytes"] == len(original)
+    assert recorded[0]["sent_bytes"] == len(sent) < len(original)
+    assert recorded[0]["elapsed_ms"] >= 0
+
+
+def test_preprocessing_can_be_disabled(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLM_IMAGE_PREPROCESS", "false")
+    fake = FakeAsyncClient()
+    client = make_client(tmp_path, fake)
+    messages = caption_messages(diagram_png())
+    client.chat.completions.create(model="gpt-4o", messages=messages)
+    assert fake.messages[0] == messages
@@ -0,0 +1,89 @@
+"""Cold-start guard: importing function_app must stay cheap and free of heavy packages."""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+import function_app
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY = ("httpx", "requests", "markitdown", "openai", "numpy", "PIL", "magika", "pdfplumber",
+         "azure.storage.blob", "azure.storage.queue", "azure.data.tables", "opentelemetry")
+
+# azure.functions is loaded by the worker before the app, so it is not counted.
+MEASURE = """
+import json, sys, time
+import azure.functions
+started = time.perf_counter()
+import function_app
+elapsed = (time.perf_counter() - started) * 1000
+print(json.dumps({"ms": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+WRITE_TO_REPO = """
+import asyncio, json, sys
+import azure.functions as func
+import function_app
+
+class Resp:
+    def __init__(self, status, body):
+        self.status_code, self._body, self.headers = status, body, {}
+        self.text = json.dumps(body)
+    def json(self):
+        return self._body
+
+class Session:
+    async def request(self, method, url, **kw):
+        if method == "GET":
+            return Resp(404, {})
+        return Resp(201, {"content": {"html_url": "u"}, "commit": {"sha": "abc"}})
+
+function_app._github_session = lambda: Session()
+body = json.dumps({"repo": "o/r", "path": "a.md", "content": "# A"}).encode()
+resp = asyncio.run(function_app.write_to_repo(func.HttpRequest(method="POST", url="http://localhost/api/write_to_repo",
+                                                               params={}, body=body)))
+assert resp.status_code == 200, resp.get_body()
+print(json.dumps({"modules": sorted(sys.modules)}))
+"""
+
+
+def run(script: str, **env: str) -> dict:
+    skip = ("CONVERTER_PREWARM", "TRACING_ENABLED", "PYTHONDONTWRITEBYTECODE")
+    environ = {k: v for k, v in os.environ.items() if k not in skip}
+    environ.update(env)
+    out = subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=environ, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def loaded(modules: list[str], name: str) -> bool:
+    return any(m == name or m.startswith(name + ".") for m in modules)
+
+
+def test_import_stays_within_budget(tmp_path):
+    budget_ms = float(os.getenv("IMPORT_TIME_BUDGET_MS", "30"))
+    # Measure with compiled bytecode, as deployed; the first run fills the cache.
+    cache = {"PYTHONPYCACHEPREFIX": str(tmp_path)}
+    runs = [run(MEASURE, **cache) for _ in range(4)][1:]
+    fastest = min(r["ms"] for r in runs)
+    assert fastest <= budget_ms, f"import function_app took {fastest:.1f} ms (budget {budget_ms} ms)"
+    assert [name for name in HEAVY if loaded(runs[0]["modules"], name)] == []
+
+
+def test_write_to_repo_never_loads_converters():
+    modules = run(WRITE_TO_REPO, GITHUB_TOKEN="testtoken")["modules"]
+    assert loaded(modules, "httpx")
+    assert not loaded(modules, "markitdown") and not loaded(modules, "openai")
+
+
+def test_dotenv_is_skipped_when_hosted(monkeypatch):
+    checked = []
+    monkeypatch.setattr(function_app.os.path, "isfile", lambda path: checked.append(path) or False)
+    monkeypatch.setenv("WEBSITE_INSTANCE_ID", "abc123")
+    function_app._load_local_dotenv()
+    assert checked == []
+
+    monkeypatch.delenv("WEBSITE_INSTANCE_ID")
+    function_app._load_local_dotenv()
+    assert checked and checked[0].endswith(".env")
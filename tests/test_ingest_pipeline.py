@@ -0,0 +1,154 @@
+import base64
+import json
+import os
+import azure.functions as func
+from azure.core.exceptions import ResourceNotFoundError
+import function_app
+from function_app import ingest, ingest_status  # type: ignore
+
+
+class FakeDownload:
+    def __init__(self, data: bytes):
+        self._data = data
+        self.size = len(data)
+
+    def readall(self):
+        return self._data
+
+    def readinto(self, stream):
+        stream.write(self._data)
+        return self.size
+
+
+class FakeContainer:
+    def __init__(self):
+        self.blobs = {}
+
+    def upload_blob(self, name, data, overwrite=False, length=None):
+        if hasattr(data, "read"):
+            data = data.read()
+        self.blobs[name] = data.encode("utf-8") if isinstance(data, str) else bytes(data)
+
+    def download_blob(self, name):
+        if name not in self.blobs:
+            raise ResourceNotFoundError(name)
+        return FakeDownload(self.blobs[name])
+
+
+class FakeQueueProperties:
+    def __init__(self, count):
+        self.approximate_message_count = count
+
+
+class FakeQueue:
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, content):
+        self.messages.append(content)
+
+    def get_queue_properties(self):
+        return FakeQueueProperties(len(self.messages))
+
+
+def install(monkeypatch):
+    container = FakeContainer()
+    queues = {}
+    monkeypatch.setattr(function_app, "_blob_container", lambda: container)
+    monkeypatch.setattr(function_app, "_queue_client", lambda name: queues.setdefault(name, FakeQueue()))
+    return container, queues
+
+
+def make_req(body: dict):
+    return func.HttpRequest(
+        method="POST",
+        url="http://localhost/api/ingest",
+        params={},
+        body=json.dumps(body).encode("utf-8"),
+    )
+
+
+def drain(queues, name, handler):
+    queue = queues.get(name)
+    while queue and queue.messages:
+        handler(json.loads(queue.messages.pop(0))["job_id"])
+
+
+def get_status(job_id):
+    req = func.HttpRequest(method="GET", url=f"http://localhost/api/ingest_status/{job_id}",
+                           route_params={"job_id": job_id}, body=b"")
+    return json.loads(ingest_status(req).get_body())
+
+
+def test_ingest_runs_convert_and_persist_stages(monkeypatch):
+    container, queues = install(monkeypatch)
+    written = {}
+
+    async def fake_write(repo, branch, path, content, message, headers):
+        written[path] = content
+        return {"status": "ok", "action": "created", "commit_sha": "abc123"}
+
+    monkeypatch.setattr(function_app, "_write_file", fake_write)
+    os.environ["GITHUB_TOKEN"] = "testtoken"
+
+    resp = ingest(make_req({
+        "filename": "notes.txt",
+        "content_base64": base64.b64encode(b"queued document").decode(),
+        "repo": "owner/repo",
+        "path": "docs/notes.md",
+    }))
+    assert resp.status_code == 202, resp.get_body()
+    job_id = json.loads(resp.get_body())["job_id"]
+    assert get_status(job_id)["job"]["state"] == "queued"
+
+    drain(queues, function_app._CONVERT_QUEUE, function_app._ingest_convert)
+    assert get_status(job_id)["job"]["state"] == "converted"
+    drain(queues, function_app._PERSIST_QUEUE, function_app._ingest_persist)
+
+    job = get_status(job_id)["job"]
+    assert job["state"] == "completed"
+    assert job["result"]["commit_sha"] == "abc123"
+    assert "queued document" in written["docs/notes.md"]
+
+
+def test_ingest_applies_backpressure(monkeypatch):
+    _, queues = install(monkeypatch)
+    monkeypatch.setenv("INGEST_MAX_QUEUE_DEPTH", "1")
+    queues[function_app._CONVERT_QUEUE] = FakeQueue()
+    queues[function_app._CONVERT_QUEUE].messages.append("{}")
+    resp = ingest(make_req({"filename": "a.txt", "content_base64": base64.b64encode(b"x").decode()}))
+    assert resp.status_code == 429
+    assert resp.headers["Retry-After"]
+
+
+def test_ingest_removes_spooled_upload(monkeypatch):
+    install(monkeypatch)
+    monkeypatch.setenv("UPLOAD_SPOOL_MB", "0")
+    spooled = []
+    real_read_upload = function_app._read_upload
+
+    def spy(req):
+        upload, error = real_read_upload(req)
+        spooled.append(upload.path)
+        return upload, error
+
+    monkeypatch.setattr(function_app, "_read_upload", spy)
+    resp = ingest(make_req({"filename": "a.txt", "content_base64": base64.b64encode(b"spooled").decode()}))
+
+    assert resp.status_code == 202
+    assert spooled[0] and not os.path.exists(spooled[0])
+
+
+def test_poison_message_marks_job_failed(monkeypatch):
+    install(monkeypatch)
+    function_app._save_job({"job_id": "abc", "state": "converting"})
+    msg = func.QueueMessage(body=json.dumps({"job_id": "abc"}).encode())
+    function_app.ingest_convert_poison(msg)
+    assert get_status("abc")["job"]["state"] == "failed"
+
+
+def test_ingest_status_unknown_job(monkeypatch):
+    install(monkeypatch)
+    req = func.HttpRequest(method="GET", url="http://localhost/api/ingest_status/nope",
+                           route_params={"job_id": "nope"}, body=b"")
+    assert ingest_status(req).status_code == 404
@@ -0,0 +1,139 @@
+import asyncio
+import base64
+import json
+import os
+import time
+from pathlib import Path
+import azure.functions as func
+import pytest
+import function_app
+from function_app import process_file  # type: ignore
+from test_image_captions import FakeAsyncClient, caption_messages, diagram_png, make_client
+
+DOCX = Path(__file__).parent / "fixtures" / "documents" / "Architecture Guidelines.docx"
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = function_app._SupervisedPool(2)
+    monkeypatch.setattr(function_app, "_supervised_pool_obj", pool)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = function_app._CircuitBreaker(threshold=2, cooldown=60)
+    monkeypatch.setattr(function_app, "_circuit_breaker", breaker)
+    return breaker
+
+
+def test_workers_are_reused_and_report_errors_by_class(pool):
+    first = pool.run(os.getpid, (), timeout=30)
+    assert pool.run(os.getpid, (), timeout=30) == first != os.getpid()
+    with pytest.raises(function_app._ConversionFailure) as excinfo:
+        pool.run(int, ("not a number",), timeout=30)
+    assert excinfo.value.kind == "ValueError"
+    assert pool.run(os.getpid, (), timeout=30) == first  # an ordinary error keeps the worker
+
+
+def test_overrunning_worker_is_killed_and_replaced(pool):
+    pool.run(os.getpid, (), timeout=30)  # warm a worker so the limit only covers the task
+    started = time.monotonic()
+    with pytest.raises(function_app._ConversionFailure) as excinfo:
+        pool.run(time.sleep, (30,), timeout=1)
+    assert excinfo.value.kind == "ConversionTimeout"
+    assert time.monotonic() - started < 10
+    assert pool.run(len, (b"abc",), timeout=30) == 3
+
+
+@pytest.mark.skipif(function_app._process_rss(os.getpid()) is None, reason="needs /proc")
+def test_memory_limit_kills_worker(pool):
+    with pytest.raises(function_app._ConversionFailure) as excinfo:
+        pool.run(time.sleep, (30,), timeout=30, memory_limit=1024 * 1024)
+    assert excinfo.value.kind == "ConversionMemoryExceeded"
+
+
+def test_breaker_opens_after_repeated_timeouts_and_half_opens():
+    now = [0.0]
+    breaker = function_app._CircuitBreaker(threshold=2, cooldown=10, clock=lambda: now[0])
+    timeout = function_app._ConversionFailure("ConversionTimeout")
+
+    breaker.record("pdf", function_app._ConversionFailure("FileConversionException"))  # a bad file, not a trend
+    breaker.record("pdf", timeout)
+    breaker.check("pdf")
+    breaker.record("pdf", timeout)
+    with pytest.raises(function_app._ConversionFailure, match="CircuitOpen"):
+        breaker.check("pdf")
+    breaker.check("docx")  # other formats are unaffected
+
+    now[0] = 11
+    breaker.check("pdf")  # the half-open trial
+    with pytest.raises(function_app._ConversionFailure):
+        breaker.check("pdf")  # only one trial at a time
+    breaker.record("pdf")
+    breaker.check("pdf")
+    assert breaker.state() == {}
+
+
+def test_open_circuit_fails_fast(monkeypatch, pool, breaker):
+    monkeypatch.setenv("CONVERSION_TIMEOUT_SECONDS_SLOW", "1")
+    for _ in range(2):
+        with pytest.raises(function_app._ConversionFailure, match="ConversionTimeout"):
+            function_app._run_isolated("slow", time.sleep, 30)
+
+    started = time.monotonic()
+    with pytest.raises(function_app._ConversionFailure) as excinfo:
+        function_app._run_isolated("slow", time.sleep, 30)
+    assert time.monotonic() - started < 0.5
+    assert function_app._extraction_failed(excinfo.value) == "(extraction_failed: CircuitOpen)"
+
+
+def test_process_file_converts_in_worker(monkeypatch, pool, breaker):
+    monkeypatch.setattr(function_app, "_conversion_cache", function_app._TwoTierCache(None, 0, 0))
+    body = {"filename": DOCX.name, "content_base64": base64.b64encode(DOCX.read_bytes()).decode()}
+
+    def convert():
+        req = func.HttpRequest(method="POST", url="http://localhost/api/process_file?format=json",
+                               params={}, body=json.dumps(body).encode())
+        return json.loads(asyncio.run(process_file(req)).get_body())
+
+    in_process = convert()
+    monkeypatch.setenv("CONVERSION_ISOLATION", "true")
+    isolated = convert()
+
+    assert isolated["data"]["markdown"] == in_process["data"]["markdown"]
+    assert "isolated" in isolated["timings"]
+
+
+def test_ndjson_pages_are_walked_in_worker(monkeypatch, pool, breaker, make_pdf):
+    body = {"filename": "report.pdf", "content_base64": base64.b64encode(make_pdf(["Alpha", "Beta", "Gamma"])).decode()}
+
+    def pages():
+        req = func.HttpRequest(method="POST", url="http://localhost/api/process_file?format=ndjson&pages=2-",
+                               params={}, body=json.dumps(body).encode())
+        lines = asyncio.run(process_file(req)).get_body().decode().splitlines()
+        return [json.loads(line) for line in lines if json.loads(line)["type"] == "page"]
+
+    in_process = pages()
+    monkeypatch.setenv("CONVERSION_ISOLATION", "true")
+    worker = pool.run(os.getpid, (), timeout=30)
+    isolated = pages()
+
+    assert isolated == in_process and [page["page"] for page in isolated] == [2, 3]
+    monkeypatch.setattr(function_app, "_iter_pdf_pages", None)  # the parent no longer parses the PDF
+    assert pages() == in_process
+    assert pool.run(os.getpid, (), timeout=30) == worker
+
+
+def test_hung_caption_call_times_out_and_trips_breaker(monkeypatch, tmp_path):
+    monkeypatch.setenv("LLM_TIMEOUT_SECONDS", "1")
+    monkeypatch.setattr(function_app, "_circuit_breaker", function_app._CircuitBreaker(threshold=1, cooldown=60))
+    fake = FakeAsyncClient(delay=30)
+    client = make_client(tmp_path, fake)
+
+    with pytest.raises(function_app._ConversionFailure, match="LLMTimeout"):
+        client.chat.completions.create(model="gpt-4o", messages=caption_messages(diagram_png()))
+    with pytest.raises(function_app._ConversionFailure, match="CircuitOpen"):
+        client.chat.completions.create(model="gpt-4o", messages=caption_messages(diagram_png(variant=2)))
+    assert fake.calls == 1
@@ -0,0 +1,107 @@
+import io
+import function_app
+
+
+def make_pptx(titles: list[str]) -> bytes:
+    import pptx
+
+    deck = pptx.Presentation()
+    for i, title in enumerate(titles):
+        slide = deck.slides.add_slide(deck.slide_layouts[1])
+        slide.shapes.title.text = title
+        slide.placeholders[1].text = f"Body of slide {i + 1}"
+    buffer = io.BytesIO()
+    deck.save(buffer)
+    return buffer.getvalue()
+
+
+def serial(filename: str, data: bytes) -> str:
+    return function_app._convert_stream(io.BytesIO(data), filename, use_llm=False)
+
+
+def upload_for(filename: str, data: bytes) -> function_app._Upload:
+    return function_app._Upload(
+        filename,
+        function_app._infer_content_type(filename),
+        function_app._hash_bytes(data),
+        len(data),
+        data=data,
+    )
+
+
+def test_page_ranges_cover_document_in_order():
+    ranges = function_app._page_ranges(30, 4)
+    assert ranges[0][0] == 0 and ranges[-1][1] == 30
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    assert len(ranges) == 4
+    # Never split below the minimum range size.
+    assert len(function_app._page_ranges(6, 8)) == 1
+
+
+def test_parallel_pdf_matches_serial(monkeypatch, make_pdf):
+    monkeypatch.setenv("PAGE_PARALLEL_MIN_PAGES", "8")
+    monkeypatch.setenv("PAGE_PARALLEL_MAX_RANGES", "3")
+    monkeypatch.setenv("PAGE_PARALLEL_MIN_MB", "0")
+    data = make_pdf([f"Section {i} text" for i in range(1, 13)])
+
+    parallel = function_app._convert_parallel(upload_for("report.pdf", data))
+    assert parallel is not None
+    assert parallel == serial("report.pdf", data)
+
+
+def test_parallel_pptx_matches_serial(monkeypatch):
+    monkeypatch.setenv("PAGE_PARALLEL_MIN_PAGES", "8")
+    monkeypatch.setenv("PAGE_PARALLEL_MAX_RANGES", "3")
+    monkeypatch.setenv("PAGE_PARALLEL_MIN_MB", "0")
+    data = make_pptx([f"Slide title {i}" for i in range(1, 11)])
+
+    parallel = function_app._convert_parallel(upload_for("deck.pptx", data))
+    assert parallel is not None
+    assert parallel == serial("deck.pptx", data)
+    assert "<!-- Slide number: 10 -->" in parallel
+
+
+def test_small_documents_stay_serial(monkeypatch, make_pdf):
+    monkeypatch.setenv("PAGE_PARALLEL_MIN_PAGES", "8")
+    monkeypatch.setenv("PAGE_PARALLEL_MAX_RANGES", "3")
+    monkeypatch.setenv("PAGE_PARALLEL_MIN_MB", "0")
+
+    def no_pool():
+        raise AssertionError("pool should not be used")
+
+    monkeypatch.setattr(function_app, "_get_process_pool", no_pool)
+    assert function_app._convert_parallel(upload_for("short.pdf", make_pdf(["a", "b"]))) is None
+    assert function_app._convert_parallel(upload_for("notes.txt", b"text")) is None
+
+
+def test_small_files_are_not_spilled_or_counted(monkeypatch, make_pdf):
+    monkeypatch.setenv("PAGE_PARALLEL_MIN_PAGES", "8")
+    monkeypatch.setenv("PAGE_PARALLEL_MAX_RANGES", "3")
+
+    def no_count(path):
+        raise AssertionError("small files should not be opened")
+
+    monkeypatch.setattr(function_app, "_pdf_page_count", no_count)
+    monkeypatch.setattr(function_app.tempfile, "mkstemp", no_count)
+    data = make_pdf([f"Section {i} text" for i in range(1, 13)])
+    assert function_app._convert_parallel(upload_for("report.pdf", data)) is None
+
+
+def test_pptx_range_keeps_only_its_slides(monkeypatch, tmp_path):
+    import zipfile
+
+    path = tmp_path / "deck.pptx"
+    path.write_bytes(make_pptx([f"Slide title {i}" for i in range(1, 41)]))
+    saved = []
+    real_convert = function_app._convert_stream
+
+    def capture(stream, filename, use_llm):
+        saved.append(stream.getvalue())
+        return real_convert(stream, filename, use_llm)
+
+    monkeypatch.setattr(function_app, "_convert_stream", capture)
+    markdown_text = function_app._convert_pptx_range(str(path), 10, 15)
+
+    slides = [n for n in zipfile.ZipFile(io.BytesIO(saved[0])).namelist() if n.startswith("ppt/slides/slide")]
+    assert len(slides) == 5
+    assert "Slide title 11" in markdown_text and "Slide title 16" not in markdown_text
@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import os
 import json
@@ -29,7 +30,7 @@ def test_process_image_artifact_markdown():
     b64_img = base64.b64encode(img_bytes).decode()
 
     req = make_request({"filename": "architecture overview.png", "content_base64": b64_img})
-    resp = process_file(req)
+    resp = asyncio.run(process_file(req))
     assert resp.status_code == 200, resp.get_body()[:200]
     body = resp.get_body().decode(errors="replace")
     lines = body.splitlines()
@@ -0,0 +1,81 @@
+import base64
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import azure.functions as func
+import function_app
+from function_app import process_batch  # type: ignore
+
+
+def make_request(body):
+    return func.HttpRequest(
+        method="POST",
+        url="http://localhost/api/process_batch",
+        params={},
+        body=json.dumps(body).encode("utf-8"),
+    )
+
+
+def b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def test_process_batch_parallel_with_bad_item(monkeypatch, tmp_path):
+    cache = function_app._TwoTierCache(str(tmp_path), memory_bytes=1024 * 1024, disk_bytes=1024 * 1024)
+    monkeypatch.setattr(function_app, "_conversion_cache", cache)
+    monkeypatch.setenv("CONVERSION_MAX_WORKERS", "2")
+    files = [
+        {"filename": "a.txt", "content_base64": b64(b"first document")},
+        {"filename": "bad.pdf", "content_base64": "**notb64**"},
+        {"filename": "b.txt", "content_base64": b64(b"second document")},
+    ]
+    resp = process_batch(make_request({"files": files}))
+    assert resp.status_code == 200, resp.get_body()
+    payload = json.loads(resp.get_body())
+    assert payload["count"] == 3
+    first, bad, second = payload["results"]
+    assert first["status"] == "ok" and "first document" in first["data"]["markdown"]
+    assert bad["status"] == "error" and "base64" in bad["error"]
+    assert second["status"] == "ok" and second["data"]["filename"] == "b.txt"
+    assert second["data"]["cache"] == "miss"
+
+    # Converted items were cached by the parent process.
+    again = json.loads(process_batch(make_request({"files": files[:1]})).get_body())
+    assert again["results"][0]["data"]["cache"] == "hit"
+
+
+def test_process_batch_requires_files():
+    resp = process_batch(make_request({"files": []}))
+    assert resp.status_code == 400
+    assert json.loads(resp.get_body())["status"] == "error"
+
+
+def test_process_batch_limit(monkeypatch):
+    monkeypatch.setenv("BATCH_MAX_FILES", "1")
+    files = [{"filename": "a.txt", "content_base64": b64(b"x")}] * 2
+    resp = process_batch(make_request({"files": files}))
+    assert resp.status_code == 413
+
+
+def test_identical_batch_items_on_the_pool_convert_once(monkeypatch):
+    monkeypatch.setenv("CONVERSION_MAX_WORKERS", "2")
+    submitted = []
+
+    class SlowPool:
+        """Process pool stand-in: records submissions, each taking long enough to overlap."""
+
+        def __init__(self):
+            self._threads = ThreadPoolExecutor(2)
+
+        def submit(self, fn, filename, data, use_llm):
+            submitted.append(filename)
+            return self._threads.submit(lambda: time.sleep(0.3) or "# converted")
+
+    monkeypatch.setattr(function_app, "_get_process_pool", SlowPool)
+    files = [{"filename": "same.html", "content_base64": b64(b"<p>same bytes</p>")}] * 2
+
+    payload = json.loads(process_batch(make_request({"files": files})).get_body())
+
+    assert submitted == ["same.html"]
+    assert [r["data"]["markdown"] for r in payload["results"]] == ["# converted"] * 2
+    assert sorted(r["data"]["cache"] for r in payload["results"]) == ["coalesced", "miss"]
@@ -0,0 +1,113 @@
+import asyncio
+import base64
+import json
+import azure.functions as func
+import function_app
+from function_app import process_file  # type: ignore
+
+DOC_V1 = """# Guide
+
+Intro paragraph.
+
+## Install
+
+Run the installer.
+
+```bash
+# not a heading
+pip install thing
+```
+
+## Usage
+
+Call the API.
+"""
+
+
+def make_request(text: str, url_suffix: str = "?format=chunks", filename: str = "guide.md"):
+    body = {"filename": filename, "content_base64": base64.b64encode(text.encode()).decode()}
+    return func.HttpRequest(
+        method="POST",
+        url=f"http://localhost/api/process_file{url_suffix}",
+        params={},
+        body=json.dumps(body).encode("utf-8"),
+    )
+
+
+def use_local_store(monkeypatch, tmp_path):
+    monkeypatch.delenv("AzureWebJobsStorage", raising=False)
+    monkeypatch.setattr(function_app, "_storage_clients", {})
+    cache = function_app._TwoTierCache(str(tmp_path), memory_bytes=1024 * 1024, disk_bytes=1024 * 1024)
+    monkeypatch.setattr(function_app, "_conversion_cache", cache)
+
+
+def chunks_of(resp) -> dict:
+    assert resp.status_code == 200, resp.get_body()
+    return json.loads(resp.get_body())["data"]
+
+
+def test_chunks_follow_headings_and_ignore_fenced_hashes(monkeypatch, tmp_path):
+    use_local_store(monkeypatch, tmp_path)
+    data = chunks_of(asyncio.run(process_file(make_request(DOC_V1))))
+
+    paths = [c["heading_path"] for c in data["chunks"]]
+    assert paths == [["Guide"], ["Guide", "Install"], ["Guide", "Usage"]]
+    assert "# not a heading" in data["chunks"][1]["markdown"]
+    assert all(c["tokens"] > 0 and len(c["id"]) == 32 for c in data["chunks"])
+    assert data["diff"]["previous"] is None
+    assert "markdown" in data  # the full document is still returned
+
+
+def test_edit_only_changes_affected_chunk_ids(monkeypatch, tmp_path):
+    use_local_store(monkeypatch, tmp_path)
+    first = chunks_of(asyncio.run(process_file(make_request(DOC_V1, "?format=chunks&chunk_key=site/guide"))))
+    edited = DOC_V1.replace("Call the API.", "Call the v2 API.")
+    second = chunks_of(asyncio.run(process_file(make_request(edited, "?format=chunks&chunk_key=site/guide"))))
+
+    assert second["diff"]["previous"] == "key:site/guide"
+    assert [c["status"] for c in second["chunks"]] == ["unchanged", "unchanged", "added"]
+    assert second["diff"]["removed"] == [first["chunks"][2]["id"]]
+    assert second["diff"]["unchanged"] == [c["id"] for c in first["chunks"][:2]]
+
+
+def test_previous_version_located_by_sha256(monkeypatch, tmp_path):
+    use_local_store(monkeypatch, tmp_path)
+    first = chunks_of(asyncio.run(process_file(make_request(DOC_V1))))
+    edited = DOC_V1 + "\n## FAQ\n\nNone yet.\n"
+    second = chunks_of(asyncio.run(process_file(make_request(edited, f"?format=chunks&previous_sha256={first['sha256']}"))))
+
+    assert second["diff"]["previous"] == f"sha256:{first['sha256']}"
+    assert len(second["diff"]["added"]) == 1
+    assert second["diff"]["removed"] == []
+
+
+def test_large_sections_respect_token_budget(monkeypatch, tmp_path):
+    use_local_store(monkeypatch, tmp_path)
+    monkeypatch.setenv("CHUNK_MAX_TOKENS", "50")
+    paragraphs = "\n\n".join(f"Paragraph {i} " + "word " * 30 for i in range(10))
+    data = chunks_of(asyncio.run(process_file(make_request(f"# Long\n\n{paragraphs}\n"))))
+
+    assert len(data["chunks"]) > 1
+    assert all(c["tokens"] <= 50 for c in data["chunks"])
+    assert all(c["heading_path"] == ["Long"] for c in data["chunks"])
+    assert len({c["id"] for c in data["chunks"]}) == len(data["chunks"])
+
+
+def test_unreachable_storage_is_not_retried_on_every_request(monkeypatch, tmp_path):
+    use_local_store(monkeypatch, tmp_path)
+    attempts = []
+
+    def unreachable():
+        attempts.append(1)
+        raise OSError("connection timed out")
+
+    monkeypatch.setattr(function_app, "_storage_connection", unreachable)
+    first = chunks_of(asyncio.run(process_file(make_request(DOC_V1, "?format=chunks&chunk_key=site/guide"))))
+    second = chunks_of(asyncio.run(process_file(make_request(DOC_V1, "?format=chunks&chunk_key=site/guide"))))
+
+    assert len(attempts) == 1  # later lookups and writes fail fast until STORAGE_RETRY_SECONDS pass
+    assert second["diff"]["unchanged"] == [c["id"] for c in first["chunks"]]
+
+    function_app._storage_clients["failed:container"] = (0.0, "expired")  # the backoff has passed
+    chunks_of(asyncio.run(process_file(make_request(DOC_V1, "?format=chunks&chunk_key=site/guide"))))
+    assert len(attempts) == 2
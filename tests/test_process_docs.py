@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import json
 import azure.functions as func
@@ -24,7 +25,7 @@ def test_process_file_success_pdf():
         },
         url_suffix="?format=json",
     )
-    resp = process_file(req)
+    resp = asyncio.run(process_file(req))
     assert resp.status_code == 200
     payload = json.loads(resp.get_body())
     assert payload["status"] == "ok"
@@ -38,7 +39,7 @@ def test_process_file_success_pdf():
 
 def test_process_file_missing_fields():
     req = make_request({"filename": "file.docx"}, url_suffix="?format=json")  # missing content_base64
-    resp = process_file(req)
+    resp = asyncio.run(process_file(req))
     assert resp.status_code == 400
     payload = json.loads(resp.get_body())
     assert payload["status"] == "error"
@@ -47,7 +48,7 @@ def test_process_file_missing_fields():
 
 def test_process_file_bad_base64():
     req = make_request({"filename": "bad.pptx", "content_base64": "**notb64**"}, url_suffix="?format=json")
-    resp = process_file(req)
+    resp = asyncio.run(process_file(req))
     assert resp.status_code == 400
     payload = json.loads(resp.get_body())
     assert payload["status"] == "error"
@@ -58,7 +59,7 @@ def test_process_file_default_markdown_output():
     content = b"Hello world in a txt-like file"  # unknown extension fallback
     b64 = base64.b64encode(content).decode()
     req = make_request({"filename": "notes.bin", "content_base64": b64})  # no format param -> markdown
-    resp = process_file(req)
+    resp = asyncio.run(process_file(req))
     assert resp.status_code == 200
     body = resp.get_body().decode()
     # Should contain HTML comment header with filename
@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import json
 import azure.functions as func
@@ -32,7 +33,7 @@ def test_process_image_unit_1x1_png_json():
         url_suffix="?format=json",
     )
 
-    resp = process_file(req)
+    resp = asyncio.run(process_file(req))
     assert resp.status_code == 200, resp.get_body()
     payload = json.loads(resp.get_body())
     assert payload["status"] == "ok"
@@ -0,0 +1,71 @@
+import asyncio
+import base64
+import json
+import azure.functions as func
+import pytest
+import function_app
+from function_app import process_file  # type: ignore
+
+
+def make_request(body: dict, url_suffix: str = "?format=ndjson"):
+    return func.HttpRequest(
+        method="POST",
+        url=f"http://localhost/api/process_file{url_suffix}",
+        params={},
+        body=json.dumps(body).encode("utf-8"),
+    )
+
+
+def read_records(resp) -> list[dict]:
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/x-ndjson"
+    return [json.loads(line) for line in resp.get_body().decode().splitlines()]
+
+
+def test_pdf_emits_one_record_per_page(make_pdf):
+    pdf = make_pdf(["Alpha page", "Bravo page", "Charlie page"])
+    resp = asyncio.run(process_file(make_request({"filename": "deck.pdf", "content_base64": base64.b64encode(pdf).decode()})))
+    records = read_records(resp)
+
+    assert records[0]["type"] == "document"
+    assert records[0]["filename"] == "deck.pdf"
+    pages = [r for r in records if r["type"] == "page"]
+    assert [p["page"] for p in pages] == [1, 2, 3]
+    assert "Bravo page" in pages[1]["markdown"]
+    assert records[-1] == {"type": "end", "pages": 3}
+
+
+def test_pdf_page_range_skips_other_pages(make_pdf):
+    pdf = make_pdf(["One", "Two", "Three", "Four"])
+    resp = asyncio.run(process_file(
+        make_request(
+            {"filename": "deck.pdf", "content_base64": base64.b64encode(pdf).decode()},
+            url_suffix="?format=ndjson&pages=2,4-",
+        )
+    ))
+    pages = [r for r in read_records(resp) if r["type"] == "page"]
+    assert [p["page"] for p in pages] == [2, 4]
+    assert "Four" in pages[1]["markdown"]
+
+
+def test_non_paged_document_is_a_single_record():
+    body = {"filename": "notes.txt", "content_base64": base64.b64encode(b"plain notes").decode()}
+    pages = [r for r in read_records(asyncio.run(process_file(make_request(body)))) if r["type"] == "page"]
+    assert len(pages) == 1
+    assert "plain notes" in pages[0]["markdown"]
+
+
+def test_invalid_page_range_is_rejected():
+    body = {"filename": "notes.txt", "content_base64": base64.b64encode(b"x").decode()}
+    resp = asyncio.run(process_file(make_request(body, url_suffix="?format=ndjson&pages=5-2")))
+    assert resp.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "spec,included,excluded",
+    [("1-3,5", [1, 2, 3, 5], [4, 6]), ("7-", [7, 100], [6]), (None, [1, 42], [])],
+)
+def test_parse_page_ranges(spec, included, excluded):
+    wanted = function_app._parse_page_ranges(spec)
+    assert all(wanted(p) for p in included)
+    assert not any(wanted(p) for p in excluded)
@@ -0,0 +1,60 @@
+import asyncio
+import hashlib
+import json
+import azure.functions as func
+from function_app import process_file  # type: ignore
+
+
+def test_process_file_raw_octet_stream():
+    content = b"Raw upload without base64"
+    req = func.HttpRequest(
+        method="POST",
+        url="http://localhost/api/process_file?format=json",
+        headers={"Content-Type": "application/octet-stream", "X-Filename": "raw%20notes.txt"},
+        params={},
+        body=content,
+    )
+    resp = asyncio.run(process_file(req))
+    assert resp.status_code == 200, resp.get_body()
+    data = json.loads(resp.get_body())["data"]
+    assert data["filename"] == "raw notes.txt"
+    assert data["size_bytes"] == len(content)
+    assert data["sha256"] == hashlib.sha256(content).hexdigest()
+    assert "Raw upload" in data["markdown"]
+
+
+def test_process_file_raw_requires_filename():
+    req = func.HttpRequest(
+        method="POST",
+        url="http://localhost/api/process_file?format=json",
+        headers={"Content-Type": "application/octet-stream"},
+        params={},
+        body=b"data",
+    )
+    resp = asyncio.run(process_file(req))
+    assert resp.status_code == 400
+    assert "filename" in json.loads(resp.get_body())["error"].lower()
+
+
+def test_process_file_multipart():
+    content = b"%PDF-1.4 example minimal"
+    boundary = "testboundary"
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="sample.pdf"\r\n'
+        "Content-Type: application/pdf\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    req = func.HttpRequest(
+        method="POST",
+        url="http://localhost/api/process_file?format=json",
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+        params={},
+        body=body,
+    )
+    resp = asyncio.run(process_file(req))
+    assert resp.status_code == 200, resp.get_body()
+    data = json.loads(resp.get_body())["data"]
+    assert data["filename"] == "sample.pdf"
+    assert data["content_type"] == "application/pdf"
+    assert data["size_bytes"] == len(content)
+    assert data["sha256"] == hashlib.sha256(content).hexdigest()
@@ -0,0 +1,85 @@
+import asyncio
+import base64
+import json
+import azure.functions as func
+import function_app
+from function_app import process_file, search  # type: ignore
+
+
+def make_index(tmp_path, **kw):
+    return function_app._SearchIndex(str(tmp_path), **{"flush_docs": 1000, **kw})
+
+
+def keys(results):
+    return [r["key"] for r in results]
+
+
+def test_bm25_ranks_and_highlights(tmp_path):
+    index = make_index(tmp_path)
+    index.add("a", "sha-a", "Deployment slots let you swap staging and production. Slots are great.", "a.md")
+    index.add("b", "sha-b", "Queues decouple producers from consumers. Slots are mentioned once.", "b.md")
+    index.add("c", "sha-c", "Nothing relevant here.", "c.md")
+
+    total, results = index.search("deployment slots")
+    assert total == 2
+    assert keys(results)[0] == "a"
+    assert "**Deployment**" in results[0]["snippet"] and "**slots**" in results[0]["snippet"]
+    assert "c" not in keys(results)
+
+
+def test_unchanged_sha_is_skipped_and_new_version_replaces_old(tmp_path):
+    index = make_index(tmp_path)
+    assert index.add("doc", "v1", "the legacy gateway", "doc.md") == "indexed"
+    assert index.add("doc", "v1", "the legacy gateway", "doc.md") == "unchanged"
+    index.flush()
+    assert index.add("doc", "v2", "the modern gateway", "doc.md") == "indexed"
+
+    assert index.search("legacy") == (0, [])
+    total, results = index.search("gateway")
+    assert total == 1 and results[0]["sha256"] == "v2"
+
+
+def test_segments_merge_and_are_shared_between_instances(tmp_path):
+    index = make_index(tmp_path, max_segments=2)
+    for i in range(6):
+        index.add(f"doc{i}", f"sha{i}", f"document number {i} about topic{i % 2}", f"{i}.md")
+        index.flush()
+    index.add("doc0", "sha0-b", "document zero rewritten about topic1", "0.md")  # pending only
+
+    assert len(index._manifest["segments"]) <= 2
+    other = make_index(tmp_path)  # e.g. another worker process on the same directory
+    total, results = other.search("topic1", top=10)
+    assert total == 4
+    assert set(keys(results)) == {"doc0", "doc1", "doc3", "doc5"}
+    assert other.search("topic0")[0] == 2
+
+
+def process_request(text: str, filename: str = "notes.md"):
+    body = {"filename": filename, "content_base64": base64.b64encode(text.encode()).decode(), "item_id": "item-1"}
+    return func.HttpRequest(method="POST", url="http://localhost/api/process_file", params={},
+                            body=json.dumps(body).encode())
+
+
+def search_request(query: str):
+    return func.HttpRequest(method="GET", url=f"http://localhost/api/search?q={query}", params={"q": query}, body=b"")
+
+
+def test_process_file_feeds_search_endpoint(monkeypatch, tmp_path):
+    monkeypatch.setenv("SEARCH_INDEX_ENABLED", "true")
+    monkeypatch.setattr(function_app, "_search_index_instance", make_index(tmp_path))
+
+    asyncio.run(process_file(process_request("# Runbook\n\nRestart the ingestion worker when the queue backs up.")))
+    resp = search(search_request("ingestion"))
+
+    assert resp.status_code == 200
+    payload = json.loads(resp.get_body())
+    assert payload["total"] == 1
+    assert payload["results"][0]["key"] == "item-1"
+    assert payload["results"][0]["title"] == "notes.md"
+    assert "Server-Timing" in resp.headers
+
+
+def test_search_disabled_returns_503(monkeypatch):
+    monkeypatch.delenv("SEARCH_INDEX_ENABLED", raising=False)
+    monkeypatch.setattr(function_app, "_search_index_instance", None)
+    assert search(search_request("anything")).status_code == 503
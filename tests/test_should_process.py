@@ -0,0 +1,71 @@
+import asyncio
+import json
+import os
+import azure.functions as func
+from azure.core.exceptions import ResourceNotFoundError
+import function_app
+from function_app import should_process, write_to_repo  # type: ignore
+
+
+class FakeTable:
+    def __init__(self):
+        self.rows = {}
+
+    def get_entity(self, partition_key, row_key):
+        if (partition_key, row_key) not in self.rows:
+            raise ResourceNotFoundError("missing")
+        return self.rows[(partition_key, row_key)]
+
+    def upsert_entity(self, entity):
+        self.rows[(entity["PartitionKey"], entity["RowKey"])] = dict(entity)
+
+
+def make_req(url: str, body: dict):
+    return func.HttpRequest(method="POST", url=url, params={}, body=json.dumps(body).encode("utf-8"))
+
+
+def ask(item_id, etag):
+    resp = should_process(make_req("http://localhost/api/should_process", {"item_id": item_id, "etag": etag}))
+    assert resp.status_code == 200
+    return json.loads(resp.get_body())
+
+
+def test_should_process_tracks_writes(monkeypatch):
+    table = FakeTable()
+    monkeypatch.setattr(function_app, "_manifest_table", lambda: table)
+    assert ask("42", '"v1"')["reason"] == "new"
+
+    async def fake_write(repo, branch, path, content, message, headers):
+        return {"status": "ok", "action": "created", "repo": repo, "branch": branch, "path": path,
+                "commit_sha": "abc123"}
+
+    monkeypatch.setattr(function_app, "_write_file", fake_write)
+    os.environ["GITHUB_TOKEN"] = "testtoken"
+    resp = asyncio.run(write_to_repo(make_req("http://localhost/api/write_to_repo", {
+        "repo": "owner/repo", "path": "docs/42.md", "content": "# Doc", "item_id": "42", "source_etag": '"v1"',
+    })))
+    assert resp.status_code == 200
+
+    unchanged = ask("42", '"v1"')
+    assert unchanged["process"] is False and unchanged["reason"] == "unchanged"
+    assert unchanged["record"]["output_path"] == "docs/42.md"
+    assert ask("42", '"v2"')["reason"] == "etag_changed"
+
+
+def test_should_process_reprocesses_after_converter_upgrade(monkeypatch):
+    record = {"source_etag": '"v1"', "converter_version": "0.0.1"}
+    assert function_app._manifest_decision(record, '"v1"', None) == (True, "converter_changed")
+
+
+def test_should_process_fails_open_without_storage(monkeypatch):
+    def broken():
+        raise RuntimeError("AzureWebJobsStorage is not configured")
+
+    monkeypatch.setattr(function_app, "_manifest_table", broken)
+    payload = ask("7", '"v1"')
+    assert payload["process"] is True and payload["reason"] == "manifest_unavailable"
+
+
+def test_should_process_requires_item_id():
+    resp = should_process(make_req("http://localhost/api/should_process", {"etag": "x"}))
+    assert resp.status_code == 400
@@ -0,0 +1,182 @@
+import base64
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
+import function_app
+
+PAGE = b"<html><body><h1>Release notes</h1><p>Same bytes, many events.</p></body></html>"
+
+
+@pytest.fixture
+def slow_converter(monkeypatch):
+    """Count MarkItDown runs; each one takes long enough for callers to overlap."""
+    monkeypatch.setattr(function_app, "_conversion_cache", function_app._TwoTierCache(None, 0, 0))
+    calls = []
+
+    def convert(stream, filename, use_llm):
+        calls.append(filename)
+        time.sleep(0.3)
+        return f"# converted {len(calls)}"
+
+    monkeypatch.setattr(function_app, "_convert_stream", convert)
+    return calls
+
+
+def make_upload(data: bytes = PAGE):
+    payload = {"filename": "notes.html", "content_base64": base64.b64encode(data).decode()}
+    upload, error = function_app._upload_from_payload(payload)
+    assert error is None
+    return upload
+
+
+def convert_concurrently(count: int):
+    results = [None] * count
+
+    def run(index):
+        results[index] = function_app._convert_upload(make_upload())
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def test_concurrent_identical_uploads_convert_once(slow_converter):
+    results = convert_concurrently(5)
+
+    assert slow_converter == ["notes.html"]
+    assert {markdown for markdown, _status in results} == {"# converted 1"}
+    assert sorted(status for _markdown, status in results) == ["bypass"] + ["coalesced"] * 4
+
+
+def test_leader_failure_is_shared_but_not_remembered(monkeypatch, slow_converter):
+    def broken(stream, filename, use_llm):
+        slow_converter.append(filename)
+        time.sleep(0.3)
+        raise ValueError("corrupt")
+
+    monkeypatch.setattr(function_app, "_convert_stream", broken)
+    results = convert_concurrently(3)
+    assert len(slow_converter) == 1
+    assert {markdown for markdown, _status in results} == {"(extraction_failed: ValueError)"}
+
+    function_app._convert_upload(make_upload())
+    assert len(slow_converter) == 2  # failures are retried, not coalesced after the fact
+
+
+def test_disabled_singleflight_converts_every_time(monkeypatch, slow_converter):
+    monkeypatch.setenv("SINGLEFLIGHT_ENABLED", "false")
+    convert_concurrently(3)
+    assert len(slow_converter) == 3
+
+
+class FakeLease:
+    def __init__(self, blob):
+        self.blob = blob
+
+    def renew(self):
+        pass
+
+    def release(self):
+        self.blob.leased = False
+
+
+class FakeBlob:
+    """Blob with just enough lease semantics for the single-flight protocol."""
+
+    def __init__(self):
+        self.exists = False
+        self.leased = False
+        self.metadata = {}
+        self.data = b""
+
+    def get_blob_properties(self):
+        if not self.exists:
+            raise ResourceNotFoundError("missing")
+        return SimpleNamespace(metadata=dict(self.metadata),
+                               lease=SimpleNamespace(state="leased" if self.leased else "available"))
+
+    def upload_blob(self, data, overwrite=False, metadata=None, lease=None):
+        if self.exists and not overwrite:
+            raise ResourceExistsError("exists")
+        assert not self.leased or lease is not None
+        self.exists, self.data, self.metadata = True, data, metadata or {}
+        self.etag = f"v{len(data)}-{time.monotonic()}"
+        return {"etag": self.etag}
+
+    def delete_blob(self, etag=None, match_condition=None):
+        if self.leased or (etag is not None and etag != self.etag):
+            raise HttpResponseError("Precondition failed")
+        self.exists, self.data, self.metadata = False, b"", {}
+
+    def acquire_lease(self, lease_duration):
+        if self.leased:
+            error = HttpResponseError("There is already a lease present.")
+            error.status_code = 409
+            raise error
+        self.leased = True
+        return FakeLease(self)
+
+    def download_blob(self):
+        return SimpleNamespace(readall=lambda: self.data)
+
+
+@pytest.fixture
+def shared_blob(monkeypatch):
+    blob = FakeBlob()
+    monkeypatch.setenv("SINGLEFLIGHT_LEASE_ENABLED", "true")
+    monkeypatch.setattr(function_app, "_LEASE_POLL_SECONDS", 0.05)
+    monkeypatch.setattr(function_app, "_blob_container", lambda: SimpleNamespace(get_blob_client=lambda name: blob))
+    return blob
+
+
+def test_leader_publishes_result_and_releases_lease(shared_blob, slow_converter):
+    markdown, status = function_app._convert_upload(make_upload())
+
+    assert (markdown, status) == ("# converted 1", "bypass")
+    assert shared_blob.metadata == {"state": "done"} and shared_blob.data == b"# converted 1"
+    assert not shared_blob.leased
+
+
+def test_published_result_is_deleted_after_its_ttl(monkeypatch, shared_blob, slow_converter):
+    monkeypatch.setenv("SINGLEFLIGHT_RESULT_TTL_SECONDS", "0")
+    function_app._convert_upload(make_upload())
+    time.sleep(0.2)
+    assert not shared_blob.exists
+
+    # A result rewritten by a newer flight is left alone.
+    shared_blob.upload_blob(b"# newer", overwrite=True, metadata={"state": "done"})
+    function_app._expire_published_conversion(shared_blob, "stale-etag")
+    time.sleep(0.2)
+    assert shared_blob.exists and shared_blob.data == b"# newer"
+
+
+def test_other_instance_waits_for_lease_holder(shared_blob, slow_converter):
+    shared_blob.exists, shared_blob.leased = True, True  # another instance is converting
+
+    def finish_elsewhere():
+        time.sleep(0.3)
+        shared_blob.data, shared_blob.metadata = b"# from instance B", {"state": "done"}
+        shared_blob.leased = False
+
+    threading.Thread(target=finish_elsewhere).start()
+    markdown, status = function_app._convert_upload(make_upload())
+
+    assert (markdown, status) == ("# from instance B", "coalesced")
+    assert slow_converter == []
+
+
+def test_lease_wait_is_bounded_and_storage_errors_fall_back(monkeypatch, shared_blob, slow_converter):
+    monkeypatch.setenv("SINGLEFLIGHT_WAIT_SECONDS", "0")
+    shared_blob.exists, shared_blob.leased = True, True  # holder never finishes
+    assert function_app._convert_upload(make_upload())[0] == "# converted 1"
+
+    def unavailable():
+        raise RuntimeError("no storage configured")
+
+    monkeypatch.setattr(function_app, "_blob_container", unavailable)
+    assert function_app._convert_upload(make_upload())[0] == "# converted 2"
@@ -0,0 +1,94 @@
+import asyncio
+import base64
+import contextlib
+import json
+import azure.functions as func
+import function_app
+from function_app import process_file, write_to_repo  # type: ignore
+
+
+def make_request(route: str, body: dict, url_suffix: str = ""):
+    return func.HttpRequest(
+        method="POST",
+        url=f"http://localhost/api/{route}{url_suffix}",
+        params={},
+        body=json.dumps(body).encode("utf-8"),
+    )
+
+
+def server_timing_names(resp) -> set[str]:
+    return {entry.split(";")[0].strip() for entry in resp.headers["Server-Timing"].split(",")}
+
+
+def test_process_file_reports_stage_timings(monkeypatch):
+    monkeypatch.setattr(function_app, "_conversion_cache", function_app._TwoTierCache(None, 0, 0))
+    body = {"filename": "notes.html", "content_base64": base64.b64encode(b"<p>timed body</p>").decode()}
+
+    resp = asyncio.run(process_file(make_request("process_file", body, "?format=json")))
+
+    timings = json.loads(resp.get_body())["timings"]
+    assert {"parse", "decode", "hash", "convert", "converter"} <= set(timings)
+    assert all(isinstance(v, float) for v in timings.values())
+    assert {"total", "parse", "convert", "serialize"} <= server_timing_names(resp)
+
+
+def test_markdown_mode_still_gets_server_timing():
+    body = {"filename": "notes.txt", "content_base64": base64.b64encode(b"plain").decode()}
+    resp = asyncio.run(process_file(make_request("process_file", body)))
+    assert "total" in server_timing_names(resp)
+    assert not resp.get_body().startswith(b"{")
+
+
+class DummyResp:
+    def __init__(self, status_code: int, json_obj=None):
+        self.status_code = status_code
+        self._json = json_obj or {}
+        self.text = json.dumps(self._json)
+        self.headers = {}
+
+    def json(self):
+        return self._json
+
+
+class FakeSession:
+    async def request(self, method, url, **kw):
+        if method == "GET":
+            return DummyResp(404)
+        return DummyResp(201, {"content": {"html_url": "https://github.com/o/r/blob/main/a.md"},
+                               "commit": {"sha": "abc"}})
+
+
+def test_write_to_repo_separates_github_get_and_put(monkeypatch):
+    monkeypatch.setenv("GITHUB_TOKEN", "testtoken")
+    monkeypatch.setattr(function_app, "_github_session", lambda: FakeSession())
+    function_app._branch_snapshots.clear()
+
+    resp = asyncio.run(write_to_repo(make_request("write_to_repo", {"repo": "o/r", "path": "a.md", "content": "x"})))
+
+    payload = json.loads(resp.get_body())
+    assert {"github_get", "github_put"} <= set(payload["timings"])
+    assert {"github_get", "github_put", "total"} <= server_timing_names(resp)
+
+
+def test_stages_become_spans_when_tracing_enabled(monkeypatch):
+    spans = []
+
+    class FakeTracer:
+        @contextlib.contextmanager
+        def start_as_current_span(self, name, attributes=None):
+            spans.append(name)
+            yield
+
+    monkeypatch.setattr(function_app, "_tracer", FakeTracer())
+    monkeypatch.setattr(function_app, "_tracer_resolved", True)
+    body = {"filename": "notes.txt", "content_base64": base64.b64encode(b"traced").decode()}
+    asyncio.run(process_file(make_request("process_file", body, "?format=json")))
+
+    assert spans[0] == "total"
+    assert {"parse", "decode", "hash"} <= set(spans)
+
+
+def test_stage_outside_request_is_a_no_op():
+    with function_app._stage("anything"):
+        pass
+    assert function_app._request_timings() is None
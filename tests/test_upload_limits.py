@@ -0,0 +1,121 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import threading
+import azure.functions as func
+import function_app
+from function_app import process_batch, process_file  # type: ignore
+
+MB = 1024 * 1024
+
+
+def json_request(route: str, body: dict, url_suffix: str = "?format=json"):
+    return func.HttpRequest(method="POST", url=f"http://localhost/api/{route}{url_suffix}", params={},
+                            body=json.dumps(body).encode("utf-8"))
+
+
+def text_payload(size: int, filename: str = "big.txt") -> tuple[bytes, dict]:
+    data = (b"spooled line of text\n" * (size // 21 + 1))[:size]
+    return data, {"filename": filename, "content_base64": base64.b64encode(data).decode()}
+
+
+def test_oversized_upload_is_rejected_before_decoding(monkeypatch):
+    monkeypatch.setenv("UPLOAD_MAX_MB", "1")
+    _data, body = text_payload(MB + 10)
+    decoded = []
+    monkeypatch.setattr(function_app, "_spool_base64", lambda *a: decoded.append(a))
+
+    resp = asyncio.run(process_file(json_request("process_file", body)))
+
+    assert resp.status_code == 413
+    assert "too large" in json.loads(resp.get_body())["error"]
+    assert decoded == []
+
+
+def test_large_base64_upload_is_spooled_to_disk(monkeypatch):
+    monkeypatch.setenv("UPLOAD_SPOOL_MB", "1")
+    data, body = text_payload(3 * MB // 2)
+
+    upload, error = function_app._upload_from_payload(body)
+
+    assert error is None and upload._data is None
+    path = upload.path
+    assert path and os.path.getsize(path) == len(data)
+    assert upload.sha256 == hashlib.sha256(data).hexdigest() and upload.size == len(data)
+    assert upload.read_bytes() == data
+    upload.close()
+    assert not os.path.exists(path)
+
+
+def test_spooled_upload_converts_like_in_memory(monkeypatch):
+    monkeypatch.setattr(function_app, "_conversion_cache", function_app._TwoTierCache(None, 0, 0))
+    _data, body = text_payload(3 * MB // 2)
+    expected = json.loads(asyncio.run(process_file(json_request("process_file", body))).get_body())["data"]
+
+    monkeypatch.setenv("UPLOAD_SPOOL_MB", "1")
+    spooled = json.loads(asyncio.run(process_file(json_request("process_file", body))).get_body())["data"]
+
+    assert spooled["markdown"] == expected["markdown"]
+    assert spooled["sha256"] == expected["sha256"]
+
+
+def test_invalid_base64_still_reported_when_spooling(monkeypatch):
+    monkeypatch.setenv("UPLOAD_SPOOL_MB", "0")
+    upload, error = function_app._upload_from_payload({"filename": "a.txt", "content_base64": "@@@@"})
+    assert upload is None and error == "content_base64 is not valid base64"
+
+
+def test_memory_budget_queues_then_admits():
+    budget = function_app._MemoryBudget(100)
+    admitted = []
+    with budget.reserve(80, timeout=1) as first:
+        assert first
+
+        def second():
+            with budget.reserve(50, timeout=5) as ok:
+                admitted.append((ok, budget.in_use))
+
+        worker = threading.Thread(target=second)
+        worker.start()
+        worker.join(0.1)
+        assert admitted == []  # waiting for the first reservation
+    worker.join(5)
+    assert admitted == [(True, 50)]
+    assert budget.in_use == 0
+
+
+def test_memory_budget_caps_oversized_cost_and_times_out():
+    budget = function_app._MemoryBudget(100)
+    with budget.reserve(10_000, timeout=0) as ok:
+        assert ok and budget.in_use == 100
+        with budget.reserve(1, timeout=0) as other:
+            assert not other
+    assert budget.in_use == 0
+
+
+def test_process_file_returns_429_when_budget_exhausted(monkeypatch):
+    monkeypatch.setenv("CONVERSION_QUEUE_SECONDS", "0")
+    monkeypatch.setattr(function_app, "_conversion_cache", function_app._TwoTierCache(None, 0, 0))
+    budget = function_app._MemoryBudget(MB)
+    monkeypatch.setattr(function_app, "_memory_budget", budget)
+    _data, body = text_payload(1000, "page.html")  # not on the text fast path
+
+    with budget.reserve(MB, timeout=0):
+        busy = asyncio.run(process_file(json_request("process_file", body)))
+        batch = process_batch(json_request("process_batch", {"files": [body]}, ""))
+    assert busy.status_code == 429 and busy.headers["Retry-After"] == "1"
+    assert batch.status_code == 429
+    assert asyncio.run(process_file(json_request("process_file", body))).status_code == 200
+
+
+def test_batch_reports_oversized_items_individually(monkeypatch):
+    monkeypatch.setenv("UPLOAD_MAX_MB", "1")
+    _big, big = text_payload(MB + 10, "big.txt")
+    _small, small = text_payload(100, "small.txt")
+
+    payload = json.loads(process_batch(json_request("process_batch", {"files": [big, small]}, "")).get_body())
+
+    assert payload["results"][0]["status"] == "error" and "too large" in payload["results"][0]["error"]
+    assert payload["results"][1]["status"] == "ok"
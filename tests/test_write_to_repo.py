@@ -1,14 +1,17 @@
+import asyncio
 import json
 import azure.functions as func
 import os
+import function_app
 from function_app import write_to_repo  # type: ignore
 
 
 class DummyResp:
-    def __init__(self, status_code: int, json_obj=None, text: str = ""):
+    def __init__(self, status_code: int, json_obj=None, text: str = "", headers=None):
         self.status_code = status_code
         self._json = json_obj or {}
         self.text = text or json.dumps(self._json)
+        self.headers = headers or {}
 
     def json(self):  # noqa: D401 - simple
         return self._json
@@ -23,17 +26,27 @@ def make_req(body: dict):
     )
 
 
-def patch_requests(monkeypatch, get_resp, put_resp):
-    import requests  # type: ignore
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+
+    async def request(self, method, url, **kw):  # noqa: D401
+        self.calls.append((method, url))
+        resp = self.responses[method]
+        return resp.pop(0) if isinstance(resp, list) else resp
 
-    def fake_get(*a, **kw):  # noqa: D401
-        return get_resp
 
-    def fake_put(*a, **kw):  # noqa: D401
-        return put_resp
+async def no_sleep(seconds):
+    pass
 
-    monkeypatch.setattr(requests, "get", fake_get)
-    monkeypatch.setattr(requests, "put", fake_put)
+
+def patch_requests(monkeypatch, get_resp, put_resp):
+    session = FakeSession({"GET": get_resp, "PUT": put_resp})
+    monkeypatch.setattr(function_app, "_github_session", lambda: session)
+    monkeypatch.setattr(function_app.asyncio, "sleep", no_sleep)
+    function_app._branch_snapshots.clear()
+    return session
 
 
 def test_write_to_repo_create(monkeypatch):
@@ -50,7 +63,7 @@ def test_write_to_repo_create(monkeypatch):
         "path": "docs/file.md",
         "content": "# Title\nBody",
     })
-    resp = write_to_repo(req)
+    resp = asyncio.run(write_to_repo(req))
     assert resp.status_code == 200
     payload = json.loads(resp.get_body())
     assert payload["status"] == "ok"
@@ -72,7 +85,7 @@ def test_write_to_repo_update(monkeypatch):
         "content": "Updated content",
         "commit_message": "Update docs/file.md",
     })
-    resp = write_to_repo(req)
+    resp = asyncio.run(write_to_repo(req))
     assert resp.status_code == 200
     payload = json.loads(resp.get_body())
     assert payload["action"] == "updated"
@@ -81,7 +94,7 @@ def test_write_to_repo_update(monkeypatch):
 
 def test_write_to_repo_missing_fields():
     req = make_req({"repo": "owner/repo"})  # missing path & content
-    resp = write_to_repo(req)
+    resp = asyncio.run(write_to_repo(req))
     assert resp.status_code == 400
     body = json.loads(resp.get_body())
     assert body["status"] == "error"
@@ -97,8 +110,41 @@ def test_write_to_repo_no_token(monkeypatch):
         "path": "docs/file.md",
         "content": "Anything",
     })
-    resp = write_to_repo(req)
+    resp = asyncio.run(write_to_repo(req))
     assert resp.status_code == 500
     payload = json.loads(resp.get_body())
     assert payload["status"] == "error"
     assert "GITHUB_TOKEN" in payload["error"]
+
+
+def test_write_to_repo_retries_transient_errors_and_reports_quota(monkeypatch):
+    os.environ["GITHUB_TOKEN"] = "testtoken"
+    quota = {"X-RateLimit-Limit": "5000", "X-RateLimit-Remaining": "4321", "X-RateLimit-Reset": "1700000000"}
+    session = patch_requests(
+        monkeypatch,
+        DummyResp(404, {}),
+        [
+            DummyResp(502, text="Bad Gateway"),
+            DummyResp(403, text="You have exceeded a secondary rate limit", headers={"Retry-After": "1"}),
+            DummyResp(201, {"commit": {"sha": "abc123"}}, headers=quota),
+        ],
+    )
+    resp = asyncio.run(write_to_repo(make_req({"repo": "owner/repo", "path": "docs/file.md", "content": "x"})))
+    assert resp.status_code == 200, resp.get_body()
+    payload = json.loads(resp.get_body())
+    assert payload["commit_sha"] == "abc123"
+    assert payload["rate_limit"]["remaining"] == 4321
+    assert [m for m, _ in session.calls].count("PUT") == 3
+
+
+def test_write_to_repo_gives_up_on_long_rate_limit_reset(monkeypatch):
+    os.environ["GITHUB_TOKEN"] = "testtoken"
+    monkeypatch.setenv("GITHUB_MAX_RETRY_WAIT_SECONDS", "5")
+    limited = DummyResp(403, text="API rate limit exceeded", headers={
+        "X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(function_app.time.time()) + 3600),
+    })
+    session = patch_requests(monkeypatch, DummyResp(404, {}), [limited])
+    resp = asyncio.run(write_to_repo(make_req({"repo": "owner/repo", "path": "docs/file.md", "content": "x"})))
+    assert resp.status_code == 502
+    assert json.loads(resp.get_body())["rate_limit"]["remaining"] == 0
+    assert [m for m, _ in session.calls].count("PUT") == 1
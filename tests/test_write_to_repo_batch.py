@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+import json
+import os
+import azure.functions as func
+import function_app
+from function_app import write_to_repo  # type: ignore
+
+
+class DummyResp:
+    def __init__(self, status_code: int, json_obj=None):
+        self.status_code = status_code
+        self._json = json_obj or {}
+        self.text = json.dumps(self._json)
+        self.headers = {}
+
+    def json(self):
+        return self._json
+
+
+def blob_sha(text: str) -> str:
+    data = text.encode("utf-8")
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class FakeGitData:
+    """Minimal in-memory stand-in for the Git Data API endpoints used in batch mode."""
+
+    def __init__(self, existing: dict, reject_first_ref_update: bool = False):
+        self.head = "c0"
+        self.trees = {"t0": [{"path": p, "mode": "100644", "type": "blob", "sha": blob_sha(c)}
+                             for p, c in existing.items()]}
+        self.commits = {"c0": "t0"}
+        self.reject_first_ref_update = reject_first_ref_update
+        self.calls = []
+
+    def get(self, url, **kw):
+        self.calls.append(("GET", url))
+        if "/git/ref/heads/" in url:
+            return DummyResp(200, {"object": {"sha": self.head}})
+        if "/git/commits/" in url:
+            return DummyResp(200, {"tree": {"sha": self.commits[url.rsplit("/", 1)[1]]}})
+        if "/git/trees/" in url:
+            return DummyResp(200, {"tree": self.trees[url.rsplit("/", 1)[1]], "truncated": False})
+        return DummyResp(404)
+
+    def post(self, url, json=None, **kw):
+        self.calls.append(("POST", url))
+        if url.endswith("/git/trees"):
+            sha = f"t{len(self.trees)}"
+            self.trees[sha] = json["tree"]
+            return DummyResp(201, {"sha": sha})
+        if url.endswith("/git/commits"):
+            sha = f"c{len(self.commits)}"
+            self.commits[sha] = json["tree"]
+            return DummyResp(201, {"sha": sha, "html_url": f"https://github.com/o/r/commit/{sha}"})
+        return DummyResp(404)
+
+    def patch(self, url, json=None, **kw):
+        self.calls.append(("PATCH", url))
+        if self.reject_first_ref_update:
+            self.reject_first_ref_update = False
+            self.head = "c_other"
+            self.commits["c_other"] = "t0"
+            return DummyResp(422, {"message": "Update is not a fast forward"})
+        self.head = json["sha"]
+        return DummyResp(200, {"object": {"sha": json["sha"]}})
+
+
+class FakeSession:
+    def __init__(self, fake):
+        self.fake = fake
+
+    async def request(self, method, url, **kw):
+        return getattr(self.fake, method.lower())(url, **kw)
+
+
+def install(monkeypatch, fake):
+    monkeypatch.setattr(function_app, "_github_session", lambda: FakeSession(fake))
+    function_app._branch_snapshots.clear()
+    os.environ["GITHUB_TOKEN"] = "testtoken"
+
+
+def make_req(body: dict):
+    return func.HttpRequest(
+        method="POST",
+        url="http://localhost/api/write_to_repo",
+        params={},
+        body=json.dumps(body).encode("utf-8"),
+    )
+
+
+def test_batch_single_commit_with_per_path_status(monkeypatch):
+    fake = FakeGitData({"docs/same.md": "same", "docs/old.md": "old"})
+    install(monkeypatch, fake)
+    resp = asyncio.run(write_to_repo(make_req({
+        "repo": "owner/repo",
+        "files": [
+            {"path": "docs/same.md", "content": "same"},
+            {"path": "docs/old.md", "content": "new"},
+            {"path": "docs/added.md", "content": "added"},
+        ],
+    })))
+    assert resp.status_code == 200, resp.get_body()
+    payload = json.loads(resp.get_body())
+    assert payload["action"] == "committed"
+    assert {f["path"]: f["action"] for f in payload["files"]} == {
+        "docs/same.md": "unchanged",
+        "docs/old.md": "updated",
+        "docs/added.md": "created",
+    }
+    assert [c for c in fake.calls if c[0] == "PATCH"] and payload["commit_sha"] == fake.head
+    assert len(fake.trees[fake.commits[fake.head]]) == 2  # unchanged file not re-sent
+
+
+def test_batch_retries_when_branch_moves(monkeypatch):
+    fake = FakeGitData({}, reject_first_ref_update=True)
+    install(monkeypatch, fake)
+    resp = asyncio.run(write_to_repo(make_req({"repo": "owner/repo", "files": [{"path": "a.md", "content": "x"}]})))
+    payload = json.loads(resp.get_body())
+    assert payload["status"] == "ok"
+    assert payload["attempts"] == 2
+    assert payload["commit_sha"] == fake.head
+
+
+def test_batch_all_unchanged_skips_commit(monkeypatch):
+    fake = FakeGitData({"a.md": "x"})
+    install(monkeypatch, fake)
+    resp = asyncio.run(write_to_repo(make_req({"repo": "owner/repo", "files": [{"path": "a.md", "content": "x"}]})))
+    payload = json.loads(resp.get_body())
+    assert payload["action"] == "unchanged"
+    assert not [c for c in fake.calls if c[0] in ("POST", "PATCH")]
+
+
+def test_batch_rejects_parent_segments(monkeypatch):
+    install(monkeypatch, FakeGitData({}))
+    resp = asyncio.run(write_to_repo(make_req({"repo": "owner/repo", "files": [{"path": "../x.md", "content": "x"}]})))
+    assert resp.status_code == 400
+
+
+def test_truncated_tree_checks_missing_paths_individually(monkeypatch):
+    fake = FakeGitData({"docs/listed.md": "old"})
+    install(monkeypatch, fake)
+    hidden = {"docs/hidden.md": blob_sha("same"), "docs/hidden-old.md": blob_sha("old")}
+    real_get = fake.get
+
+    def get(url, params=None, **kw):
+        if "/contents/" in url:
+            fake.calls.append(("GET", url))
+            assert params == {"ref": "c0"}
+            sha = hidden.get(url.split("/contents/", 1)[1])
+            return DummyResp(200, {"type": "file", "sha": sha}) if sha else DummyResp(404)
+        resp = real_get(url, **kw)
+        if "/git/trees/" in url:
+            resp._json["truncated"] = True
+        return resp
+
+    fake.get = get
+    resp = asyncio.run(write_to_repo(make_req({"repo": "owner/repo", "files": [
+        {"path": "docs/listed.md", "content": "new"},
+        {"path": "docs/hidden.md", "content": "same"},
+        {"path": "docs/hidden-old.md", "content": "new"},
+        {"path": "docs/added.md", "content": "added"},
+    ]})))
+
+    payload = json.loads(resp.get_body())
+    assert {f["path"]: f["action"] for f in payload["files"]} == {
+        "docs/listed.md": "updated",
+        "docs/hidden.md": "unchanged",
+        "docs/hidden-old.md": "updated",
+        "docs/added.md": "created",
+    }
+    assert sum(1 for c in fake.calls if "/contents/" in c[1]) == 3  # listed paths need no lookup
+
+
+def test_batch_on_empty_repo_falls_back_to_contents_api(monkeypatch):
+    fake = FakeGitData({})
+    install(monkeypatch, fake)
+    empty = {"message": "Git Repository is empty."}
+    fake.get = lambda url, **kw: DummyResp(409 if "/git/ref/heads/" in url else 404, empty)
+    puts = []
+
+    def put(url, json=None, **kw):
+        puts.append(url.rsplit("/contents/", 1)[1])
+        return DummyResp(201, {"content": {"html_url": "u"}, "commit": {"sha": f"c{len(puts)}"}})
+
+    fake.put = put
+    resp = asyncio.run(write_to_repo(make_req({"repo": "owner/repo", "files": [
+        {"path": "a.md", "content": "x"},
+        {"path": "b.md", "content": "y"},
+    ]})))
+
+    payload = json.loads(resp.get_body())
+    assert resp.status_code == 200 and payload["action"] == "committed"
+    assert puts == ["a.md", "b.md"] and payload["commit_sha"] == "c2"
+    assert [(f["action"], f["commit_sha"]) for f in payload["files"]] == [("created", "c1"), ("created", "c2")]
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import function_app
+from function_app import write_to_repo  # type: ignore
+from test_write_to_repo_batch import DummyResp, FakeGitData, install, make_req
+
+
+def write_all(bodies):
+    async def main():
+        return await asyncio.gather(*(write_to_repo(make_req(body)) for body in bodies))
+
+    return [json.loads(resp.get_body()) for resp in asyncio.run(main())]
+
+
+def test_burst_of_writes_becomes_one_commit(monkeypatch):
+    monkeypatch.setenv("WRITE_COALESCE_WINDOW_MS", "50")
+    fake = FakeGitData({"docs/old.md": "old"})
+    install(monkeypatch, fake)
+
+    results = write_all([
+        {"repo": "owner/repo", "path": "docs/a.md", "content": "A", "commit_message": "Add a"},
+        {"repo": "owner/repo", "path": "docs/b.md", "content": "B"},
+        {"repo": "owner/repo", "path": "docs/old.md", "content": "old"},
+    ])
+
+    assert [c for c in fake.calls if c[0] != "GET"] == [
+        ("POST", "https://api.github.com/repos/owner/repo/git/trees"),
+        ("POST", "https://api.github.com/repos/owner/repo/git/commits"),
+        ("PATCH", "https://api.github.com/repos/owner/repo/git/refs/heads/main"),
+    ]
+    assert {r["commit_sha"] for r in results} == {"c1"}
+    assert [r["action"] for r in results] == ["created", "created", "unchanged"]
+    assert all(r["coalesced_writes"] == 3 for r in results)
+    assert {e["path"] for e in fake.trees["t1"]} == {"docs/a.md", "docs/b.md"}
+
+
+def test_last_write_wins_per_path(monkeypatch):
+    monkeypatch.setenv("WRITE_COALESCE_WINDOW_MS", "50")
+    fake = FakeGitData({})
+    install(monkeypatch, fake)
+
+    results = write_all([
+        {"repo": "owner/repo", "path": "docs/a.md", "content": "first"},
+        {"repo": "owner/repo", "path": "docs/a.md", "content": "second"},
+    ])
+
+    assert [r["action"] for r in results] == ["superseded", "created"]
+    assert [e["content"] for e in fake.trees["t1"]] == ["second"]
+    assert fake.commits["c1"] == "t1"
+
+
+def test_branches_flush_separately_and_failures_reach_every_caller(monkeypatch):
+    monkeypatch.setenv("WRITE_COALESCE_WINDOW_MS", "50")
+    fake = FakeGitData({})
+    install(monkeypatch, fake)
+    fake.patch = lambda url, json=None, **kw: DummyResp(403, {"message": "Resource not accessible"})
+
+    results = write_all([
+        {"repo": "owner/repo", "path": "a.md", "content": "x"},
+        {"repo": "owner/repo", "path": "b.md", "content": "y"},
+        {"repo": "owner/repo", "path": "c.md", "content": "z", "branch": "dev"},
+    ])
+
+    assert [r["status"] for r in results] == ["error"] * 3
+    assert sum(1 for c in fake.calls if c == ("POST", "https://api.github.com/repos/owner/repo/git/commits")) == 2
+
+
+def test_max_wait_caps_the_debounce(monkeypatch):
+    monkeypatch.setenv("WRITE_COALESCE_WINDOW_MS", "10000")
+    monkeypatch.setenv("WRITE_COALESCE_MAX_WAIT_MS", "100")
+    install(monkeypatch, FakeGitData({}))
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        resp = await write_to_repo(make_req({"repo": "owner/repo", "path": "a.md", "content": "x"}))
+        return resp, loop.time() - started
+
+    resp, elapsed = asyncio.run(main())
+    assert resp.status_code == 200 and elapsed < 2
+
+
+def test_empty_repo_falls_back_to_contents_api(monkeypatch):
+    monkeypatch.setenv("WRITE_COALESCE_WINDOW_MS", "50")
+    fake = FakeGitData({})
+    install(monkeypatch, fake)
+    empty = {"message": "Git Repository is empty."}
+    fake.get = lambda url, **kw: DummyResp(409 if "/git/ref/heads/" in url else 404, empty)
+    puts = []
+
+    def put(url, json=None, **kw):
+        puts.append(url.rsplit("/contents/", 1)[1])
+        return DummyResp(201, {"content": {"html_url": "u"}, "commit": {"sha": f"c{len(puts)}"}})
+
+    fake.put = put
+    results = write_all([
+        {"repo": "owner/repo", "path": "a.md", "content": "x"},
+        {"repo": "owner/repo", "path": "b.md", "content": "y"},
+    ])
+
+    assert [r["status"] for r in results] == ["ok", "ok"]
+    assert [r["commit_sha"] for r in results] == ["c1", "c2"] and puts == ["a.md", "b.md"]
+
+
+def test_unexpected_flush_errors_are_reported_as_github_errors(monkeypatch):
+    monkeypatch.setenv("WRITE_COALESCE_WINDOW_MS", "50")
+    install(monkeypatch, FakeGitData({}))
+
+    async def broken(*args, **kwargs):
+        raise KeyError("sha")
+
+    monkeypatch.setattr(function_app, "_commit_files", broken)
+    resp = asyncio.run(write_to_repo(make_req({"repo": "owner/repo", "path": "a.md", "content": "x"})))
+
+    assert resp.status_code == 502
+    assert "KeyError" in json.loads(resp.get_body())["error"]
@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import json
+import os
+import azure.functions as func
+import function_app
+from function_app import write_to_repo  # type: ignore
+
+
+class DummyResp:
+    def __init__(self, status_code: int, json_obj=None, headers=None):
+        self.status_code = status_code
+        self._json = json_obj or {}
+        self.text = json.dumps(self._json)
+        self.headers = headers or {}
+
+    def json(self):
+        return self._json
+
+
+def blob_sha(text: str) -> str:
+    data = text.encode("utf-8")
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class FakeGitHub:
+    """Branch with one file; the ref endpoint honours If-None-Match."""
+
+    def __init__(self, files: dict):
+        self.files = {p: blob_sha(c) for p, c in files.items()}
+        self.calls = []
+        self.put_parent = "c1"
+
+    def get(self, url, headers=None, **kw):
+        kind = url.split("/repos/owner/repo/", 1)[1].split("/")[0:2]
+        self.calls.append(("GET", "/".join(kind)))
+        if "/git/ref/heads/" in url:
+            if (headers or {}).get("If-None-Match") == '"etag-1"':
+                return DummyResp(304)
+            return DummyResp(200, {"object": {"sha": "c1"}}, headers={"ETag": '"etag-1"'})
+        if "/git/commits/" in url:
+            return DummyResp(200, {"tree": {"sha": "t1"}})
+        if "/git/trees/" in url:
+            tree = [{"path": p, "mode": "100644", "type": "blob", "sha": s} for p, s in self.files.items()]
+            return DummyResp(200, {"tree": tree, "truncated": False})
+        return DummyResp(404)
+
+    def put(self, url, json=None, **kw):
+        self.calls.append(("PUT", json.get("sha")))
+        return DummyResp(200, {
+            "content": {"html_url": "https://github.com/owner/repo/blob/main/docs/file.md"},
+            "commit": {"sha": "c2", "tree": {"sha": "t2"}, "parents": [{"sha": self.put_parent}]},
+        })
+
+
+class FakeSession:
+    def __init__(self, fake):
+        self.fake = fake
+
+    async def request(self, method, url, **kw):
+        return getattr(self.fake, method.lower())(url, **kw)
+
+
+def install(monkeypatch, fake):
+    monkeypatch.setattr(function_app, "_github_session", lambda: FakeSession(fake))
+    function_app._branch_snapshots.clear()
+    os.environ["GITHUB_TOKEN"] = "testtoken"
+
+
+def make_req(content: str):
+    return func.HttpRequest(
+        method="POST",
+        url="http://localhost/api/write_to_repo",
+        params={},
+        body=json.dumps({"repo": "owner/repo", "path": "docs/file.md", "content": content}).encode("utf-8"),
+    )
+
+
+def test_identical_content_is_not_committed(monkeypatch):
+    fake = FakeGitHub({"docs/file.md": "same"})
+    install(monkeypatch, fake)
+    payload = json.loads(asyncio.run(write_to_repo(make_req("same"))).get_body())
+    assert payload["action"] == "unchanged"
+    assert not [c for c in fake.calls if c[0] == "PUT" or c[1].startswith("contents")]
+
+
+def test_snapshot_supplies_sha_and_is_revalidated_with_etag(monkeypatch):
+    fake = FakeGitHub({"docs/file.md": "old"})
+    install(monkeypatch, fake)
+    first = json.loads(asyncio.run(write_to_repo(make_req("new"))).get_body())
+    assert first["action"] == "updated"
+    assert ("PUT", blob_sha("old")) in fake.calls
+    assert not [c for c in fake.calls if c[1].startswith("contents")]
+
+    # Second request: ref answers 304, tree is not fetched again, and the
+    # snapshot already knows the blob we just wrote.
+    fake.calls.clear()
+    second = json.loads(asyncio.run(write_to_repo(make_req("new"))).get_body())
+    assert second["action"] == "unchanged"
+    assert fake.calls == [("GET", "git/ref")]
+
+
+def test_snapshot_is_dropped_when_another_commit_landed_first(monkeypatch):
+    fake = FakeGitHub({"docs/file.md": "old"})
+    install(monkeypatch, fake)
+    fake.put_parent = "c1b"  # GitHub applied our write on top of someone else's commit
+    asyncio.run(write_to_repo(make_req("new")))
+    assert ("owner/repo", "main") not in function_app._branch_snapshots
+
+    # The next request rebuilds the snapshot instead of trusting a stale tree.
+    fake.calls.clear()
+    asyncio.run(write_to_repo(make_req("newer")))
+    assert ("GET", "git/trees") in fake.calls